@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Mobility.settings')
 
 application = get_asgi_application()
+
+# Connect to Document AI before the first OCR request arrives.
+from MobilityAnalyzer.analyze import start_client_warm_up  # noqa: E402
+
+start_client_warm_up()
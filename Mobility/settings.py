@@ -17,6 +17,21 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 
+LOCATIONS_FILE = os.path.join(DATA_DIR, 'ottoman_locations.xlsx')
+
+# Persistent caches of the OCR and LLM results
+CACHE_DIR = BASE_DIR / 'cache'
+
+CACHE_DATABASE = CACHE_DIR / 'analysis_cache.sqlite3'
+
+OCR_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+LATINIZATION_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+TRANSLATION_MEMORY_MAX_BYTES = 20 * 1024 * 1024
+
+EXTRACTION_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -87,6 +102,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # The page worker threads and the web server write to the database at the same time:
+        # a writer waits up to timeout seconds for the lock, and transactions take it when they begin,
+        # so a transaction that read first cannot fail to upgrade to a write.
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Tests of the worker threads need a database file; an in-memory one cannot be shared by threads.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
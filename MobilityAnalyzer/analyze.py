@@ -1,15 +1,49 @@
+import difflib
+import hashlib
 import json
-import mimetypes
+import logging
 import os
+import math
+import queue
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import anthropic
 import anthropic.types
 import environ
+import grpc
+import httpx
 from django.http import JsonResponse
 from google.api_core.client_options import ClientOptions
 from google.cloud import documentai_v1beta3 as documentai
 from google.oauth2 import service_account
-from Mobility.settings import BASE_DIR
-from MobilityAnalyzer.prompts import LATINIZATION_SYSTEM_PROMPT, STRUCTURED_DATA_EXTRACTION_SYSTEM_PROMPT
+from Mobility.settings import (
+    BASE_DIR,
+    CACHE_DATABASE,
+    EXTRACTION_CACHE_MAX_BYTES,
+    LATINIZATION_CACHE_MAX_BYTES,
+    OCR_CACHE_MAX_BYTES,
+    TRANSLATION_MEMORY_MAX_BYTES
+)
+from MobilityAnalyzer.cache import PersistentCache
+from MobilityAnalyzer.json_stream import JSONArrayStreamParser
+from MobilityAnalyzer.routing import RoutingStats, extraction_problem, latinization_problem
+from MobilityAnalyzer.segmenter import segment_appointments
+from MobilityAnalyzer.translation_memory import (
+    LATINIZED_LINE_SEPARATOR,
+    TranslationMemory,
+    join_latinized_lines,
+    latinized_prefix,
+    split_latinized_lines
+)
+from MobilityAnalyzer.prompts import (
+    LATINIZATION_SYSTEM_PROMPT,
+    STRUCTURED_DATA_EXTRACTION_EXAMPLES,
+    STRUCTURED_DATA_EXTRACTION_SYSTEM_PROMPT
+)
+
+logger = logging.getLogger(__name__)
 
 env = environ.Env()
 try:
@@ -18,91 +52,798 @@ except FileNotFoundError:
     raise FileNotFoundError("Please create an .env file in the root directory of the project.")
 
 
-def initialize_claude():
+def initialize_claude(transport: httpx.BaseTransport = None) -> anthropic.Anthropic:
     """
-    Initializes the Claude client.
+    Initializes a Claude client with its own pool of keep-alive HTTP connections.
+    Pool size and timeouts are read from the .env file.
+    Args:
+        transport: HTTP transport to send the requests through, e.g. a fake one in tests.
+        By default, a connection pool is created.
     Return:
          The Claude client.
     """
     try:
+        if transport is None:
+            transport = httpx.HTTPTransport(limits=httpx.Limits(
+                max_connections=env.int("CLAUDE_MAX_CONNECTIONS", default=20),
+                max_keepalive_connections=env.int("CLAUDE_MAX_KEEPALIVE_CONNECTIONS", default=10),
+                keepalive_expiry=env.float("CLAUDE_KEEPALIVE_EXPIRY", default=60.0)
+            ))
+        http_client = anthropic.DefaultHttpxClient(
+            transport=transport,
+            timeout=httpx.Timeout(env.float("CLAUDE_TIMEOUT", default=120.0),
+                                  connect=env.float("CLAUDE_CONNECT_TIMEOUT", default=10.0))
+        )
         claude_client_initialized = anthropic.Anthropic(
-            api_key=env("CLAUDE_KEY")
+            api_key=env("CLAUDE_KEY"),
+            http_client=http_client
         )
         return claude_client_initialized
     except Exception:
         raise Exception("Failed to initialize the Claude client.")
 
 
-def document_ai_ocr(file_path: str, cloud_key_path: str = env("GOOGLE_CLOUD_KEY_PATH")) -> str:
+_claude_client = None
+_claude_client_lock = threading.Lock()
+
+
+def get_claude_client() -> anthropic.Anthropic:
     """
-    Extracts text from an Image/png file using the Document AI API of Google.
+    Returns the Claude client shared by the whole process, creating it on first use.
+    Reusing it keeps its HTTP connections (and their TLS sessions) alive between requests.
+    Return:
+         The Claude client.
+    """
+    global _claude_client
+    if _claude_client is None:
+        with _claude_client_lock:
+            if _claude_client is None:
+                _claude_client = initialize_claude()
+    return _claude_client
+
+
+def reset_claude_client(transport: httpx.BaseTransport = None) -> None:
+    """
+    Closes the shared Claude client. The next get_claude_client call creates a new one.
+    Args:
+        transport: If given, the shared client is replaced right away by one using this
+        transport. Lets tests inject a fake transport.
+    """
+    global _claude_client
+    with _claude_client_lock:
+        if _claude_client is not None:
+            _claude_client.close()
+        _claude_client = initialize_claude(transport) if transport is not None else None
+
+
+CLAUDE_MODEL = "claude-3-5-sonnet-20240620"
+
+# Short inputs are first sent to the fast model, and escalated to CLAUDE_MODEL
+# only when its answer fails a quality check. Set MODEL_ROUTING=false to always use CLAUDE_MODEL.
+MODEL_ROUTING = env.bool("MODEL_ROUTING", default=True)
+CLAUDE_FAST_MODEL = env("CLAUDE_FAST_MODEL", default="claude-3-haiku-20240307")
+ROUTING_MAX_INPUT_CHARACTERS = env.int("ROUTING_MAX_INPUT_CHARACTERS", default=1500)
+ROUTING_MAX_NOT_SPECIFIED_RATIO = env.float("ROUTING_MAX_NOT_SPECIFIED_RATIO", default=0.6)
+
+routing_stats = RoutingStats()
+
+LATINIZATION_USER_PROMPT = "Transliterate this Ottoman Turkish text (may contain OCR errors): "
+
+# Beta header enabling the cache_control markers on the static prompt blocks.
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+
+# Prompt cache reads and writes reported by Claude since the start of the process, per stage.
+_prompt_cache_usage = defaultdict(Counter)
+_prompt_cache_usage_lock = threading.Lock()
+
+
+def cacheable_system_prompt(*blocks: str) -> list:
+    """
+    System prompt made of the given static text blocks. The last block is marked as a
+    cache breakpoint, so Claude caches the whole prompt up to it and later requests only
+    read it from the cache. Prompts shorter than the model's minimum cacheable length are not cached.
+    """
+    system = [{"type": "text", "text": block} for block in blocks]
+    system[-1]["cache_control"] = {"type": "ephemeral"}
+    return system
+
+
+def record_prompt_cache_usage(stage: str, usage: anthropic.types.Usage) -> None:
+    """
+    Logs and counts the input tokens of a response read from, and written to, the prompt cache.
+    Args:
+        stage: The step the request was made for, e.g. latinization.
+        usage: The usage reported in Claude's response.
+    """
+    cache_read_tokens = getattr(usage, 'cache_read_input_tokens', None) or 0
+    cache_write_tokens = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    with _prompt_cache_usage_lock:
+        _prompt_cache_usage[stage].update(requests=1, input_tokens=usage.input_tokens,
+                                          cache_read_input_tokens=cache_read_tokens,
+                                          cache_creation_input_tokens=cache_write_tokens)
+    logger.info("%s prompt cache: %d tokens read, %d tokens written, %d uncached input tokens.",
+                stage.capitalize(), cache_read_tokens, cache_write_tokens, usage.input_tokens)
+
+
+def prompt_cache_stats() -> dict:
+    """
+    Prompt cache reads and writes since the start of the process.
+    Returns:
+         Dict from each stage to its number of requests and their input, cache read and cache write tokens.
+    """
+    with _prompt_cache_usage_lock:
+        return {stage: dict(usage) for stage, usage in _prompt_cache_usage.items()}
+
+
+# Long pages are latinized in chunks of at most this many lines (0 sends the whole page at once),
+# with at most LATINIZATION_MAX_CONCURRENCY chunks in flight.
+LATINIZATION_CHUNK_LINES = env.int("LATINIZATION_CHUNK_LINES", default=15)
+LATINIZATION_MAX_CONCURRENCY = env.int("LATINIZATION_MAX_CONCURRENCY", default=4)
+
+# Appointments are extracted in batches of this many appointment blocks (0 sends the whole text at once),
+# with at most EXTRACTION_MAX_CONCURRENCY batches in flight.
+EXTRACTION_BATCH_BLOCKS = env.int("EXTRACTION_BATCH_BLOCKS", default=4)
+EXTRACTION_MAX_CONCURRENCY = env.int("EXTRACTION_MAX_CONCURRENCY", default=4)
+
+# OCR'ed texts keyed by the SHA-256 of the image and the processor name.
+ocr_cache = PersistentCache(CACHE_DATABASE, 'ocr_results', OCR_CACHE_MAX_BYTES)
+
+# Claude latinization messages keyed by the hashes of the OCR text and the prompts, and the model.
+latinization_cache = PersistentCache(CACHE_DATABASE, 'latinization_results', LATINIZATION_CACHE_MAX_BYTES)
+
+# Latinized lines keyed by the hash of their OCR line, the model and the prompts.
+translation_memory = TranslationMemory(CACHE_DATABASE, 'translation_memory', TRANSLATION_MEMORY_MAX_BYTES)
+
+# Extractions of single appointment blocks keyed by the hashes of the block and the prompt, and the model.
+extraction_cache = PersistentCache(CACHE_DATABASE, 'extraction_results', EXTRACTION_CACHE_MAX_BYTES)
+
+_document_ai_clients = {}
+_document_ai_clients_lock = threading.Lock()
+
+
+def get_document_ai_client(cloud_key_path: str = env("GOOGLE_CLOUD_KEY_PATH"),
+                           location: str = env("LOCATION")) -> documentai.DocumentProcessorServiceClient:
+    """
+    Returns the Document AI client for the given key and location, creating it on first use.
+    The service-account key is read once, and the client's gRPC channel is reused by every OCR call.
     Args:
         cloud_key_path: The path to the Google Cloud API key.
-        file_path: The (local) path to the Image file to be OCR'ed.
+        location: The location of the Document AI processor, e.g. eu.
     Return:
-         OCR'ed raw text.
+         The Document AI client.
+    """
+    api_endpoint = f"{location}-documentai.googleapis.com"
+    key = (str(cloud_key_path), api_endpoint)
+    gc_client = _document_ai_clients.get(key)
+    if gc_client is None:
+        with _document_ai_clients_lock:
+            gc_client = _document_ai_clients.get(key)
+            if gc_client is None:
+                gc_credentials = service_account.Credentials.from_service_account_file(str(cloud_key_path))
+                gc_client = documentai.DocumentProcessorServiceClient(
+                    credentials=gc_credentials,
+                    client_options=ClientOptions(api_endpoint=api_endpoint))
+                _document_ai_clients[key] = gc_client
+    return gc_client
+
+
+@lru_cache(maxsize=1)
+def document_ai_processor_name() -> str:
+    """
+    The full resource name of the Document AI processor set in the .env file.
+    """
+    return f'projects/{env("PROJECT_ID")}/locations/{env("LOCATION")}/processors/{env("PROCESSOR_ID")}'
+
+
+def warm_up_document_ai(cloud_key_path: str = env("GOOGLE_CLOUD_KEY_PATH"), timeout: float = 10.0) -> None:
+    """
+    Creates the Document AI client and waits until its gRPC channel is connected,
+    so the first OCR request does not pay for it. Failures are logged, not raised.
+    Args:
+        cloud_key_path: The path to the Google Cloud API key.
+        timeout: Maximum seconds to wait for the channel.
     """
     try:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError("The specified file does not exist.")
+        gc_client = get_document_ai_client(cloud_key_path)
+        document_ai_processor_name()
+        grpc.channel_ready_future(gc_client.transport.grpc_channel).result(timeout=timeout)
+    except Exception:
+        logger.exception("Failed to warm up the Document AI client.")
+
+
+def start_client_warm_up() -> None:
+    """
+    Warms up the Document AI client in a background thread. Called at server startup,
+    unless DOCUMENT_AI_WARM_UP is set to false in the .env file.
+    """
+    if not env.bool("DOCUMENT_AI_WARM_UP", default=True):
+        return
+    threading.Thread(target=warm_up_document_ai, name='document-ai-warm-up', daemon=True).start()
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def check_png_signature(image_content: bytes) -> None:
+    """
+    Checks that the content starts with the PNG signature.
+    Raises:
+        ValueError: If the content is not a PNG image.
+    """
+    if not image_content.startswith(PNG_SIGNATURE):
+        raise ValueError("The file is not a valid PNG file.")
+
+
+def read_png_file(file_path: str) -> bytes:
+    """
+    Reads an Image/png file to be OCR'ed.
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        ValueError: If the file is not a PNG file.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError("The specified file does not exist.")
+
+    # Check if the file is an image with PNG format.
+    if not file_path.lower().endswith('.png'):
+        raise ValueError("The file should be in PNG format.")
+
+    with open(file_path, 'rb') as file:
+        image_content = file.read()
+    check_png_signature(image_content)
+    return image_content
 
-        # Check if the file is an image with PNG format.
-        if not file_path.lower().endswith('.png'):
-            raise ValueError("The file should be in PNG format.")
 
-        # Check Mime type
-        mime_type = mimetypes.guess_type('image.png')[0]
-        if mime_type != 'image/png':
-            raise ValueError("The file is not a valid PNG file.")
+def read_uploaded_png(uploaded_file) -> bytes:
+    """
+    Reads an uploaded Image/png file chunk by chunk, without saving it to disk.
+    The signature is checked on the first chunk, so other files are rejected before being read.
+    Args:
+        uploaded_file: The uploaded file, from request.FILES.
+    Raises:
+        ValueError: If the file is not a PNG file.
+    """
+    chunks = uploaded_file.chunks()
+    first_chunk = next(chunks, b'')
+    check_png_signature(first_chunk)
+    # A page smaller than a chunk is returned without being copied.
+    return b''.join([first_chunk, *chunks])
 
-        with open(file_path, 'rb') as file:
-            image_content = file.read()
 
-        gc_client_options = ClientOptions(api_endpoint=f"{env('LOCATION')}-documentai.googleapis.com")
-        gc_credentials = service_account.Credentials.from_service_account_file(cloud_key_path)
-        gc_client = documentai.DocumentProcessorServiceClient(credentials=gc_credentials,
-                                                              client_options=gc_client_options)
-        processor_name = f'projects/{env("PROJECT_ID")}/locations/{env("LOCATION")}/processors/{env("PROCESSOR_ID")}'
+def ocr_cache_key(image_content: bytes) -> str:
+    """
+    Cache key of the OCR result of an image.
+    """
+    return f"{hashlib.sha256(image_content).hexdigest()}:{document_ai_processor_name()}"
 
-        raw_image = documentai.RawDocument(content=image_content,
-                                           mime_type='image/png')
-        request = documentai.ProcessRequest(name=processor_name,
-                                            raw_document=raw_image)
-        process_result = gc_client.process_document(request=request)
+
+def ocr_request(image_content: bytes) -> documentai.ProcessRequest:
+    """
+    Document AI request OCR'ing the given PNG image.
+    """
+    raw_image = documentai.RawDocument(content=image_content,
+                                       mime_type='image/png')
+    return documentai.ProcessRequest(name=document_ai_processor_name(),
+                                     raw_document=raw_image)
+
+
+def document_ai_ocr_content(image_content: bytes, cloud_key_path: str = env("GOOGLE_CLOUD_KEY_PATH")) -> str:
+    """
+    Extracts text from the content of an Image/png file using the Document AI API of Google.
+    The results are cached by the content of the image, so a page is sent only once.
+    Args:
+        image_content: The PNG image to be OCR'ed.
+        cloud_key_path: The path to the Google Cloud API key.
+    Return:
+         OCR'ed raw text.
+    """
+    try:
+        check_png_signature(image_content)
+
+        # The same page is often uploaded again during a correction session.
+        cache_key = ocr_cache_key(image_content)
+        cached_text = ocr_cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+
+        gc_client = get_document_ai_client(cloud_key_path)
+        process_result = gc_client.process_document(request=ocr_request(image_content))
 
         # Extract the OCR text
         ocred_text = process_result.document.text
+        ocr_cache.put(cache_key, ocred_text)
         return ocred_text
     except Exception as e:
         raise Exception("Failed to OCR the document using Google Cloud AI: " + str(e))
 
 
-def latinize_ocr_text(claude_client: anthropic, ottoman_text: str) -> anthropic.types.Message:
+def document_ai_ocr(file_path: str, cloud_key_path: str = env("GOOGLE_CLOUD_KEY_PATH")) -> str:
     """
-    Transliterates OCR'ed Ottoman Turkish text to Latin script using Claude.
+    Extracts text from an Image/png file using the Document AI API of Google.
+    Args:
+        cloud_key_path: The path to the Google Cloud API key.
+        file_path: The (local) path to the Image file to be OCR'ed.
+    Return:
+         OCR'ed raw text.
+    """
+    try:
+        image_content = read_png_file(file_path)
+    except Exception as e:
+        raise Exception("Failed to OCR the document using Google Cloud AI: " + str(e))
+    return document_ai_ocr_content(image_content, cloud_key_path)
+
+
+def ocr_image(image) -> str:
+    """
+    OCRs a page given either as the content of a PNG file or as the path to one.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return document_ai_ocr_content(bytes(image))
+    return document_ai_ocr(image)
+
+
+def latinization_version(model: str) -> str:
+    """
+    Identifies the model and prompts of a latinization. Editing the prompts invalidates
+    the cached latinizations and the translation memory.
+    """
+    prompt_hash = hashlib.sha256((LATINIZATION_SYSTEM_PROMPT + LATINIZATION_USER_PROMPT).encode('utf-8')).hexdigest()
+    return f"{model}:{prompt_hash}"
+
+
+def latinization_cache_key(ottoman_text: str, model: str) -> str:
+    """
+    Cache key of a latinization.
+    """
+    return f"{hashlib.sha256(ottoman_text.encode('utf-8')).hexdigest()}:{latinization_version(model)}"
+
+
+def latinization_request(ottoman_text: str, model: str = CLAUDE_MODEL) -> dict:
+    """
+    Parameters of the Claude request latinizing the given text.
+    """
+    return dict(
+        model=model,
+        max_tokens=3000,
+        temperature=0.0,
+        system=cacheable_system_prompt(LATINIZATION_SYSTEM_PROMPT),
+        messages=[
+            {
+                "role": "user",
+                "content": LATINIZATION_USER_PROMPT + ottoman_text
+            }
+        ],
+        extra_headers={"anthropic-beta": PROMPT_CACHING_BETA}
+    )
+
+
+def request_latinization(claude_client: anthropic, ottoman_text: str,
+                         model: str = CLAUDE_MODEL) -> anthropic.types.Message:
+    """
+    Sends OCR'ed Ottoman Turkish text to Claude for transliteration.
     Args:
         ottoman_text: OCR'ed Ottoman Turkish text.
         claude_client: The Claude client.
+        model: The Claude model to use.
     Return:
          Latinized text message from Claude.
     """
     try:
-        latinized_text = claude_client.messages.create(
-            model="claude-3-5-sonnet-20240620",
-            max_tokens=3000,
-            temperature=0.0,
-            system=LATINIZATION_SYSTEM_PROMPT,
-            messages=[
-                {
-                    "role": "user",
-                    "content": "Transliterate this Ottoman Turkish text (may contain OCR errors): " + ottoman_text
-                }
-            ]
-        )
+        latinized_text = claude_client.messages.create(**latinization_request(ottoman_text, model))
+    except Exception:
+        raise Exception("Failed to Latinize the text using Claude.")
+    record_prompt_cache_usage('latinization', latinized_text.usage)
+    return latinized_text
+
+
+def is_routed(text: str) -> bool:
+    """
+    Checks if the text is short enough to be tried on the fast model first.
+    """
+    return MODEL_ROUTING and len(text) <= ROUTING_MAX_INPUT_CHARACTERS
+
+
+def log_escalation(stage: str, problem: str) -> None:
+    routing_stats.record(stage, escalated=problem is not None)
+    if problem is not None:
+        logger.info("%s escalated from %s to %s: %s. Escalation rate: %.0f%%", stage.capitalize(),
+                    CLAUDE_FAST_MODEL, CLAUDE_MODEL, problem, 100 * routing_stats.escalation_rate(stage))
+
+
+def answering_models(text: str) -> list:
+    """
+    The models whose answers are used for the text, preferred first: CLAUDE_MODEL,
+    then the fast model if the text is routed. Cached answers are only served from these.
+    """
+    return [CLAUDE_MODEL, CLAUDE_FAST_MODEL] if is_routed(text) else [CLAUDE_MODEL]
+
+
+def assembled_model(models) -> str:
+    """
+    The model a text assembled from the answers of the given models is attributed to:
+    CLAUDE_MODEL if it gave every answer, otherwise the first other model.
+    """
+    return next((model for model in models if model != CLAUDE_MODEL), CLAUDE_MODEL)
+
+
+def fast_latinization_problem(ottoman_text: str, latinized_text: anthropic.types.Message):
+    """
+    Why the fast model's latinization should be escalated to CLAUDE_MODEL, or None if it passes the quality check.
+    """
+    if latinized_text.stop_reason != "end_turn":
+        return "truncated latinization"
+    return latinization_problem(ottoman_text, extract_text_from_claude_response(latinized_text))
+
+
+def route_latinization(claude_client: anthropic, ottoman_text: str) -> anthropic.types.Message:
+    """
+    Latinizes a short text with the fast model, and a long one, or one whose fast latinization
+    is truncated or does not have one line per OCR line, with CLAUDE_MODEL.
+    Args:
+        ottoman_text: OCR'ed Ottoman Turkish text.
+        claude_client: The Claude client.
+    Return:
+         Latinized text message from Claude.
+    """
+    if not is_routed(ottoman_text):
+        return request_latinization(claude_client, ottoman_text)
 
+    latinized_text = request_latinization(claude_client, ottoman_text, CLAUDE_FAST_MODEL)
+    problem = fast_latinization_problem(ottoman_text, latinized_text)
+    log_escalation('latinization', problem)
+    if problem is None:
         return latinized_text
+    return request_latinization(claude_client, ottoman_text)
+
+
+def text_message(text: str, model: str, usage: anthropic.types.Usage = None,
+                 stop_reason: str = "end_turn") -> anthropic.types.Message:
+    """
+    Wraps a text, e.g. one assembled from several answers, in a Claude message.
+    """
+    return anthropic.types.Message(
+        id="msg_assembled",
+        type="message",
+        role="assistant",
+        model=model,
+        content=[anthropic.types.TextBlock(type="text", text=text)],
+        stop_reason=stop_reason,
+        stop_sequence=None,
+        usage=usage or anthropic.types.Usage(input_tokens=0, output_tokens=0)
+    )
+
+
+def unseen_ocr_lines(ocr_lines: list, known_lines: dict) -> list:
+    """
+    The distinct non-empty lines missing from the translation memory, stripped, in order.
+    """
+    return list(dict.fromkeys(line.strip() for index, line in enumerate(ocr_lines)
+                              if line.strip() and index not in known_lines))
+
+
+def learn_latinized_page(ottoman_text: str, latinized_text: anthropic.types.Message) -> None:
+    """
+    Adds the lines of a complete latinization to the translation memory,
+    under the version of the model that latinized them.
+    """
+    if latinized_text.stop_reason == "end_turn":
+        translation_memory.learn_lines(ottoman_text.split("\n"), split_latinized_lines(
+            extract_text_from_claude_response(latinized_text)), latinization_version(latinized_text.model))
+
+
+def lookup_known_lines(ottoman_text: str, ocr_lines: list) -> tuple:
+    """
+    Finds the lines of the text in the translation memory, among the lines learnt from
+    the answering models of the text, preferring those of CLAUDE_MODEL.
+    Returns:
+         A (dict from the index of each known line to its latinization, model of the known lines) tuple.
+    """
+    known_lines = {}
+    line_models = {}
+    # CLAUDE_MODEL comes last, so its lines replace those of the fast model.
+    for model in reversed(answering_models(ottoman_text)):
+        for index, latinized_line in translation_memory.lookup_lines(ocr_lines, latinization_version(model)).items():
+            known_lines[index] = latinized_line
+            line_models[index] = model
+    return known_lines, assembled_model(line_models.values())
+
+
+def stitch_latinized_lines(ocr_lines: list, known_lines: dict, known_model: str, unseen_lines: list,
+                           partial_response: anthropic.types.Message):
+    """
+    Assembles the latinization of a text from the translation memory and Claude's
+    latinization of its unseen lines, which are learnt on the way.
+    Args:
+        ocr_lines: Lines of the OCR text.
+        known_lines: The latinized lines found in the translation memory, by index.
+        known_model: The model of the known lines, as returned by lookup_known_lines.
+        unseen_lines: The other lines, as returned by unseen_ocr_lines.
+        partial_response: Claude's latinization of the unseen lines, or None if there are none.
+    Return:
+         Latinized text message, attributed to the models of both parts,
+         or None if Claude's answer does not have one line per unseen line.
+    """
+    learned_lines = {}
+    usage = None
+    models = [known_model]
+    if partial_response is not None:
+        if partial_response.stop_reason != "end_turn":
+            return None
+        learned_lines = translation_memory.learn_lines(unseen_lines, split_latinized_lines(
+            extract_text_from_claude_response(partial_response)), latinization_version(partial_response.model))
+        if learned_lines is None:
+            return None
+        usage = partial_response.usage
+        models.append(partial_response.model)
+
+    logger.info("Latinized %d of %d lines from the translation memory.",
+                len(known_lines), len(known_lines) + len(unseen_lines))
+    latinized_lines = [known_lines[index] if index in known_lines else learned_lines.get(line.strip(), "")
+                       for index, line in enumerate(ocr_lines)]
+    return text_message(join_latinized_lines(latinized_lines), assembled_model(models), usage)
+
+
+def latinize_with_translation_memory(claude_client: anthropic, ottoman_text: str) -> anthropic.types.Message:
+    """
+    Latinizes the lines found in the translation memory from it, and sends only
+    the unseen lines to Claude. The answer is stitched back line by line.
+    If Claude does not return one line per unseen line, the whole text is sent instead.
+    Args:
+        ottoman_text: OCR'ed Ottoman Turkish text.
+        claude_client: The Claude client.
+    Return:
+         Latinized text message.
+    """
+    ocr_lines = ottoman_text.split("\n")
+    known_lines, known_model = lookup_known_lines(ottoman_text, ocr_lines)
+
+    if known_lines:
+        unseen_lines = unseen_ocr_lines(ocr_lines, known_lines)
+        partial_response = route_latinization(claude_client, "\n".join(unseen_lines)) if unseen_lines else None
+        latinized_text = stitch_latinized_lines(ocr_lines, known_lines, known_model, unseen_lines, partial_response)
+        if latinized_text is not None:
+            return latinized_text
+
+    latinized_text = route_latinization(claude_client, ottoman_text)
+    learn_latinized_page(ottoman_text, latinized_text)
+    return latinized_text
+
+
+def cached_latinization(ottoman_text: str):
+    """
+    The cached latinization of the text by one of its answering models, or None.
+    """
+    for model in answering_models(ottoman_text):
+        cached_message = latinization_cache.get(latinization_cache_key(ottoman_text, model))
+        if cached_message is not None:
+            logger.info("Latinization served from the cache. Hit rate: %.0f%%",
+                        100 * latinization_cache.hit_rate)
+            return anthropic.types.Message.model_validate_json(cached_message)
+    return None
+
+
+def cache_latinization(ottoman_text: str, latinized_text: anthropic.types.Message) -> None:
+    """
+    Caches a complete latinization under the model that produced it.
+    A truncated answer should be retried, not served again.
+    """
+    if latinized_text.stop_reason == "end_turn":
+        latinization_cache.put(latinization_cache_key(ottoman_text, latinized_text.model),
+                               latinized_text.model_dump_json())
+
+
+def latinize_ocr_text(claude_client: anthropic, ottoman_text: str) -> anthropic.types.Message:
+    """
+    Transliterates OCR'ed Ottoman Turkish text to Latin script using Claude.
+    Complete answers are cached, so a page that was already latinized is not sent again,
+    and lines already latinized on other pages are served from the translation memory.
+    Args:
+        ottoman_text: OCR'ed Ottoman Turkish text.
+        claude_client: The Claude client.
+    Return:
+         Latinized text message from Claude.
+    """
+    cached_message = cached_latinization(ottoman_text)
+    if cached_message is not None:
+        return cached_message
+
+    latinized_text = latinize_with_translation_memory(claude_client, ottoman_text)
+    cache_latinization(ottoman_text, latinized_text)
+    return latinized_text
+
+
+def latinization_chunks(ottoman_text: str, max_lines: int) -> list:
+    """
+    The non-empty line-aligned chunks a text is latinized in, see split_into_chunks.
+    A max_lines of 0 gives no chunks, i.e. the text is latinized at once.
+    """
+    if max_lines <= 0:
+        return []
+    return [chunk for chunk in split_into_chunks(ottoman_text, max_lines) if chunk.strip()]
+
+
+def normalized_latinization(latinized_text: anthropic.types.Message) -> str:
+    """
+    The lines of a latinization joined like in join_latinized_chunks, without a trailing line break.
+    """
+    return join_latinized_lines(split_latinized_lines(extract_text_from_claude_response(latinized_text)))
+
+
+def first_uncached_chunk(chunks: list):
+    """
+    The index of the first chunk without a cached latinization, if none of its lines are
+    in the translation memory either, so the whole chunk would be sent to Claude. Otherwise None.
+    """
+    for index, chunk in enumerate(chunks):
+        if cached_latinization(chunk) is None:
+            known_lines, _ = lookup_known_lines(chunk, chunk.split("\n"))
+            return None if known_lines else index
+    return None
+
+
+def stream_chunk_latinization(claude_client: anthropic, ottoman_text: str):
+    """
+    Transliterates OCR'ed Ottoman Turkish text with CLAUDE_MODEL in a streamed request, yielding the text
+    as Claude generates it. The fast model is not tried first, since a fast answer failing its quality check
+    could not be taken back once shown. Line breaks are held back until the text after them arrives,
+    see latinized_prefix. The complete answer is cached and added to the translation memory.
+    Args:
+        ottoman_text: OCR'ed Ottoman Turkish text.
+        claude_client: The Claude client.
+    Yields:
+         Pieces of the latinized text, in order. Joined, they give normalized_latinization of the answer.
+    """
+    generated_text = ""
+    sent_text = ""
+    try:
+        with claude_client.messages.stream(**latinization_request(ottoman_text)) as stream:
+            for text in stream.text_stream:
+                generated_text += text
+                prefix = latinized_prefix(generated_text)
+                if len(prefix) > len(sent_text) and prefix.startswith(sent_text):
+                    yield prefix[len(sent_text):]
+                    sent_text = prefix
+            latinized_text = stream.get_final_message()
     except Exception:
         raise Exception("Failed to Latinize the text using Claude.")
+    record_prompt_cache_usage('latinization', latinized_text.usage)
+
+    cache_latinization(ottoman_text, latinized_text)
+    learn_latinized_page(ottoman_text, latinized_text)
+    rest = normalized_latinization(latinized_text)[len(sent_text):]
+    if rest:
+        yield rest
+
+
+def latinize_chunks(claude_client: anthropic, chunks: list, max_concurrency: int = LATINIZATION_MAX_CONCURRENCY):
+    """
+    Latinizes the chunks concurrently with latinize_ocr_text, so each chunk is cached like a page,
+    and only its unseen lines are sent to Claude.
+    Args:
+        claude_client: The Claude client.
+        chunks: Chunks of OCR'ed Ottoman Turkish text.
+        max_concurrency: Maximum number of chunks latinized at the same time.
+    Yields:
+         The latinized text message of each chunk, in order, as soon as it and the chunks before it are done.
+    """
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(chunks))) as executor:
+        futures = [executor.submit(latinize_ocr_text, claude_client, chunk) for chunk in chunks]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # E.g. the browser went away, or a chunk failed: the chunks not started yet are not sent.
+            for future in futures:
+                future.cancel()
+
+
+def stream_latinization(claude_client: anthropic, ottoman_text: str, max_lines: int = LATINIZATION_CHUNK_LINES,
+                        max_concurrency: int = LATINIZATION_MAX_CONCURRENCY):
+    """
+    Transliterates OCR'ed Ottoman Turkish text to Latin script like latinize_page, yielding the text
+    as soon as it is ready. The first chunk that is neither cached nor partly in the translation memory
+    is streamed as Claude generates it, see stream_chunk_latinization, while the other chunks are latinized
+    concurrently by latinize_ocr_text, each yielded once it and the chunks before it are done.
+    Args:
+        ottoman_text: OCR'ed Ottoman Turkish text.
+        claude_client: The Claude client.
+        max_lines: Maximum number of lines in a chunk. 0 latinizes the whole text at once.
+        max_concurrency: Maximum number of chunks latinized at the same time, the streamed one included.
+    Yields:
+         Pieces of the latinized text, in order. Joined, they give the lines of latinize_page's text.
+    """
+    chunks = latinization_chunks(ottoman_text, max_lines)
+    if len(chunks) <= 1:
+        chunks = [ottoman_text]
+    streamed_chunk = first_uncached_chunk(chunks)
+    pool_size = max(max_concurrency - (streamed_chunk is not None), 1)
+
+    started = False
+    with ThreadPoolExecutor(max_workers=min(pool_size, len(chunks))) as executor:
+        futures = [None if index == streamed_chunk else executor.submit(latinize_ocr_text, claude_client, chunk)
+                   for index, chunk in enumerate(chunks)]
+        try:
+            for chunk, future in zip(chunks, futures):
+                pieces = stream_chunk_latinization(claude_client, chunk) if future is None \
+                    else [normalized_latinization(future.result())]
+                # Lines of consecutive chunks are separated like those of join_latinized_chunks.
+                separator = LATINIZED_LINE_SEPARATOR if started else ""
+                for piece in pieces:
+                    if piece:
+                        yield separator + piece
+                        separator = ""
+                        started = True
+        finally:
+            # E.g. the browser went away, or a chunk failed: the chunks not started yet are not sent.
+            for future in futures:
+                if future is not None:
+                    future.cancel()
+
+
+def split_into_chunks(ottoman_text: str, max_lines: int) -> list:
+    """
+    Splits a text into chunks of whole lines, as even in size as possible.
+    Args:
+        ottoman_text: OCR'ed Ottoman Turkish text.
+        max_lines: Maximum number of lines in a chunk.
+    Returns:
+         List of chunks, in the order of the text. Joined with a line break, they give back the text.
+    """
+    lines = ottoman_text.split("\n")
+    chunk_count = math.ceil(len(lines) / max_lines)
+    chunk_size = math.ceil(len(lines) / chunk_count)
+    return ["\n".join(lines[start:start + chunk_size]) for start in range(0, len(lines), chunk_size)]
+
+
+def latinize_ocr_text_in_chunks(claude_client: anthropic, ottoman_text: str,
+                                max_lines: int = LATINIZATION_CHUNK_LINES,
+                                max_concurrency: int = LATINIZATION_MAX_CONCURRENCY) -> anthropic.types.Message:
+    """
+    Latinizes a long text as line-aligned chunks sent concurrently, then joins the
+    latinized chunks in the order of the text. Each chunk gets its own max_tokens,
+    so a dense page is not truncated, and each chunk is cached like a page.
+    Args:
+        ottoman_text: OCR'ed Ottoman Turkish text.
+        claude_client: The Claude client.
+        max_lines: Maximum number of lines in a chunk.
+        max_concurrency: Maximum number of chunks latinized at the same time.
+    Return:
+         Latinized text message.
+    """
+    chunks = latinization_chunks(ottoman_text, max_lines)
+    if len(chunks) <= 1:
+        return latinize_ocr_text(claude_client, ottoman_text)
+
+    responses = list(latinize_chunks(claude_client, chunks, max_concurrency))
+    logger.info("Latinized %d lines in %d chunks.", len(ottoman_text.split("\n")), len(chunks))
+    return join_latinized_chunks(responses)
+
+
+def latinize_page(claude_client: anthropic, ottoman_text: str, chunk_lines: int = LATINIZATION_CHUNK_LINES,
+                  max_concurrency: int = LATINIZATION_MAX_CONCURRENCY) -> anthropic.types.Message:
+    """
+    Latinizes the OCR'ed text of a page, in chunks of at most chunk_lines lines, at most
+    max_concurrency of them at the same time, or in one request if chunk_lines is 0.
+    """
+    if chunk_lines > 0:
+        return latinize_ocr_text_in_chunks(claude_client, ottoman_text, chunk_lines, max_concurrency)
+    return latinize_ocr_text(claude_client, ottoman_text)
+
+
+def join_latinized_chunks(responses: list) -> anthropic.types.Message:
+    """
+    Joins the latinizations of consecutive chunks into one message.
+    Its stop reason is that of the first chunk that did not end its turn.
+    """
+    latinized_lines = []
+    for response in responses:
+        latinized_lines.extend(split_latinized_lines(extract_text_from_claude_response(response)))
+    usage = anthropic.types.Usage(input_tokens=sum(response.usage.input_tokens for response in responses),
+                                  output_tokens=sum(response.usage.output_tokens for response in responses))
+    stop_reason = next((response.stop_reason for response in responses
+                        if response.stop_reason != "end_turn"), "end_turn")
+    return text_message(join_latinized_lines(latinized_lines),
+                        assembled_model(response.model for response in responses), usage, stop_reason)
 
 
 def extract_text_from_claude_response(claude_response: anthropic.types.Message) -> str:
@@ -121,30 +862,40 @@ def extract_text_from_claude_response(claude_response: anthropic.types.Message)
     return extracted_text
 
 
-def extract_appointments(claude_client: anthropic, text: str):
+def extraction_request(text: str, model: str = CLAUDE_MODEL) -> dict:
+    """
+    Parameters of the Claude request extracting the appointments from the given text.
+    """
+    return dict(
+        model=model,
+        max_tokens=6000,
+        temperature=0.0,
+        system=cacheable_system_prompt(STRUCTURED_DATA_EXTRACTION_SYSTEM_PROMPT, STRUCTURED_DATA_EXTRACTION_EXAMPLES),
+        messages=[
+            {
+                "role": "user",
+                "content": """Please extract the necessary info and generate JSON from the following text """ + text
+            }
+        ],
+        extra_headers={"anthropic-beta": PROMPT_CACHING_BETA}
+    )
+
+
+def request_extraction(claude_client: anthropic, text: str, model: str = CLAUDE_MODEL) -> str:
     """
-    Extracts the OCR'ed and Latinized appointment text and extracts the necessary information.
+    Sends Latinized appointment text to Claude in a single request.
     Args:
         text: Latinized appointment text.
         claude_client: The Claude client.
+        model: The Claude model to use.
     Returns:
-         A json output containing the extracted information in the required format.
+         Claude's JSON answer, as text.
     """
     try:
-        message = claude_client.messages.create(
-            model="claude-3-5-sonnet-20240620",
-            max_tokens=6000,
-            temperature=0.0,
-            system=STRUCTURED_DATA_EXTRACTION_SYSTEM_PROMPT,
-            messages=[
-                {
-                    "role": "user",
-                    "content": """Please extract the necessary info and generate JSON from the following text """ + text
-                }
-            ]
-        )
+        message = claude_client.messages.create(**extraction_request(text, model))
     except Exception:
         raise Exception("Failed to extract the appointment data using Claude.")
+    record_prompt_cache_usage('extraction', message.usage)
 
     extracted_text = ""
     # Extract and print the response text
@@ -155,25 +906,390 @@ def extract_appointments(claude_client: anthropic, text: str):
     return extracted_text
 
 
-def end_to_end_process(file_path) -> JsonResponse:
+def route_extraction(claude_client: anthropic, text: str) -> tuple:
+    """
+    Extracts the appointments of a short text with the fast model, and those of a long text,
+    or of one whose fast extraction is not valid JSON or leaves too many fields not specified, with CLAUDE_MODEL.
+    Args:
+        text: Latinized appointment text.
+        claude_client: The Claude client.
+    Returns:
+         A (Claude's JSON answer as text, model that gave it) tuple.
+    """
+    if not is_routed(text):
+        return request_extraction(claude_client, text), CLAUDE_MODEL
+
+    extracted_text = request_extraction(claude_client, text, CLAUDE_FAST_MODEL)
+    problem = extraction_problem(extracted_text, ROUTING_MAX_NOT_SPECIFIED_RATIO)
+    log_escalation('extraction', problem)
+    if problem is None:
+        return extracted_text, CLAUDE_FAST_MODEL
+    return request_extraction(claude_client, text), CLAUDE_MODEL
+
+
+def parse_extraction(extracted_text: str) -> dict:
+    """
+    Parses Claude's JSON answer, ignoring any text around the JSON object.
+    Raises:
+        json.JSONDecodeError: If the answer does not contain a valid JSON object.
+    """
+    return json.loads(extracted_text[extracted_text.find('{'):extracted_text.rfind('}') + 1])
+
+
+def extraction_cache_key(block: str, model: str) -> str:
+    """
+    Cache key of the extraction of an appointment block. Editing the prompt invalidates the old entries.
+    """
+    prompt_hash = hashlib.sha256((STRUCTURED_DATA_EXTRACTION_SYSTEM_PROMPT +
+                                  STRUCTURED_DATA_EXTRACTION_EXAMPLES).encode('utf-8')).hexdigest()
+    return f"{hashlib.sha256(block.encode('utf-8')).hexdigest()}:{model}:{prompt_hash}"
+
+
+def cached_block_extraction(block: str):
+    """
+    The cached extraction of the block by one of its answering models, parsed, or None.
+    """
+    for model in answering_models(block):
+        cached_extraction = extraction_cache.get(extraction_cache_key(block, model))
+        if cached_extraction is not None:
+            return json.loads(cached_extraction)
+    return None
+
+
+def cache_block_extractions(blocks: list, extraction: dict, model: str) -> None:
+    """
+    Caches the extraction of each block under the model that extracted it, when the answer has
+    exactly one appointment per block and nothing else, so that the appointments can be told apart by block.
+    """
+    appointments = extraction.get('appointments')
+    if list(extraction) != ['appointments'] or not isinstance(appointments, list) or len(appointments) != len(blocks):
+        return
+    for block, appointment in zip(blocks, appointments):
+        extraction_cache.put(extraction_cache_key(block, model), json.dumps({'appointments': [appointment]}))
+
+
+def cached_block_batch(blocks: list):
+    """
+    The cached extractions of the blocks if every block has one, otherwise None.
+    """
+    extractions = [cached_block_extraction(block) for block in blocks]
+    if not blocks or None in extractions:
+        return None
+    return extractions
+
+
+def extraction_batches(text: str, batch_blocks: int) -> list:
+    """
+    Splits the text into appointment blocks, and the blocks into the batches sent in one request each.
+    A text with no more blocks than a batch is sent as is.
+    Args:
+        text: Latinized appointment text.
+        batch_blocks: Number of appointment blocks sent in a request. 0 sends the whole text at once.
+    Returns:
+         (blocks, text sent) tuples, in the order of the text.
+    """
+    blocks = segment_appointments(text) if batch_blocks > 0 else []
+    if len(blocks) <= batch_blocks:
+        return [(blocks, text)]
+    return [(blocks[start:start + batch_blocks], "\n".join(blocks[start:start + batch_blocks]))
+            for start in range(0, len(blocks), batch_blocks)]
+
+
+def extract_block_batch(claude_client: anthropic, blocks: list, text: str = None) -> list:
+    """
+    Extracts the appointments of a few blocks in one request, unless all of them are cached.
+    If Claude's answer is not valid JSON, each block is extracted on its own,
+    and the blocks that still fail are skipped.
+    Args:
+        blocks: Appointment blocks of a Latinized text.
+        claude_client: The Claude client.
+        text: The text sent for the blocks, by default the blocks joined, e.g. the whole text they were split from.
+    Returns:
+         List of the parsed answers, each a dict like {'appointments': [...]}.
+    """
+    cached_extractions = cached_block_batch(blocks)
+    if cached_extractions is not None:
+        return cached_extractions
+    text = "\n".join(blocks) if text is None else text
+    try:
+        extracted_text, model = route_extraction(claude_client, text)
+        extraction = parse_extraction(extracted_text)
+    except json.JSONDecodeError:
+        if len(blocks) > 1:
+            return [result for block in blocks for result in extract_block_batch(claude_client, [block])]
+        logger.warning("Skipped an appointment text Claude could not extract: %.80s", text)
+        return []
+    cache_block_extractions(blocks, extraction, model)
+    return [extraction]
+
+
+def merged_extraction_json(extractions: list) -> str:
+    """
+    Merges parsed extraction answers into the JSON output of extract_appointments,
+    which always has an 'appointments' list.
+    """
+    merged = merge_extractions(extractions)
+    merged.setdefault('appointments', [])
+    return json.dumps(merged, ensure_ascii=False)
+
+
+def merge_extractions(extractions: list) -> dict:
+    """
+    Merges parsed extraction answers, concatenating their lists in order,
+    e.g. the appointments (and dismissals) of consecutive batches.
+    """
+    merged = {}
+    for extraction in extractions:
+        for key, value in extraction.items():
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            else:
+                merged.setdefault(key, value)
+    return merged
+
+
+def extract_in_batches(claude_client: anthropic, text: str, batch_blocks: int = EXTRACTION_BATCH_BLOCKS,
+                       max_concurrency: int = EXTRACTION_MAX_CONCURRENCY):
+    """
+    Extracts the batches of appointment blocks of the text concurrently, see extraction_batches,
+    so a long page takes about as long as its largest batch, and a malformed answer only loses its own batch.
+    Batches whose blocks are all cached are not sent.
+    Args:
+        text: Latinized appointment text.
+        claude_client: The Claude client.
+        batch_blocks: Number of appointment blocks sent in a request. 0 sends the whole text at once.
+        max_concurrency: Maximum number of batches extracted at the same time.
+    Yields:
+         The parsed answers of each batch, as lists of dicts like {'appointments': [...]},
+         in the order of the text, as soon as the batch and the ones before it are done.
+    """
+    batches = extraction_batches(text, batch_blocks)
+    if len(batches) == 1:
+        yield extract_block_batch(claude_client, *batches[0])
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+        futures = [executor.submit(extract_block_batch, claude_client, blocks, batch_text)
+                   for blocks, batch_text in batches]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # E.g. the browser went away, or a batch failed: the batches not started yet are not sent.
+            for future in futures:
+                future.cancel()
+    logger.info("Extracted %d appointment blocks in %d batches.", sum(len(blocks) for blocks, _ in batches),
+                len(batches))
+
+
+def extract_appointments(claude_client: anthropic, text: str,
+                         batch_blocks: int = EXTRACTION_BATCH_BLOCKS,
+                         max_concurrency: int = EXTRACTION_MAX_CONCURRENCY) -> str:
+    """
+    Extracts the OCR'ed and Latinized appointment text and extracts the necessary information,
+    in concurrent batches of appointment blocks, see extract_in_batches.
+    Args:
+        text: Latinized appointment text.
+        claude_client: The Claude client.
+        batch_blocks: Number of appointment blocks sent in a request. 0 sends the whole text at once.
+        max_concurrency: Maximum number of batches extracted at the same time.
+    Returns:
+         The extracted information in the required format, as JSON with an 'appointments' list,
+         whether Claude wrapped its answer in text or not, and however long the text is.
+    """
+    return merged_extraction_json([extraction for results in extract_in_batches(
+        claude_client, text, batch_blocks, max_concurrency) for extraction in results])
+
+
+def reused_block_extractions(previous_text: str, text: str, previous_appointments: list) -> tuple:
+    """
+    Diffs the appointment blocks of a text and of its edited version, see reextract_appointments.
+    Returns:
+         A (blocks of the edited text, {block index: list of extractions} of the blocks that are
+         not sent to Claude again) tuple.
+    """
+    previous_blocks = segment_appointments(previous_text)
+    blocks = segment_appointments(text)
+
+    block_extractions = {}
+    if len(previous_appointments) == len(previous_blocks):
+        matcher = difflib.SequenceMatcher(a=previous_blocks, b=blocks, autojunk=False)
+        for tag, previous_start, previous_end, start, _ in matcher.get_opcodes():
+            if tag == 'equal':
+                for offset in range(previous_end - previous_start):
+                    block_extractions[start + offset] = [
+                        {'appointments': [previous_appointments[previous_start + offset]]}]
+
+    for index, block in enumerate(blocks):
+        if index not in block_extractions:
+            cached_extraction = cached_block_extraction(block)
+            if cached_extraction is not None:
+                block_extractions[index] = [cached_extraction]
+    return blocks, block_extractions
+
+
+def merged_reextraction(blocks: list, block_extractions: dict, changed_blocks: list) -> dict:
+    """
+    Merges the extractions of the blocks of an edited text in their order, see reextract_appointments.
+    """
+    logger.info("Re-extracted %d of %d appointment blocks.", len(changed_blocks), len(blocks))
+    merged = merge_extractions([extraction for index in range(len(blocks)) for extraction in block_extractions[index]])
+    merged.setdefault('appointments', [])
+    merged['reextracted_blocks'] = len(changed_blocks)
+    return merged
+
+
+def reextract_appointments(claude_client: anthropic, previous_text: str, text: str,
+                           previous_appointments: list, max_concurrency: int = EXTRACTION_MAX_CONCURRENCY) -> dict:
+    """
+    Extracts the appointments of an edited text, sending only the appointment blocks that changed.
+    The blocks of both texts are diffed; an unchanged block keeps its previous appointment (with any
+    correction made to it in the table) when the previous appointments pair up one to one with the
+    previous blocks. Otherwise its cached extraction is used, and only the remaining blocks are
+    extracted, one block per request.
+    Args:
+        previous_text: The Latinized text the previous appointments were extracted from.
+        text: The edited Latinized text.
+        previous_appointments: The appointments extracted from the previous text, in order.
+        claude_client: The Claude client.
+        max_concurrency: Maximum number of blocks extracted at the same time.
+    Returns:
+         The extracted information in the required format, with the number of blocks
+         sent to Claude under 'reextracted_blocks'.
+    """
+    blocks, block_extractions = reused_block_extractions(previous_text, text, previous_appointments)
+
+    changed_blocks = [index for index in range(len(blocks)) if index not in block_extractions]
+    if changed_blocks:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(changed_blocks))) as executor:
+            for index, extractions in zip(changed_blocks, executor.map(
+                    lambda index: extract_block_batch(claude_client, [blocks[index]]), changed_blocks)):
+                block_extractions[index] = extractions
+    return merged_reextraction(blocks, block_extractions, changed_blocks)
+
+
+def stream_block_batch(claude_client: anthropic, blocks: list, text: str = None):
+    """
+    Extracts the appointments of a few blocks in one streamed request, like extract_block_batch,
+    yielding each appointment as soon as Claude has written it, and caching the batch once it is done.
+    If Claude's answer turns out not to be valid JSON, the blocks after the appointments already
+    yielded are extracted one by one. Cached batches are not sent, and a short text routed to
+    the fast model is extracted without streaming, since its answer may still be escalated.
+    Args:
+        blocks: Appointment blocks of a Latinized text.
+        claude_client: The Claude client.
+        text: The text sent for the blocks, by default the blocks joined, e.g. the whole text they were split from.
+    Yields:
+         The appointments, as dicts in the required format, in order.
+    """
+    text = "\n".join(blocks) if text is None else text
+    extractions = cached_block_batch(blocks)
+    if extractions is None and is_routed(text):
+        extractions = extract_block_batch(claude_client, blocks, text)
+    if extractions is not None:
+        for extraction in extractions:
+            yield from extraction.get('appointments', [])
+        return
+
+    parser = JSONArrayStreamParser('appointments')
+    yielded = 0
+    try:
+        with claude_client.messages.stream(**extraction_request(text)) as stream:
+            for text_delta in stream.text_stream:
+                for appointment in parser.feed(text_delta):
+                    yield appointment
+                    yielded += 1
+            message = stream.get_final_message()
+        extraction = parse_extraction(extract_text_from_claude_response(message))
+    except json.JSONDecodeError:
+        if len(blocks) > 1 and yielded < len(blocks):
+            for block in blocks[yielded:]:
+                for extraction in extract_block_batch(claude_client, [block]):
+                    yield from extraction.get('appointments', [])
+            return
+        logger.warning("Skipped an appointment text Claude could not extract: %.80s", text)
+        return
+    except Exception:
+        raise Exception("Failed to extract the appointment data using Claude.")
+    record_prompt_cache_usage('extraction', message.usage)
+    cache_block_extractions(blocks, extraction, CLAUDE_MODEL)
+
+
+# Put in the queue of a batch after its last appointment.
+BATCH_END = object()
+
+
+def stream_into_queue(appointments, appointment_queue: queue.Queue, stopped: threading.Event) -> None:
+    """
+    Puts the appointments of a batch in its queue, followed by BATCH_END, until stopped is set.
+    """
+    try:
+        for appointment in appointments:
+            if stopped.is_set():
+                break
+            appointment_queue.put(appointment)
+    finally:
+        # Also closes the request of a batch that is stopped early.
+        appointments.close()
+        appointment_queue.put(BATCH_END)
+
+
+def stream_appointments(claude_client: anthropic, text: str, batch_blocks: int = EXTRACTION_BATCH_BLOCKS,
+                        max_concurrency: int = EXTRACTION_MAX_CONCURRENCY):
+    """
+    Extracts the appointments like extract_appointments, yielding each appointment as soon as
+    Claude has written it and the batches before its own are done, see stream_block_batch.
+    The batches are streamed concurrently, each into its own queue, and read in the order of the text.
+    Args:
+        text: Latinized appointment text.
+        claude_client: The Claude client.
+        batch_blocks: Number of appointment blocks sent in a request. 0 sends the whole text at once.
+        max_concurrency: Maximum number of batches extracted at the same time.
+    Yields:
+         The appointments, as dicts in the required format, in order.
+    """
+    batches = extraction_batches(text, batch_blocks)
+    if len(batches) == 1:
+        yield from stream_block_batch(claude_client, *batches[0])
+        return
+
+    queues = [queue.Queue() for _ in batches]
+    stopped = threading.Event()
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+        futures = [executor.submit(stream_into_queue, stream_block_batch(claude_client, blocks, batch_text),
+                                   batch_queue, stopped)
+                   for (blocks, batch_text), batch_queue in zip(batches, queues)]
+        try:
+            for future, batch_queue in zip(futures, queues):
+                while (appointment := batch_queue.get()) is not BATCH_END:
+                    yield appointment
+                future.result()
+        finally:
+            # E.g. the browser went away, or a batch failed: the batches not started yet are not sent,
+            # and the ones being streamed are closed.
+            stopped.set()
+            for future in futures:
+                future.cancel()
+    logger.info("Extracted %d appointment blocks in %d batches.", sum(len(blocks) for blocks, _ in batches),
+                len(batches))
+
+
+def end_to_end_process(image, chunk_lines: int = LATINIZATION_CHUNK_LINES) -> JsonResponse:
     """
     Orchestrates the OCR and Latinization process. Entry point.
     Args:
-        file_path: The path to the local PDF file to be processed.
+        image: The content of the PNG file to be processed, or the path to the local file.
+        chunk_lines: Long pages are latinized concurrently in chunks of at most this many lines.
+        0 sends the whole page in one request.
     Returns:
          A JSON response containing the OCR'ed and Latinized text.
     """
     try:
         # First OCR the document
-        document_ocr_text = document_ai_ocr(file_path)
-
-        try:
-            claude_client = initialize_claude()
-        except Exception:
-            raise Exception("Failed to initialize the Claude client.")
+        document_ocr_text = ocr_image(image)
 
         # Latinize the OCR'ed text
-        latinized_claude_response = latinize_ocr_text(claude_client, document_ocr_text)
+        latinized_claude_response = latinize_page(get_claude_client(), document_ocr_text, chunk_lines)
         latinized_final_text = ""
 
         # Extract and print the response text
@@ -188,3 +1304,24 @@ def end_to_end_process(file_path) -> JsonResponse:
                              'Latinized': latinized_final_text}, status=200)
     except Exception as e:
         return JsonResponse({'error': 'Failed to OCR and Latinize the document.' + str(e)}, status=500)
+
+
+def stream_end_to_end_process(image):
+    """
+    Orchestrates the OCR and Latinization process, reporting each step as soon as it is done:
+    the OCR text first, then the latinized text as it is generated, see stream_latinization.
+    Args:
+        image: The content of the PNG file to be processed, or the path to the local file.
+    Yields:
+         (event, data) tuples: ('ocr', {'OCR': text}), then ('latinized', {'text': piece}) for each
+         piece of the latinization, then ('done', {}). On failure, ('error', {'message': message}).
+    """
+    try:
+        document_ocr_text = ocr_image(image)
+        yield 'ocr', {'OCR': document_ocr_text}
+
+        for latinized_piece in stream_latinization(get_claude_client(), document_ocr_text):
+            yield 'latinized', {'text': latinized_piece}
+        yield 'done', {}
+    except Exception as e:
+        yield 'error', {'message': 'Failed to OCR and Latinize the document.' + str(e)}
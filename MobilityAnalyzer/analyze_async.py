@@ -0,0 +1,610 @@
+"""
+Asynchronous version of the OCR, Latinization and extraction pipeline in analyze.py, for the async views
+served by the ASGI application. Requests wait for Document AI and Claude without holding a thread,
+and the chunks and batches of a page are sent concurrently from the event loop.
+Only the requests and their scheduling live here: the prompts, caches, translation memory, chunking,
+batching and model routing checks are the functions of analyze.py.
+"""
+import asyncio
+import json
+import logging
+import threading
+import weakref
+
+import anthropic
+import anthropic.types
+import httpx
+from django.http import JsonResponse
+from google.api_core.client_options import ClientOptions
+
+from MobilityAnalyzer import analyze
+from MobilityAnalyzer.analyze import (
+    BATCH_END,
+    CLAUDE_MODEL,
+    EXTRACTION_BATCH_BLOCKS,
+    EXTRACTION_MAX_CONCURRENCY,
+    LATINIZATION_CHUNK_LINES,
+    LATINIZED_LINE_SEPARATOR,
+    LATINIZATION_MAX_CONCURRENCY,
+    cache_block_extractions,
+    cache_latinization,
+    cached_block_batch,
+    cached_latinization,
+    check_png_signature,
+    documentai,
+    env,
+    extract_text_from_claude_response,
+    extraction_batches,
+    extraction_request,
+    fast_latinization_problem,
+    first_uncached_chunk,
+    is_routed,
+    join_latinized_chunks,
+    latinization_chunks,
+    latinization_request,
+    latinized_prefix,
+    learn_latinized_page,
+    log_escalation,
+    lookup_known_lines,
+    merged_extraction_json,
+    merged_reextraction,
+    normalized_latinization,
+    ocr_cache_key,
+    ocr_request,
+    parse_extraction,
+    read_png_file,
+    record_prompt_cache_usage,
+    reused_block_extractions,
+    stitch_latinized_lines,
+    unseen_ocr_lines
+)
+from MobilityAnalyzer.json_stream import JSONArrayStreamParser
+from MobilityAnalyzer.routing import extraction_problem
+
+logger = logging.getLogger(__name__)
+
+# httpx and gRPC connections belong to the event loop they were opened on,
+# so each event loop gets its own clients.
+_claude_clients = weakref.WeakKeyDictionary()
+_claude_transport = None
+_document_ai_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def initialize_claude(transport: httpx.AsyncBaseTransport = None) -> anthropic.AsyncAnthropic:
+    """
+    Initializes an asynchronous Claude client with its own pool of keep-alive HTTP connections.
+    Pool size and timeouts are read from the .env file, like for the synchronous client.
+    Args:
+        transport: HTTP transport to send the requests through, e.g. a fake one in tests.
+        By default, a connection pool is created.
+    Return:
+         The Claude client.
+    """
+    try:
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+                max_connections=env.int("CLAUDE_MAX_CONNECTIONS", default=20),
+                max_keepalive_connections=env.int("CLAUDE_MAX_KEEPALIVE_CONNECTIONS", default=10),
+                keepalive_expiry=env.float("CLAUDE_KEEPALIVE_EXPIRY", default=60.0)
+            ))
+        http_client = anthropic.DefaultAsyncHttpxClient(
+            transport=transport,
+            timeout=httpx.Timeout(env.float("CLAUDE_TIMEOUT", default=120.0),
+                                  connect=env.float("CLAUDE_CONNECT_TIMEOUT", default=10.0))
+        )
+        return anthropic.AsyncAnthropic(api_key=env("CLAUDE_KEY"), http_client=http_client)
+    except Exception:
+        raise Exception("Failed to initialize the Claude client.")
+
+
+def get_claude_client() -> anthropic.AsyncAnthropic:
+    """
+    Returns the asynchronous Claude client shared by the running event loop, creating it on first use.
+    Return:
+         The Claude client.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        claude_client = _claude_clients.get(loop)
+        if claude_client is None:
+            claude_client = _claude_clients[loop] = initialize_claude(_claude_transport)
+    return claude_client
+
+
+def reset_claude_client(transport: httpx.AsyncBaseTransport = None) -> None:
+    """
+    Drops the shared asynchronous Claude clients. The next get_claude_client call creates a new one.
+    Args:
+        transport: If given, the new clients send their requests through this transport.
+        Lets tests inject a fake transport.
+    """
+    global _claude_transport
+    with _clients_lock:
+        _claude_clients.clear()
+        _claude_transport = transport
+
+
+def get_document_ai_client(cloud_key_path: str = env("GOOGLE_CLOUD_KEY_PATH"),
+                           location: str = env("LOCATION")) -> documentai.DocumentProcessorServiceAsyncClient:
+    """
+    Returns the asynchronous Document AI client of the running event loop
+    for the given key and location, creating it on first use.
+    Args:
+        cloud_key_path: The path to the Google Cloud API key.
+        location: The location of the Document AI processor, e.g. eu.
+    Return:
+         The Document AI client.
+    """
+    api_endpoint = f"{location}-documentai.googleapis.com"
+    key = (str(cloud_key_path), api_endpoint)
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        loop_clients = _document_ai_clients.setdefault(loop, {})
+        gc_client = loop_clients.get(key)
+        if gc_client is None:
+            gc_credentials = analyze.service_account.Credentials.from_service_account_file(str(cloud_key_path))
+            gc_client = loop_clients[key] = documentai.DocumentProcessorServiceAsyncClient(
+                credentials=gc_credentials,
+                client_options=ClientOptions(api_endpoint=api_endpoint))
+    return gc_client
+
+
+async def document_ai_ocr_content(image_content: bytes, cloud_key_path: str = env("GOOGLE_CLOUD_KEY_PATH")) -> str:
+    """
+    Extracts text from the content of an Image/png file using the Document AI API of Google.
+    The results are cached by the content of the image, so a page is sent only once.
+    Args:
+        image_content: The PNG image to be OCR'ed.
+        cloud_key_path: The path to the Google Cloud API key.
+    Return:
+         OCR'ed raw text.
+    """
+    try:
+        check_png_signature(image_content)
+
+        cache_key = ocr_cache_key(image_content)
+        cached_text = await asyncio.to_thread(analyze.ocr_cache.get, cache_key)
+        if cached_text is not None:
+            return cached_text
+
+        gc_client = get_document_ai_client(cloud_key_path)
+        process_result = await gc_client.process_document(request=ocr_request(image_content))
+
+        ocred_text = process_result.document.text
+        await asyncio.to_thread(analyze.ocr_cache.put, cache_key, ocred_text)
+        return ocred_text
+    except Exception as e:
+        raise Exception("Failed to OCR the document using Google Cloud AI: " + str(e))
+
+
+async def document_ai_ocr(file_path: str, cloud_key_path: str = env("GOOGLE_CLOUD_KEY_PATH")) -> str:
+    """
+    Extracts text from an Image/png file using the Document AI API of Google.
+    Args:
+        cloud_key_path: The path to the Google Cloud API key.
+        file_path: The (local) path to the Image file to be OCR'ed.
+    Return:
+         OCR'ed raw text.
+    """
+    try:
+        image_content = await asyncio.to_thread(read_png_file, file_path)
+    except Exception as e:
+        raise Exception("Failed to OCR the document using Google Cloud AI: " + str(e))
+    return await document_ai_ocr_content(image_content, cloud_key_path)
+
+
+async def ocr_image(image) -> str:
+    """
+    OCRs a page given either as the content of a PNG file or as the path to one.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return await document_ai_ocr_content(bytes(image))
+    return await document_ai_ocr(image)
+
+
+async def request_latinization(claude_client: anthropic.AsyncAnthropic, ottoman_text: str,
+                               model: str = CLAUDE_MODEL) -> anthropic.types.Message:
+    """
+    Sends OCR'ed Ottoman Turkish text to Claude for transliteration, like analyze.request_latinization.
+    """
+    try:
+        latinized_text = await claude_client.messages.create(**latinization_request(ottoman_text, model))
+    except Exception:
+        raise Exception("Failed to Latinize the text using Claude.")
+    record_prompt_cache_usage('latinization', latinized_text.usage)
+    return latinized_text
+
+
+async def route_latinization(claude_client: anthropic.AsyncAnthropic, ottoman_text: str) -> anthropic.types.Message:
+    """
+    Latinizes a short text with the fast model, escalating to CLAUDE_MODEL
+    when the answer fails the quality check, like analyze.route_latinization.
+    """
+    if not is_routed(ottoman_text):
+        return await request_latinization(claude_client, ottoman_text)
+
+    latinized_text = await request_latinization(claude_client, ottoman_text, analyze.CLAUDE_FAST_MODEL)
+    problem = fast_latinization_problem(ottoman_text, latinized_text)
+    log_escalation('latinization', problem)
+    if problem is None:
+        return latinized_text
+    return await request_latinization(claude_client, ottoman_text)
+
+
+async def latinize_with_translation_memory(claude_client: anthropic.AsyncAnthropic,
+                                           ottoman_text: str) -> anthropic.types.Message:
+    """
+    Latinizes the lines found in the translation memory from it, and sends only
+    the unseen lines to Claude, like analyze.latinize_with_translation_memory.
+    """
+    ocr_lines = ottoman_text.split("\n")
+    known_lines, known_model = await asyncio.to_thread(lookup_known_lines, ottoman_text, ocr_lines)
+
+    if known_lines:
+        unseen_lines = unseen_ocr_lines(ocr_lines, known_lines)
+        partial_response = await route_latinization(claude_client, "\n".join(unseen_lines)) if unseen_lines else None
+        latinized_text = await asyncio.to_thread(stitch_latinized_lines, ocr_lines, known_lines, known_model,
+                                                 unseen_lines, partial_response)
+        if latinized_text is not None:
+            return latinized_text
+
+    latinized_text = await route_latinization(claude_client, ottoman_text)
+    await asyncio.to_thread(learn_latinized_page, ottoman_text, latinized_text)
+    return latinized_text
+
+
+async def latinize_ocr_text(claude_client: anthropic.AsyncAnthropic, ottoman_text: str) -> anthropic.types.Message:
+    """
+    Transliterates OCR'ed Ottoman Turkish text to Latin script using Claude,
+    with the cache and translation memory of analyze.latinize_ocr_text.
+    """
+    cached_message = await asyncio.to_thread(cached_latinization, ottoman_text)
+    if cached_message is not None:
+        return cached_message
+
+    latinized_text = await latinize_with_translation_memory(claude_client, ottoman_text)
+    await asyncio.to_thread(cache_latinization, ottoman_text, latinized_text)
+    return latinized_text
+
+
+async def latinize_chunks(claude_client: anthropic.AsyncAnthropic, chunks: list,
+                          max_concurrency: int = LATINIZATION_MAX_CONCURRENCY):
+    """
+    Latinizes the chunks concurrently, at most max_concurrency at a time, like analyze.latinize_chunks.
+    Yields:
+         The latinized text message of each chunk, in order, as soon as it and the chunks before it are done.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def latinize_chunk(chunk):
+        async with semaphore:
+            return await latinize_ocr_text(claude_client, chunk)
+
+    tasks = [asyncio.ensure_future(latinize_chunk(chunk)) for chunk in chunks]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        # E.g. the browser went away, or a chunk failed: the chunks still waiting are not sent.
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_chunk_latinization(claude_client: anthropic.AsyncAnthropic, ottoman_text: str):
+    """
+    Yields the latinization of a text as CLAUDE_MODEL generates it, like analyze.stream_chunk_latinization.
+    """
+    generated_text = ""
+    sent_text = ""
+    try:
+        async with claude_client.messages.stream(**latinization_request(ottoman_text)) as stream:
+            async for text in stream.text_stream:
+                generated_text += text
+                prefix = latinized_prefix(generated_text)
+                if len(prefix) > len(sent_text) and prefix.startswith(sent_text):
+                    yield prefix[len(sent_text):]
+                    sent_text = prefix
+            latinized_text = await stream.get_final_message()
+    except Exception:
+        raise Exception("Failed to Latinize the text using Claude.")
+    record_prompt_cache_usage('latinization', latinized_text.usage)
+
+    await asyncio.to_thread(cache_latinization, ottoman_text, latinized_text)
+    await asyncio.to_thread(learn_latinized_page, ottoman_text, latinized_text)
+    rest = normalized_latinization(latinized_text)[len(sent_text):]
+    if rest:
+        yield rest
+
+
+async def stream_latinization(claude_client: anthropic.AsyncAnthropic, ottoman_text: str,
+                              max_lines: int = LATINIZATION_CHUNK_LINES,
+                              max_concurrency: int = LATINIZATION_MAX_CONCURRENCY):
+    """
+    Yields the latinized text as soon as it is ready, streaming the first chunk that would be sent
+    to Claude whole, like analyze.stream_latinization.
+    """
+    chunks = latinization_chunks(ottoman_text, max_lines)
+    if len(chunks) <= 1:
+        chunks = [ottoman_text]
+    streamed_chunk = await asyncio.to_thread(first_uncached_chunk, chunks)
+    semaphore = asyncio.Semaphore(max(max_concurrency - (streamed_chunk is not None), 1))
+
+    async def latinize_chunk(chunk):
+        async with semaphore:
+            return await latinize_ocr_text(claude_client, chunk)
+
+    tasks = [None if index == streamed_chunk else asyncio.ensure_future(latinize_chunk(chunk))
+             for index, chunk in enumerate(chunks)]
+    started = False
+    try:
+        for chunk, task in zip(chunks, tasks):
+            separator = LATINIZED_LINE_SEPARATOR if started else ""
+            if task is None:
+                async for piece in stream_chunk_latinization(claude_client, chunk):
+                    if piece:
+                        yield separator + piece
+                        separator = ""
+                        started = True
+            else:
+                piece = normalized_latinization(await task)
+                if piece:
+                    yield separator + piece
+                    started = True
+    finally:
+        # E.g. the browser went away, or a chunk failed: the chunks still waiting are not sent.
+        for task in tasks:
+            if task is not None:
+                task.cancel()
+
+
+async def latinize_ocr_text_in_chunks(claude_client: anthropic.AsyncAnthropic, ottoman_text: str,
+                                      max_lines: int = LATINIZATION_CHUNK_LINES,
+                                      max_concurrency: int = LATINIZATION_MAX_CONCURRENCY) -> anthropic.types.Message:
+    """
+    Latinizes a long text as line-aligned chunks sent concurrently, then joins the
+    latinized chunks in the order of the text, like analyze.latinize_ocr_text_in_chunks.
+    """
+    chunks = latinization_chunks(ottoman_text, max_lines)
+    if len(chunks) <= 1:
+        return await latinize_ocr_text(claude_client, ottoman_text)
+
+    responses = [response async for response in latinize_chunks(claude_client, chunks, max_concurrency)]
+    logger.info("Latinized %d lines in %d chunks.", len(ottoman_text.split("\n")), len(chunks))
+    return join_latinized_chunks(responses)
+
+
+async def request_extraction(claude_client: anthropic.AsyncAnthropic, text: str, model: str = CLAUDE_MODEL) -> str:
+    """
+    Sends Latinized appointment text to Claude in a single request, like analyze.request_extraction.
+    Returns:
+         Claude's JSON answer, as text.
+    """
+    try:
+        message = await claude_client.messages.create(**extraction_request(text, model))
+    except Exception:
+        raise Exception("Failed to extract the appointment data using Claude.")
+    record_prompt_cache_usage('extraction', message.usage)
+    return extract_text_from_claude_response(message)
+
+
+async def route_extraction(claude_client: anthropic.AsyncAnthropic, text: str) -> tuple:
+    """
+    Extracts the appointments of a short text with the fast model, escalating to CLAUDE_MODEL
+    when the answer fails the quality check, like analyze.route_extraction.
+    Returns:
+         A (Claude's JSON answer as text, model that gave it) tuple.
+    """
+    if not is_routed(text):
+        return await request_extraction(claude_client, text), CLAUDE_MODEL
+
+    extracted_text = await request_extraction(claude_client, text, analyze.CLAUDE_FAST_MODEL)
+    problem = extraction_problem(extracted_text, analyze.ROUTING_MAX_NOT_SPECIFIED_RATIO)
+    log_escalation('extraction', problem)
+    if problem is None:
+        return extracted_text, analyze.CLAUDE_FAST_MODEL
+    return await request_extraction(claude_client, text), CLAUDE_MODEL
+
+
+async def extract_block_batch(claude_client: anthropic.AsyncAnthropic, blocks: list, semaphore: asyncio.Semaphore,
+                              text: str = None) -> list:
+    """
+    Extracts the appointments of a few blocks in one request, retrying the blocks one
+    by one if the answer is not valid JSON, like analyze.extract_block_batch.
+    Every request, retries included, waits for the semaphore, so at most as many
+    requests as it allows are sent at the same time.
+    """
+    cached_extractions = await asyncio.to_thread(cached_block_batch, blocks)
+    if cached_extractions is not None:
+        return cached_extractions
+    text = "\n".join(blocks) if text is None else text
+    try:
+        async with semaphore:
+            extracted_text, model = await route_extraction(claude_client, text)
+        extraction = parse_extraction(extracted_text)
+    except json.JSONDecodeError:
+        if len(blocks) > 1:
+            results = await asyncio.gather(*(extract_block_batch(claude_client, [block], semaphore)
+                                             for block in blocks))
+            return [result for block_results in results for result in block_results]
+        logger.warning("Skipped an appointment text Claude could not extract: %.80s", text)
+        return []
+    await asyncio.to_thread(cache_block_extractions, blocks, extraction, model)
+    return [extraction]
+
+
+async def extract_in_batches(claude_client: anthropic.AsyncAnthropic, text: str,
+                             batch_blocks: int = EXTRACTION_BATCH_BLOCKS,
+                             max_concurrency: int = EXTRACTION_MAX_CONCURRENCY):
+    """
+    Extracts the batches of appointment blocks of the text concurrently, sending at most
+    max_concurrency requests at the same time, like analyze.extract_in_batches.
+    Yields:
+         The parsed answers of each batch, in the order of the text, as soon as the batch and the ones before it are done.
+    """
+    batches = extraction_batches(text, batch_blocks)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = [asyncio.ensure_future(extract_block_batch(claude_client, blocks, semaphore, batch_text))
+             for blocks, batch_text in batches]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        # E.g. the browser went away, or a batch failed: the batches still waiting are not sent.
+        for task in tasks:
+            task.cancel()
+
+
+async def extract_appointments(claude_client: anthropic.AsyncAnthropic, text: str,
+                               batch_blocks: int = EXTRACTION_BATCH_BLOCKS,
+                               max_concurrency: int = EXTRACTION_MAX_CONCURRENCY) -> str:
+    """
+    Extracts the OCR'ed and Latinized appointment text and extracts the necessary information,
+    like analyze.extract_appointments.
+    Returns:
+         The extracted information in the required format, as JSON with an 'appointments' list.
+    """
+    return merged_extraction_json([extraction async for results in extract_in_batches(
+        claude_client, text, batch_blocks, max_concurrency) for extraction in results])
+
+
+async def reextract_appointments(claude_client: anthropic.AsyncAnthropic, previous_text: str, text: str,
+                                 previous_appointments: list,
+                                 max_concurrency: int = EXTRACTION_MAX_CONCURRENCY) -> dict:
+    """
+    Extracts the appointments of an edited text, sending only the appointment blocks that changed,
+    at most max_concurrency at the same time, like analyze.reextract_appointments.
+    Returns:
+         The extracted information in the required format, with the number of blocks
+         sent to Claude under 'reextracted_blocks'.
+    """
+    blocks, block_extractions = await asyncio.to_thread(reused_block_extractions, previous_text, text,
+                                                        previous_appointments)
+
+    changed_blocks = [index for index in range(len(blocks)) if index not in block_extractions]
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results = await asyncio.gather(*(extract_block_batch(claude_client, [blocks[index]], semaphore)
+                                     for index in changed_blocks))
+    block_extractions.update(zip(changed_blocks, results))
+    return merged_reextraction(blocks, block_extractions, changed_blocks)
+
+
+async def stream_block_batch(claude_client: anthropic.AsyncAnthropic, blocks: list, semaphore: asyncio.Semaphore,
+                             text: str = None):
+    """
+    Extracts the appointments of a few blocks in one streamed request, yielding each appointment as soon
+    as Claude has written it, like analyze.stream_block_batch. The request waits for the semaphore,
+    and so do the retries of the blocks one by one, once it is released.
+    """
+    text = "\n".join(blocks) if text is None else text
+    extractions = await asyncio.to_thread(cached_block_batch, blocks)
+    if extractions is None and is_routed(text):
+        extractions = await extract_block_batch(claude_client, blocks, semaphore, text)
+    if extractions is not None:
+        for extraction in extractions:
+            for appointment in extraction.get('appointments', []):
+                yield appointment
+        return
+
+    parser = JSONArrayStreamParser('appointments')
+    yielded = 0
+    try:
+        async with semaphore:
+            async with claude_client.messages.stream(**extraction_request(text)) as stream:
+                async for text_delta in stream.text_stream:
+                    for appointment in parser.feed(text_delta):
+                        yield appointment
+                        yielded += 1
+                message = await stream.get_final_message()
+        extraction = parse_extraction(extract_text_from_claude_response(message))
+    except json.JSONDecodeError:
+        if len(blocks) > 1 and yielded < len(blocks):
+            results = await asyncio.gather(*(extract_block_batch(claude_client, [block], semaphore)
+                                             for block in blocks[yielded:]))
+            for extraction in (extraction for block_results in results for extraction in block_results):
+                for appointment in extraction.get('appointments', []):
+                    yield appointment
+            return
+        logger.warning("Skipped an appointment text Claude could not extract: %.80s", text)
+        return
+    except Exception:
+        raise Exception("Failed to extract the appointment data using Claude.")
+    record_prompt_cache_usage('extraction', message.usage)
+    await asyncio.to_thread(cache_block_extractions, blocks, extraction, CLAUDE_MODEL)
+
+
+async def stream_into_queue(appointments, appointment_queue: asyncio.Queue) -> None:
+    """
+    Puts the appointments of a batch in its queue, followed by analyze.BATCH_END, like analyze.stream_into_queue.
+    """
+    try:
+        async for appointment in appointments:
+            appointment_queue.put_nowait(appointment)
+    finally:
+        await appointments.aclose()
+        appointment_queue.put_nowait(BATCH_END)
+
+
+async def stream_appointments(claude_client: anthropic.AsyncAnthropic, text: str,
+                              batch_blocks: int = EXTRACTION_BATCH_BLOCKS,
+                              max_concurrency: int = EXTRACTION_MAX_CONCURRENCY):
+    """
+    Yields each appointment as soon as Claude has written it and the batches before its own are done,
+    like analyze.stream_appointments. At most max_concurrency requests are sent at the same time.
+    """
+    batches = extraction_batches(text, batch_blocks)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    queues = [asyncio.Queue() for _ in batches]
+    tasks = [asyncio.ensure_future(stream_into_queue(stream_block_batch(claude_client, blocks, semaphore, batch_text),
+                                                     batch_queue))
+             for (blocks, batch_text), batch_queue in zip(batches, queues)]
+    try:
+        for task, batch_queue in zip(tasks, queues):
+            while (appointment := await batch_queue.get()) is not BATCH_END:
+                yield appointment
+            await task
+    finally:
+        # E.g. the browser went away, or a batch failed: the batches still waiting are not sent,
+        # and the ones being streamed are closed.
+        for task in tasks:
+            task.cancel()
+
+
+async def end_to_end_process(image, chunk_lines: int = LATINIZATION_CHUNK_LINES) -> JsonResponse:
+    """
+    Orchestrates the OCR and Latinization process. Entry point of the async views.
+    Args:
+        image: The content of the PNG file to be processed, or the path to the local file.
+        chunk_lines: Long pages are latinized concurrently in chunks of at most this many lines.
+        0 sends the whole page in one request.
+    Returns:
+         A JSON response containing the OCR'ed and Latinized text.
+    """
+    try:
+        document_ocr_text = await ocr_image(image)
+
+        latinized_claude_response = await latinize_ocr_text_in_chunks(get_claude_client(), document_ocr_text,
+                                                                      chunk_lines)
+        return JsonResponse({'OCR': document_ocr_text,
+                             'Latinized': extract_text_from_claude_response(latinized_claude_response)},
+                            status=200)
+    except Exception as e:
+        return JsonResponse({'error': 'Failed to OCR and Latinize the document.' + str(e)}, status=500)
+
+
+async def stream_end_to_end_process(image):
+    """
+    Orchestrates the OCR and Latinization process, reporting each step as soon as it is done,
+    like analyze.stream_end_to_end_process. Entry point of the streaming views.
+    Yields:
+         The (event, data) tuples of analyze.stream_end_to_end_process.
+    """
+    try:
+        document_ocr_text = await ocr_image(image)
+        yield 'ocr', {'OCR': document_ocr_text}
+
+        async for latinized_text in stream_latinization(get_claude_client(), document_ocr_text):
+            yield 'latinized', {'text': latinized_text}
+        yield 'done', {}
+    except Exception as e:
+        yield 'error', {'message': 'Failed to OCR and Latinize the document.' + str(e)}
@@ -0,0 +1,204 @@
+"""
+Message Batches backend of the Latinization and extraction, for archive runs where the latency
+of a page does not matter: the requests of many pages are sent as one message batch,
+which is answered within 24 hours at half the price of the same requests sent one by one.
+Results are written to the same caches as those of latinize_ocr_text and extract_appointments.
+"""
+import json
+import logging
+import time
+
+import anthropic
+import anthropic.types
+
+from MobilityAnalyzer.analyze import (
+    EXTRACTION_BATCH_BLOCKS,
+    LATINIZATION_CHUNK_LINES,
+    PROMPT_CACHING_BETA,
+    cache_block_extractions,
+    cache_latinization,
+    cached_block_batch,
+    cached_latinization,
+    env,
+    extract_text_from_claude_response,
+    extraction_batches,
+    extraction_request,
+    join_latinized_chunks,
+    latinization_chunks,
+    latinization_request,
+    learn_latinized_page,
+    merged_extraction_json,
+    parse_extraction,
+    record_prompt_cache_usage
+)
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_BATCHES_BETA = "message-batches-2024-09-24"
+# Seconds between two checks of a message batch, and the most requests sent in one batch.
+MESSAGE_BATCH_POLL_INTERVAL = env.float("MESSAGE_BATCH_POLL_INTERVAL", default=60.0)
+MESSAGE_BATCH_MAX_REQUESTS = env.int("MESSAGE_BATCH_MAX_REQUESTS", default=10000)
+
+
+def batch_request_params(request: dict) -> dict:
+    """
+    Parameters of a request in a message batch. The beta headers are sent with the batch instead.
+    """
+    return {name: value for name, value in request.items() if name != 'extra_headers'}
+
+
+def run_message_batches(claude_client: anthropic, requests: dict, stage: str,
+                        poll_interval: float = None, max_requests: int = None) -> dict:
+    """
+    Sends the requests as message batches of at most max_requests requests,
+    waits until every batch has ended, and collects the answers.
+    Args:
+        claude_client: The Claude client.
+        requests: Dict from the custom ID of each request to its parameters.
+        stage: Stage of the requests, e.g. 'latinization', for the prompt cache statistics.
+        poll_interval: Seconds between two checks of a batch.
+        max_requests: Most requests sent in one batch.
+    Returns:
+         Dict from the custom ID of each succeeded request to its message.
+         Errored, canceled and expired requests are logged and left out.
+    """
+    poll_interval = MESSAGE_BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+    max_requests = max_requests or MESSAGE_BATCH_MAX_REQUESTS
+    betas = [MESSAGE_BATCHES_BETA, PROMPT_CACHING_BETA]
+
+    items = list(requests.items())
+    batches = [claude_client.beta.messages.batches.create(
+        requests=[{'custom_id': custom_id, 'params': batch_request_params(params)}
+                  for custom_id, params in items[start:start + max_requests]],
+        betas=betas) for start in range(0, len(items), max_requests)]
+    logger.info("Sent %d %s requests in %d message batches.", len(items), stage, len(batches))
+
+    messages = {}
+    for batch in batches:
+        while batch.processing_status != 'ended':
+            time.sleep(poll_interval)
+            batch = claude_client.beta.messages.batches.retrieve(batch.id)
+
+        for response in claude_client.beta.messages.batches.results(batch.id, betas=betas):
+            if response.result.type == 'succeeded':
+                record_prompt_cache_usage(stage, response.result.message.usage)
+                messages[response.custom_id] = response.result.message
+            else:
+                logger.warning("The %s request %s of message batch %s %s.",
+                               stage, response.custom_id, batch.id, response.result.type)
+    return messages
+
+
+def latinize_pages(claude_client: anthropic, ottoman_texts: list,
+                   chunk_lines: int = LATINIZATION_CHUNK_LINES, **batch_options) -> list:
+    """
+    Latinizes the OCR'ed texts of many pages in message batches, like latinize_page:
+    long pages in chunks of at most chunk_lines lines. Chunks found in the latinization cache
+    are not sent, and the answers are cached and added to the translation memory.
+    Args:
+        claude_client: The Claude client.
+        ottoman_texts: OCR'ed Ottoman Turkish texts.
+        chunk_lines: Maximum number of lines in a chunk. 0 sends whole pages.
+        batch_options: poll_interval and max_requests of run_message_batches.
+    Returns:
+         The latinized text message of each page, or None for the pages with a failed request.
+    """
+    page_chunks = []
+    for ottoman_text in ottoman_texts:
+        chunks = latinization_chunks(ottoman_text, chunk_lines)
+        page_chunks.append(chunks if len(chunks) > 1 else [ottoman_text])
+
+    # The same chunk, e.g. a recurring heading, is sent once.
+    messages = {}
+    requests = {}
+    for chunk in dict.fromkeys(chunk for chunks in page_chunks for chunk in chunks):
+        cached_message = cached_latinization(chunk)
+        if cached_message is not None:
+            messages[chunk] = cached_message
+        else:
+            requests[f"latinization-{len(requests)}"] = chunk
+
+    answers = run_message_batches(claude_client, {custom_id: latinization_request(chunk)
+                                                  for custom_id, chunk in requests.items()},
+                                  'latinization', **batch_options)
+    for custom_id, chunk in requests.items():
+        if custom_id not in answers:
+            continue
+        message = anthropic.types.Message.model_validate(answers[custom_id].model_dump())
+        cache_latinization(chunk, message)
+        learn_latinized_page(chunk, message)
+        messages[chunk] = message
+
+    latinized_pages = []
+    for chunks in page_chunks:
+        if not all(chunk in messages for chunk in chunks):
+            latinized_pages.append(None)
+        elif len(chunks) == 1:
+            latinized_pages.append(messages[chunks[0]])
+        else:
+            latinized_pages.append(join_latinized_chunks([messages[chunk] for chunk in chunks]))
+    return latinized_pages
+
+
+def extract_pages(claude_client: anthropic, texts: list,
+                  batch_blocks: int = EXTRACTION_BATCH_BLOCKS, **batch_options) -> list:
+    """
+    Extracts the appointments of many Latinized pages in message batches, like extract_appointments:
+    long pages in requests of batch_blocks appointment blocks. Requests whose blocks are all cached
+    are not sent. A request of several blocks, a whole page included, that errored or whose answer
+    is not valid JSON is sent again block by block in another message batch.
+    Args:
+        claude_client: The Claude client.
+        texts: Latinized appointment texts.
+        batch_blocks: Number of appointment blocks sent in a request. 0 sends whole texts.
+        batch_options: poll_interval and max_requests of run_message_batches.
+    Returns:
+         The JSON output of each page, as extract_appointments returns it,
+         or None for the pages none of whose requests was answered.
+    """
+    # (index of the first block, extraction) tuples of each page with an answer.
+    page_extractions = {}
+    # (page index, index of the first block, blocks, text sent) of each request.
+    pending_requests = []
+    for page_index, text in enumerate(texts):
+        start = 0
+        for blocks, batch_text in extraction_batches(text, batch_blocks):
+            cached_extractions = cached_block_batch(blocks)
+            if cached_extractions is not None:
+                page_extractions.setdefault(page_index, []).extend(
+                    (start + offset, extraction) for offset, extraction in enumerate(cached_extractions))
+            else:
+                pending_requests.append((page_index, start, blocks, batch_text))
+            start += len(blocks)
+
+    while pending_requests:
+        answers = run_message_batches(claude_client, {f"extraction-{number}": extraction_request(text)
+                                                      for number, (_, _, _, text) in enumerate(pending_requests)},
+                                      'extraction', **batch_options)
+        retried_requests = []
+        for number, (page_index, start, blocks, text) in enumerate(pending_requests):
+            answer = answers.get(f"extraction-{number}")
+            if answer is not None:
+                page_extractions.setdefault(page_index, [])
+                try:
+                    extraction = parse_extraction(extract_text_from_claude_response(answer))
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    cache_block_extractions(blocks, extraction, answer.model)
+                    page_extractions[page_index].append((start, extraction))
+                    continue
+
+            # The request errored, or its answer is not valid JSON.
+            if len(blocks) > 1:
+                retried_requests.extend((page_index, start + offset, [block], block)
+                                        for offset, block in enumerate(blocks))
+            else:
+                logger.warning("Skipped an appointment text Claude could not extract: %.80s", text)
+        pending_requests = retried_requests
+
+    extracted_pages = [None] * len(texts)
+    for page_index, extractions in page_extractions.items():
+        extracted_pages[page_index] = merged_extraction_json(
+            [extraction for _, extraction in sorted(extractions, key=lambda item: item[0])])
+    return extracted_pages
@@ -0,0 +1,218 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import cachetools
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe least-recently-used cache with hit/miss counters,
+    around a cachetools.LRUCache, which is not thread-safe on its own.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = cachetools.LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for the key, or default on a miss.
+        """
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        """
+        Caches the value, evicting the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            self._entries[key] = value
+
+    def clear(self) -> None:
+        """
+        Removes all entries and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters and the current size of the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+class PersistentCache:
+    """
+    String cache stored in a sqlite table, shared by all processes using the same file.
+    When the stored values grow over max_bytes, the least recently used entries are evicted.
+    The total size of the values is kept up to date by triggers in a table of its own,
+    so a put only reads the oldest entries when the cache is over budget.
+    Hit/miss counters are kept per process.
+    """
+
+    # Least recently used entries read at a time while evicting.
+    EVICTION_BATCH_SIZE = 64
+
+    def __init__(self, database_path, table: str, max_bytes: int):
+        self.database_path = Path(database_path)
+        self.table = table
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared between threads, so each thread opens its own.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            self.database_path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # In one transaction, so no entry is written between counting the total and creating the triggers.
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._create_tables(connection)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            self._local.connection = connection
+        return connection
+
+    def _create_tables(self, connection: sqlite3.Connection) -> None:
+        table = self.table
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                           "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                           "created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table}_total_size ("
+                           "id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+        # A table of an older version, without the total, starts from its current size.
+        connection.execute(f"INSERT OR IGNORE INTO {table}_total_size (id, total) "
+                           f"SELECT 0, COALESCE(SUM(size), 0) FROM {table}")
+        connection.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_inserted AFTER INSERT ON {table} BEGIN "
+                           f"UPDATE {table}_total_size SET total = total + NEW.size; END")
+        connection.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_deleted AFTER DELETE ON {table} BEGIN "
+                           f"UPDATE {table}_total_size SET total = total - OLD.size; END")
+        connection.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_updated AFTER UPDATE OF size ON {table} BEGIN "
+                           f"UPDATE {table}_total_size SET total = total + NEW.size - OLD.size; END")
+
+    def _total_size(self, connection: sqlite3.Connection) -> int:
+        (total_size,) = connection.execute(f"SELECT total FROM {self.table}_total_size").fetchone()
+        return total_size
+
+    def _count(self, hit: bool) -> None:
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str):
+        """
+        Returns the cached value for the key, or None on a miss.
+        """
+        connection = self._connection()
+        row = connection.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        self._count(row is not None)
+        if row is None:
+            return None
+        connection.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """
+        Caches the value, then evicts the least recently used entries over max_bytes.
+        """
+        now = time.time()
+        connection = self._connection()
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete does not fire the delete trigger.
+        connection.execute(f"INSERT INTO {self.table} (key, value, size, created_at, accessed_at) "
+                           "VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+                           "size = excluded.size, created_at = excluded.created_at, "
+                           "accessed_at = excluded.accessed_at",
+                           (key, value, len(value.encode('utf-8')), now, now))
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Deletes the least recently used entries until the stored values fit in max_bytes.
+        Returns:
+             The number of deleted entries.
+        """
+        connection = self._connection()
+        excess = self._total_size(connection) - self.max_bytes
+        evicted = 0
+        while excess > 0:
+            oldest_entries = connection.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed_at LIMIT ?",
+                                                (self.EVICTION_BATCH_SIZE,)).fetchall()
+            if not oldest_entries:
+                break
+            evicted_keys = []
+            for key, size in oldest_entries:
+                if excess <= 0:
+                    break
+                evicted_keys.append((key,))
+                excess -= size
+            connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", evicted_keys)
+            evicted += len(evicted_keys)
+        return evicted
+
+    def purge(self) -> int:
+        """
+        Deletes every entry.
+        Returns:
+             The number of deleted entries.
+        """
+        return self._connection().execute(f"DELETE FROM {self.table}").rowcount
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters of this process and the current size of the cache.
+        """
+        connection = self._connection()
+        (entries,) = connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        total_size = self._total_size(connection)
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'entries': entries,
+            'bytes': total_size,
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,543 @@
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+
+from .ngram_index import NGramIndex
+
+logger = logging.getLogger(__name__)
+
+# How often, in seconds, the Excel file is checked for changes.
+GAZETTEER_CHECK_INTERVAL = 2.0
+
+# Compiled gazetteer files: magic, header length, JSON header, padding,
+# then the name offsets, the alphabetical order and the UTF-8 name data.
+INDEX_FILE_MAGIC = b'OTTGAZ03'
+INDEX_FILE_SUFFIX = '.gazetteer'
+INDEX_DATA_ALIGNMENT = 64
+
+# From this many names on, unbounded top-k queries are prefiltered with the n-gram index.
+# Below it, the k-th closest name is usually several edits away, where the prefilter keeps
+# most of the names, so scoring every name in one cdist call is as fast and simpler.
+NGRAM_PREFILTER_MIN_SIZE = 20000
+
+# Normalize some Turkish characters
+TURKISH_CHARACTER_REPLACEMENTS = {
+    'û': 'u',
+    'ç': 'c',
+    'ü': 'u',
+    'ö': 'o',
+    'î': 'i',
+    'â': 'a',
+    'ş': 's',
+    'ı': 'i',
+    'ğ': 'g',
+    # 'İ'.lower() is 'i' followed by a combining dot above.
+    '\u0307': ''
+}
+
+# Some location names may include administrative unit
+# suffixes, such as X Village, Y Town. We need to remove them before working on them.
+ADMINISTRATIVE_UNIT_SUFFIXES = [
+    ' nahiyesi',
+    ' karyesi',
+    ' koyu',
+    ' kasabasi',
+    ' mahallesi',
+    ' ilcesi',
+    ' vilayeti',
+    ' sancagi',
+    ' sancak',
+    ' kazasi',
+    ' kaza',
+    ' sehri',
+    ' ceziresi',
+]
+
+
+def normalize_location_name(location_name: str) -> str:
+    """
+    Lowercases the location name and folds the Turkish characters to ASCII.
+    Args:
+        location_name: Location name as generated by OCR and Latinization.
+    Returns:
+         The normalized location name.
+    """
+    normalized_name = location_name.lower()
+    for old, new in TURKISH_CHARACTER_REPLACEMENTS.items():
+        normalized_name = normalized_name.replace(old, new)
+    return normalized_name
+
+
+def strip_administrative_suffix(normalized_name: str) -> tuple:
+    """
+    Removes the administrative unit suffix (vilayeti, sancagi, kazasi...) from a normalized name.
+    Args:
+        normalized_name: Location name normalized with normalize_location_name.
+    Returns:
+         A (name without suffix, removed suffix) tuple. The suffix is "" if none was found.
+    """
+    for suffix in ADMINISTRATIVE_UNIT_SUFFIXES:
+        if normalized_name.endswith(suffix):
+            # Exit after first match, as there can be only one suffix
+            return normalized_name[:-len(suffix)], suffix
+    return normalized_name, ""
+
+
+def encode_names(names: list) -> tuple:
+    """
+    Encodes the names into the buffers of a Gazetteer.
+    Args:
+        names: Normalized, unique location names.
+    Returns:
+         A (UTF-8 name data, offsets, alphabetical order, version) tuple.
+    """
+    encoded_names = [name.encode('utf-8') for name in names]
+    offsets = np.zeros(len(names) + 1, dtype='<i4')
+    np.cumsum([len(encoded_name) for encoded_name in encoded_names], out=offsets[1:])
+    name_data = b''.join(encoded_names)
+    sorted_order = np.array(sorted(range(len(names)), key=names.__getitem__), dtype='<i4')
+    version = hashlib.sha256(offsets.tobytes() + name_data).hexdigest()
+    return name_data, offsets, sorted_order, version
+
+
+class _SortedNames:
+    """
+    Read-only sequence of the names of a gazetteer in alphabetical order,
+    decoding each name from the name buffer only when it is looked at.
+    """
+
+    def __init__(self, gazetteer: 'Gazetteer'):
+        self._gazetteer = gazetteer
+
+    def __len__(self) -> int:
+        return len(self._gazetteer)
+
+    def __getitem__(self, index: int) -> str:
+        return self._gazetteer.name_at(int(self._gazetteer.sorted_order[index]))
+
+
+class Gazetteer:
+    """
+    Index of the Ottoman location names.
+    Names are normalized and deduplicated once, at load time, and kept in their original
+    (sheet) order as one UTF-8 buffer with the offset of each name. Together with the
+    alphabetical order of the names and a digest of the content, the buffer is what the
+    compiled file stores, so a memory-mapped gazetteer shares these pages between processes
+    and answers prefix lookups from them. Fuzzy matching needs the names as str objects,
+    which each process decodes from the buffer on the first fuzzy query.
+    """
+
+    def __init__(self, name_data, offsets: np.ndarray, sorted_order: np.ndarray, version: str,
+                 source_path: str = None):
+        """
+        Args:
+            name_data: The UTF-8 encoded names, one after the other, e.g. a slice of a mapping.
+            offsets: Where each name starts in name_data, followed by the end of the last name.
+            sorted_order: Positions of the names in alphabetical order.
+            version: Digest of the names, see encode_names.
+            source_path: The file the names were read from, if any.
+        """
+        self.name_data = memoryview(name_data)
+        self.offsets = offsets
+        self.sorted_order = sorted_order
+        # Identifies the content, e.g. for caching results computed from it.
+        self.version = version
+        self.source_path = source_path
+
+    @classmethod
+    def from_names(cls, names, source_path: str = None) -> 'Gazetteer':
+        """
+        Builds a gazetteer from raw location names.
+        Args:
+            names: Iterable of location names. Empty values are skipped.
+            source_path: The file the names were read from, if any.
+        Returns:
+             The gazetteer.
+        """
+        unique_names = dict.fromkeys(normalize_location_name(str(name)) for name in names
+                                     if not pd.isna(name) and str(name) != "")
+        return cls(*encode_names(list(unique_names)), source_path)
+
+    @classmethod
+    def from_excel(cls, location_names_source_path: str) -> 'Gazetteer':
+        """
+        Reads the Excel list of Ottoman location names.
+        Args:
+            location_names_source_path: The path to the Excel file,
+            which has a cleaned_location_name column.
+        Returns:
+             The gazetteer.
+        """
+        df = pd.read_excel(location_names_source_path)
+        return cls.from_names(df['cleaned_location_name'], str(location_names_source_path))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def name_at(self, position: int) -> str:
+        """
+        Decodes the name at the given position from the name buffer.
+        """
+        return str(self.name_data[self.offsets[position]:self.offsets[position + 1]], 'utf-8')
+
+    @cached_property
+    def names(self) -> list:
+        """
+        The names as str objects, in their original order, decoded on first use for scoring.
+        Plain str objects are much faster to score than slices of the buffer.
+        """
+        offsets = self.offsets.tolist()
+        return [str(self.name_data[start:end], 'utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    def warm_up(self) -> None:
+        """
+        Builds the lookup structures that are otherwise built on first use.
+        """
+        self.names
+        if len(self) >= NGRAM_PREFILTER_MIN_SIZE:
+            self.ngram_index
+
+    def distance_matrix(self, normalized_names: list) -> np.ndarray:
+        """
+        Levenshtein distances between the given names and every name in the gazetteer,
+        computed in one batched pass.
+        Args:
+            normalized_names: Normalized location names without their suffixes.
+        Returns:
+             A (len(normalized_names), len(gazetteer)) matrix of distances.
+        """
+        return process.cdist(normalized_names, self.names, scorer=Levenshtein.distance,
+                             dtype=np.int32, workers=-1)
+
+    def distances(self, normalized_name: str) -> np.ndarray:
+        """
+        Levenshtein distances between the given name and every name in the gazetteer.
+        """
+        return self.distance_matrix([normalized_name])[0]
+
+    def nearest_linear(self, normalized_name: str, limit: int = 25, max_distance: int = None) -> list:
+        """
+        Finds the closest names by computing the distance to every name.
+        Ties are broken by the order of the names in the source sheet.
+        Args:
+            normalized_name: Normalized location name without its suffix.
+            limit: Maximum number of names to return.
+            max_distance: If given, only names within this distance are returned.
+        Returns:
+             List of names, closest first.
+        """
+        distances = self.distances(normalized_name)
+        order = np.argsort(distances, kind='stable')[:limit]
+        if max_distance is not None:
+            order = order[distances[order] <= max_distance]
+        return [self.names[i] for i in order]
+
+    @cached_property
+    def ngram_index(self) -> NGramIndex:
+        """
+        Trigram inverted index over the names, built on first use.
+        """
+        return NGramIndex(self.names)
+
+    def complete(self, normalized_prefix: str, limit: int = 10) -> list:
+        """
+        Finds the names starting with the given prefix, using binary search on the sorted order,
+        which only decodes the names it compares.
+        Args:
+            normalized_prefix: Normalized beginning of a location name.
+            limit: Maximum number of names to return.
+        Returns:
+             List of names in alphabetical order.
+        """
+        sorted_names = _SortedNames(self)
+        start = bisect.bisect_left(sorted_names, normalized_prefix)
+        # Every name with the prefix sorts before the prefix followed by the highest code point.
+        end = bisect.bisect_left(sorted_names, normalized_prefix + '\U0010ffff', lo=start)
+        return [sorted_names[index] for index in range(start, min(end, start + limit))]
+
+    def nearest(self, normalized_name: str, limit: int = 25, max_distance: int = None) -> list:
+        """
+        Finds the closest names to the given name, with the same ranking as nearest_linear.
+        Bounded queries, single-name queries and all queries on large gazetteers first narrow
+        the names to the candidates the trigram index allows within the distance, widening it
+        until enough names are found, so an exact hit of a single-name query is answered without
+        scoring any name. Unbounded top-k queries on smaller gazetteers score every name.
+        Args:
+            normalized_name: Normalized location name without its suffix.
+            limit: Maximum number of names to return.
+            max_distance: If given, only names within this distance are returned.
+        Returns:
+             List of names, closest first.
+        """
+        if max_distance is None and limit > 1 and len(self) < NGRAM_PREFILTER_MIN_SIZE:
+            return self.nearest_linear(normalized_name, limit)
+        return [self.names[position]
+                for _, position in self.ngram_index.search(normalized_name, limit, max_distance)]
+
+    def nearest_many(self, normalized_names: list, limit: int = 25) -> list:
+        """
+        Finds the closest names for several names at once.
+        Each row has the same ranking as nearest_linear.
+        Args:
+            normalized_names: Normalized location names without their suffixes.
+            limit: Maximum number of names to return per name.
+        Returns:
+             One list of names per given name, closest first.
+        """
+        if not normalized_names:
+            return []
+        order = np.argsort(self.distance_matrix(normalized_names), axis=1, kind='stable')[:, :limit]
+        return [[self.names[i] for i in row] for row in order]
+
+
+def default_index_path(location_names_source_path: str) -> str:
+    """
+    The compiled gazetteer file of an Excel file lives next to it, e.g. ottoman_locations.gazetteer.
+    """
+    return str(Path(location_names_source_path).with_suffix(INDEX_FILE_SUFFIX))
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    SHA-256 hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_index_file(gazetteer: Gazetteer, location_names_source_path: str, index_path: str = None) -> str:
+    """
+    Compiles the gazetteer into a binary file, which can be memory-mapped by every worker.
+    The file records the size, mtime and SHA-256 of the source, so it can be
+    invalidated when the Excel file changes. The file is replaced atomically.
+    Args:
+        gazetteer: The gazetteer to compile.
+        location_names_source_path: The Excel file the gazetteer was read from.
+        index_path: Where to write the file. Defaults to default_index_path.
+    Returns:
+         The path of the written file.
+    """
+    index_path = index_path or default_index_path(location_names_source_path)
+    source_stat = os.stat(location_names_source_path)
+    header = json.dumps({
+        'source_size': source_stat.st_size,
+        'source_mtime_ns': source_stat.st_mtime_ns,
+        'source_sha256': file_sha256(location_names_source_path),
+        'count': len(gazetteer),
+        'data_size': len(gazetteer.name_data),
+        'version': gazetteer.version,
+    }).encode('utf-8')
+
+    prefix = INDEX_FILE_MAGIC + struct.pack('<I', len(header)) + header
+    padding = b'\0' * (-len(prefix) % INDEX_DATA_ALIGNMENT)
+
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    with tempfile.NamedTemporaryFile('wb', dir=index_dir, suffix='.tmp', delete=False) as file:
+        try:
+            file.write(prefix + padding)
+            file.write(gazetteer.offsets.astype('<i4').tobytes())
+            file.write(gazetteer.sorted_order.astype('<i4').tobytes())
+            file.write(gazetteer.name_data)
+            file.flush()
+            os.fsync(file.fileno())
+            os.chmod(file.name, 0o644)
+        except OSError:
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, index_path)
+    return index_path
+
+
+def read_index_file(location_names_source_path: str, index_path: str = None):
+    """
+    Memory-maps a compiled gazetteer file. The name data, offsets and alphabetical order
+    point directly into the read-only mapping, so their pages are shared between processes.
+    Args:
+        location_names_source_path: The Excel file the index was compiled from.
+        index_path: The compiled file. Defaults to default_index_path.
+    Returns:
+         The gazetteer, or None if the file is missing, corrupt or older than the Excel file.
+    """
+    index_path = index_path or default_index_path(location_names_source_path)
+    try:
+        with open(index_path, 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        if mapping[:len(INDEX_FILE_MAGIC)] != INDEX_FILE_MAGIC:
+            return None
+        header_start = len(INDEX_FILE_MAGIC) + 4
+        (header_length,) = struct.unpack('<I', mapping[len(INDEX_FILE_MAGIC):header_start])
+        header = json.loads(mapping[header_start:header_start + header_length])
+
+        source_stat = os.stat(location_names_source_path)
+        if source_stat.st_size != header['source_size']:
+            return None
+        # A touched but unchanged file keeps its index.
+        if (source_stat.st_mtime_ns != header['source_mtime_ns']
+                and file_sha256(location_names_source_path) != header['source_sha256']):
+            return None
+
+        data_offset = header_start + header_length
+        data_offset += -data_offset % INDEX_DATA_ALIGNMENT
+        count = header['count']
+        offsets = np.frombuffer(mapping, dtype='<i4', count=count + 1, offset=data_offset)
+        data_offset += offsets.nbytes
+        sorted_order = np.frombuffer(mapping, dtype='<i4', count=count, offset=data_offset)
+        data_offset += sorted_order.nbytes
+        name_data = memoryview(mapping)[data_offset:data_offset + header['data_size']]
+        if len(name_data) != header['data_size']:
+            return None
+        version = header['version']
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+    return Gazetteer(name_data, offsets, sorted_order, version, str(location_names_source_path))
+
+
+def load_gazetteer(location_names_source_path: str) -> Gazetteer:
+    """
+    Loads the gazetteer from its compiled file if it is up to date.
+    Otherwise, reads the Excel file and compiles it for the next process.
+    Args:
+        location_names_source_path: The path to the Excel file.
+    Returns:
+         The gazetteer.
+    """
+    gazetteer = read_index_file(location_names_source_path)
+    if gazetteer is not None:
+        return gazetteer
+
+    gazetteer = Gazetteer.from_excel(location_names_source_path)
+    try:
+        write_index_file(gazetteer, location_names_source_path)
+    except OSError:
+        # E.g. a read-only data directory. The in-memory gazetteer is still usable.
+        pass
+    return gazetteer
+
+
+def _source_signature(location_names_source_path: str) -> tuple:
+    source_stat = os.stat(location_names_source_path)
+    return source_stat.st_mtime_ns, source_stat.st_size
+
+
+class _GazetteerSlot:
+    """
+    Holds the current gazetteer of an Excel file and replaces it when the file changes.
+    The new gazetteer is built in a background thread and swapped in with a single
+    assignment, so readers never wait for a rebuild or see a half-built gazetteer.
+    """
+
+    def __init__(self, location_names_source_path: str):
+        self.source_path = location_names_source_path
+        # Taken before loading, so a change during the load is picked up by the next check.
+        self.signature = _source_signature(location_names_source_path)
+        self.gazetteer = load_gazetteer(location_names_source_path)
+        self.checked_at = time.monotonic()
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def current(self) -> Gazetteer:
+        """
+        Returns the current gazetteer, starting a reload if the file has changed since the last check.
+        """
+        if time.monotonic() - self.checked_at >= GAZETTEER_CHECK_INTERVAL:
+            self.reload_if_changed()
+        return self.gazetteer
+
+    def reload_if_changed(self, wait: bool = False) -> None:
+        """
+        Starts rebuilding the gazetteer in the background if the Excel file has changed.
+        Args:
+            wait: Wait for the rebuild to finish.
+        """
+        self.checked_at = time.monotonic()
+        try:
+            signature = _source_signature(self.source_path)
+        except OSError:
+            # The file may be in the middle of being replaced. Check again later.
+            return
+        if signature == self.signature:
+            return
+
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        thread = threading.Thread(target=self._reload, args=(signature,),
+                                  name='gazetteer-reload', daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+    def _reload(self, signature: tuple) -> None:
+        try:
+            gazetteer = load_gazetteer(self.source_path)
+            gazetteer.warm_up()
+            self.gazetteer = gazetteer
+            self.signature = signature
+            logger.info("Reloaded %d location names from %s.", len(gazetteer), self.source_path)
+        except Exception:
+            # E.g. the file is still being written. Keep the old gazetteer and retry on the next check.
+            logger.exception("Failed to reload the location names from %s.", self.source_path)
+        finally:
+            self._reloading = False
+
+
+_gazetteer_slots = {}
+_gazetteer_slots_lock = threading.Lock()
+
+
+def _get_gazetteer_slot(location_names_source_path: str) -> _GazetteerSlot:
+    key = str(location_names_source_path)
+    slot = _gazetteer_slots.get(key)
+    if slot is None:
+        with _gazetteer_slots_lock:
+            slot = _gazetteer_slots.get(key)
+            if slot is None:
+                slot = _GazetteerSlot(key)
+                _gazetteer_slots[key] = slot
+    return slot
+
+
+def get_gazetteer(location_names_source_path: str) -> Gazetteer:
+    """
+    Returns the gazetteer for the given Excel file.
+    The gazetteer is loaded once per process, and rebuilt in the background
+    when the Excel file changes. Until the rebuild is done, the old one is returned.
+    Args:
+        location_names_source_path: The path to the Excel file.
+    Returns:
+         The gazetteer.
+    """
+    return _get_gazetteer_slot(location_names_source_path).current()
+
+
+def check_gazetteer_for_changes(location_names_source_path: str, wait: bool = False) -> None:
+    """
+    Checks the Excel file for changes right away, instead of waiting for GAZETTEER_CHECK_INTERVAL.
+    Args:
+        location_names_source_path: The path to the Excel file.
+        wait: Wait until the changed file is loaded.
+    """
+    _get_gazetteer_slot(location_names_source_path).reload_if_changed(wait)
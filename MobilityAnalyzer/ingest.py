@@ -0,0 +1,286 @@
+"""
+Bulk ingestion of an archive of page images: OCR, Latinization, extraction and location resolution,
+with a thread pool per stage, so e.g. Document AI and Claude requests of different pages overlap.
+The Latinization and extraction can instead be sent in message batches (see batches.py).
+Appointments are saved in batches, together with a checkpoint of their pages,
+so an interrupted run resumes with the pages that were not saved yet.
+"""
+import json
+import logging
+import queue
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from . import analyze, batches
+from .models import IngestedPage, MovementItem
+from .routing import NOT_SPECIFIED
+from .suggest_location import NO_SUGGESTION, suggest_location
+
+logger = logging.getLogger(__name__)
+
+DATE_IN_PATH = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+LOCATION_FIELDS = ['fromCity', 'toCity']
+
+
+def find_page_images(directory) -> list:
+    """
+    Finds the PNG page images under the directory, in the order of their paths.
+    """
+    return sorted(path for path in Path(directory).rglob('*') if path.is_file() and path.suffix.lower() == '.png')
+
+
+def pending_pages(directory) -> list:
+    """
+    The page images under the directory that were not ingested yet.
+    Returns:
+         (path, relative path) tuples.
+    """
+    ingested = set(IngestedPage.objects.values_list('path', flat=True))
+    pages = [(path, path.relative_to(directory).as_posix()) for path in find_page_images(directory)]
+    return [(path, relative_path) for path, relative_path in pages if relative_path not in ingested]
+
+
+def page_date(relative_path: str, default_date: date = None) -> date:
+    """
+    The date of a page, i.e. the first YYYY-MM-DD in its path, or default_date.
+    Raises:
+        ValueError: If the path has no date and no default_date is given.
+    """
+    match = DATE_IN_PATH.search(relative_path)
+    if match:
+        return date(*map(int, match.groups()))
+    if default_date is None:
+        raise ValueError(f"No YYYY-MM-DD date in {relative_path}, and no default date was given.")
+    return default_date
+
+
+def ocr_page(path: Path) -> str:
+    return analyze.document_ai_ocr(str(path))
+
+
+# The stages already run several pages at a time, so each page sends its chunks and batches one after
+# the other: the Claude requests in flight are at most the workers of the stages, not a multiple of them.
+def latinize_page(ocr_text: str) -> str:
+    return analyze.extract_text_from_claude_response(
+        analyze.latinize_page(analyze.get_claude_client(), ocr_text, max_concurrency=1))
+
+
+def extract_page(latinized_text: str) -> list:
+    return json.loads(analyze.extract_appointments(analyze.get_claude_client(), latinized_text,
+                                                   max_concurrency=1))['appointments']
+
+
+class PagePipeline:
+    """
+    Runs each page through the stages, each stage with a thread pool of its own.
+    A page goes on to the next stage as soon as it is done with the previous one.
+    Finished and failed pages are collected by results().
+    """
+
+    def __init__(self, stages: list):
+        """
+        Args:
+            stages: (function, max_workers) tuples. Each function gets the result of the previous one.
+        """
+        self._stages = [(function, ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=function.__name__))
+                        for function, max_workers in stages]
+        self._results = queue.Queue()
+        self._submitted = 0
+
+    def submit(self, page, value) -> None:
+        """
+        Sends the value through the stages. page identifies it in the results.
+        """
+        self._submitted += 1
+        self._run_stage(0, page, value)
+
+    def _run_stage(self, index: int, page, value) -> None:
+        function, executor = self._stages[index]
+        future = executor.submit(function, value)
+        future.add_done_callback(lambda done: self._stage_done(index, page, done))
+
+    def _stage_done(self, index: int, page, future) -> None:
+        if future.exception() is not None:
+            self._results.put((page, None, future.exception()))
+        elif index + 1 == len(self._stages):
+            self._results.put((page, future.result(), None))
+        else:
+            self._run_stage(index + 1, page, future.result())
+
+    def results(self):
+        """
+        Yields (page, result, exception) tuples of the submitted pages, in the order they finish.
+        """
+        while self._submitted:
+            self._submitted -= 1
+            yield self._results.get()
+
+    def shutdown(self) -> None:
+        for _, executor in self._stages:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def resolve_location(raw_location_name: str, max_distance: int) -> str:
+    """
+    The closest name of the gazetteer within max_distance, or the raw name if there is none.
+    """
+    suggestions = suggest_location(raw_location_name, settings.LOCATIONS_FILE, max_distance)
+    if not suggestions or suggestions == NO_SUGGESTION:
+        return raw_location_name
+    return suggestions[0]
+
+
+def movement_items(appointments: list, source: str, appointment_date: date, max_distance: int) -> list:
+    """
+    Unsaved MovementItems of the appointments of a page, with their locations resolved.
+    The names read on the page are kept in the notes when they are resolved to another name.
+    """
+    items = []
+    for appointment in appointments:
+        fields = {field: str(appointment.get(field, NOT_SPECIFIED))
+                  for field in ['name', 'fromTitle', 'toTitle', 'salary', 'education', *LOCATION_FIELDS]}
+        notes = []
+        for field in LOCATION_FIELDS:
+            resolved = resolve_location(fields[field], max_distance)
+            if resolved != fields[field]:
+                notes.append(f"{field} read as {fields[field]}.")
+                fields[field] = resolved
+        items.append(MovementItem(**fields, date=appointment_date, source=source[:180],
+                                  notes=" ".join(notes)[:200] or 'No notes.'))
+    return items
+
+
+def save_pages(pages: list) -> int:
+    """
+    Saves the MovementItems of the pages and their checkpoints in one transaction,
+    so a page is either saved with all of its appointments or not at all.
+    Args:
+        pages: (relative path, MovementItems) tuples.
+    Returns:
+         The number of saved MovementItems.
+    """
+    items = [item for _, page_items in pages for item in page_items]
+    with transaction.atomic():
+        MovementItem.objects.bulk_create(items)
+        IngestedPage.objects.bulk_create([IngestedPage(path=relative_path, appointments=len(page_items))
+                                          for relative_path, page_items in pages])
+    return len(items)
+
+
+def pipeline_results(pages: list, ocr_workers: int, latinization_workers: int, extraction_workers: int):
+    """
+    Runs the pages through a PagePipeline, with a thread pool per stage.
+    Yields:
+         (relative path, appointments, exception) tuples, in the order the pages finish.
+    """
+    pipeline = PagePipeline([(ocr_page, ocr_workers), (latinize_page, latinization_workers),
+                             (extract_page, extraction_workers)])
+    try:
+        for path, relative_path in pages:
+            pipeline.submit(relative_path, path)
+        yield from pipeline.results()
+    finally:
+        pipeline.shutdown()
+
+
+def message_batch_results(pages: list, ocr_workers: int):
+    """
+    OCRs the pages with a thread pool, then latinizes all of them in message batches,
+    and then extracts all of their appointments in message batches.
+    Yields:
+         (relative path, appointments, exception) tuples.
+    """
+    ocr_texts = {}
+    with ThreadPoolExecutor(max_workers=ocr_workers) as executor:
+        futures = [(relative_path, executor.submit(ocr_page, path)) for path, relative_path in pages]
+    for relative_path, future in futures:
+        if future.exception() is not None:
+            yield relative_path, None, future.exception()
+        else:
+            ocr_texts[relative_path] = future.result()
+
+    claude_client = analyze.get_claude_client()
+    latinized_pages = {relative_path: message for relative_path, message
+                       in zip(ocr_texts, batches.latinize_pages(claude_client, list(ocr_texts.values())))}
+    for relative_path, message in latinized_pages.items():
+        if message is None:
+            yield relative_path, None, Exception("The Latinization failed in the message batch.")
+
+    latinized_texts = {relative_path: analyze.extract_text_from_claude_response(message)
+                       for relative_path, message in latinized_pages.items() if message is not None}
+    extracted_pages = batches.extract_pages(claude_client, list(latinized_texts.values()))
+    for relative_path, extracted_text in zip(latinized_texts, extracted_pages):
+        try:
+            if extracted_text is None:
+                raise Exception("The extraction failed in the message batch.")
+            yield relative_path, json.loads(extracted_text)['appointments'], None
+        except Exception as e:
+            yield relative_path, None, e
+
+
+def ingest_archive(directory, ocr_workers: int = 4, latinization_workers: int = 4, extraction_workers: int = 4,
+                   batch_size: int = 100, source: str = None, default_date: date = None,
+                   max_distance: int = 2, limit: int = None, message_batches: bool = False) -> dict:
+    """
+    Ingests the page images under the directory that were not ingested yet.
+    Args:
+        directory: Directory of the page images, searched recursively.
+        ocr_workers: Pages OCR'ed at the same time.
+        latinization_workers: Pages latinized at the same time, each sending one request at a time.
+        extraction_workers: Pages whose appointments are extracted at the same time, each sending one request at a time.
+        batch_size: Appointments are saved once at least this many are ready.
+        source: Source of the appointments, by default the path of their page.
+        default_date: Date of the pages without a YYYY-MM-DD date in their path.
+        max_distance: Locations are resolved to a gazetteer name within this Levenshtein distance.
+        limit: Ingest at most this many pages.
+        message_batches: Latinize and extract the pages in message batches, which are cheaper
+        but may take hours. The appointments are only saved once the batches have ended.
+    Returns:
+         Counts of the 'pages' ingested, the 'appointments' saved, the 'failed' pages and the 'skipped' ones.
+    """
+    directory = Path(directory)
+    pages = pending_pages(directory)
+    counts = {'pages': 0, 'appointments': 0, 'failed': 0,
+              'skipped': len(find_page_images(directory)) - len(pages)}
+    if limit is not None:
+        pages = pages[:limit]
+
+    if message_batches:
+        results = message_batch_results(pages, ocr_workers)
+    else:
+        results = pipeline_results(pages, ocr_workers, latinization_workers, extraction_workers)
+    ready_pages = []
+
+    def save_ready_pages():
+        counts['appointments'] += save_pages(ready_pages)
+        counts['pages'] += len(ready_pages)
+        ready_pages.clear()
+
+    try:
+        for relative_path, appointments, exception in results:
+            try:
+                if exception is not None:
+                    raise exception
+                items = movement_items(appointments, source or relative_path,
+                                       page_date(relative_path, default_date), max_distance)
+            except Exception as e:
+                # The page is tried again by the next run. Its finished stages are served from the caches.
+                logger.error("Failed to ingest %s: %s", relative_path, e)
+                counts['failed'] += 1
+                continue
+
+            ready_pages.append((relative_path, items))
+            if sum(len(page_items) for _, page_items in ready_pages) >= batch_size:
+                save_ready_pages()
+    finally:
+        # Pages finished before an interruption are saved too.
+        if ready_pages:
+            save_ready_pages()
+        results.close()
+
+    return counts
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from . import analyze
+from .models import PageJob
+
+logger = logging.getLogger(__name__)
+
+# The Latinization is streamed in small pieces; the job saves it at most this often, in seconds.
+LATINIZATION_SAVE_INTERVAL = 0.5
+
+
+def submit_page_job(file_name: str, image: bytes) -> PageJob:
+    """
+    Queues an uploaded page for OCR and Latinization by a worker.
+    Args:
+        file_name: The name of the uploaded file.
+        image: The content of the uploaded PNG file.
+    Returns:
+         The queued job.
+    """
+    return PageJob.objects.create(file_name=file_name, image=image)
+
+
+def claim_next_job():
+    """
+    Marks the oldest queued job as running and returns it. The status is checked
+    in the same UPDATE, so two workers never claim the same job.
+    Returns:
+         The claimed job, or None if no job is queued.
+    """
+    while True:
+        job_id = PageJob.objects.filter(status=PageJob.Status.QUEUED).values_list('pk', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = PageJob.objects.filter(pk=job_id, status=PageJob.Status.QUEUED).update(
+            status=PageJob.Status.RUNNING, updated_at=timezone.now())
+        if claimed:
+            return PageJob.objects.get(pk=job_id)
+
+
+def requeue_stale_jobs(stale_after: timedelta) -> int:
+    """
+    Queues again the running jobs that made no progress for stale_after, e.g. those of a killed worker.
+    Returns:
+         The number of queued jobs.
+    """
+    return PageJob.objects.filter(status=PageJob.Status.RUNNING, updated_at__lt=timezone.now() - stale_after).update(
+        status=PageJob.Status.QUEUED, stage=PageJob.Stage.QUEUED, updated_at=timezone.now())
+
+
+def _save_progress(job: PageJob, **fields) -> None:
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save(update_fields=[*fields, 'updated_at'])
+
+
+def run_page_job(job: PageJob) -> None:
+    """
+    Runs the stages of stream_end_to_end_process for a claimed job, saving the OCR text as soon as it is ready,
+    then the Latinized text as it is generated, at most every LATINIZATION_SAVE_INTERVAL seconds,
+    so the browser can show each of them before the page is done.
+    Failures are saved in the job, not raised. The image is dropped once the job is finished.
+    """
+    try:
+        _save_progress(job, stage=PageJob.Stage.OCR)
+        ocr_text = analyze.document_ai_ocr_content(bytes(job.image))
+        _save_progress(job, ocr_text=ocr_text, latinized_text='', stage=PageJob.Stage.LATINIZATION)
+
+        latinized_text = ''
+        saved_at = time.monotonic()
+        for latinized_piece in analyze.stream_latinization(analyze.get_claude_client(), ocr_text):
+            latinized_text += latinized_piece
+            if time.monotonic() - saved_at >= LATINIZATION_SAVE_INTERVAL:
+                _save_progress(job, latinized_text=latinized_text)
+                saved_at = time.monotonic()
+        _save_progress(job, latinized_text=latinized_text, image=b'', stage=PageJob.Stage.DONE,
+                       status=PageJob.Status.DONE, finished_at=timezone.now())
+    except Exception as e:
+        logger.exception("Page job %s failed.", job.pk)
+        _save_progress(job, image=b'', status=PageJob.Status.FAILED, error=str(e), finished_at=timezone.now())
+
+
+def work(stop: threading.Event, poll_interval: float = 1.0, exit_when_idle: bool = False) -> int:
+    """
+    Runs queued jobs one after the other until stop is set, waiting poll_interval
+    seconds whenever the queue is empty. Meant to run in a worker thread.
+    Args:
+        stop: Event telling the worker to finish after its current job.
+        poll_interval: Seconds to wait before looking at an empty queue again.
+        exit_when_idle: Return as soon as the queue is empty.
+    Returns:
+         The number of jobs run.
+    """
+    jobs_run = 0
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                if exit_when_idle:
+                    break
+                stop.wait(poll_interval)
+                continue
+            run_page_job(job)
+            jobs_run += 1
+    finally:
+        connection.close()
+    return jobs_run
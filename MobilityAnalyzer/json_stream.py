@@ -0,0 +1,76 @@
+import json
+import re
+
+
+class JSONArrayStreamParser:
+    """
+    Incremental parser for the objects of one array in a JSON document that arrives in pieces,
+    e.g. {"appointments": [{...}, {...}]} streamed by Claude.
+    Each object is returned as soon as its closing brace arrives, without waiting for the rest
+    of the document. Text around the JSON, such as a code fence, is ignored.
+    """
+
+    def __init__(self, key: str):
+        self._array_start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._buffer = ""
+        self._position = 0
+        self._array_started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+        self.finished = False
+
+    def feed(self, text: str) -> list:
+        """
+        Adds the next piece of the document.
+        Args:
+            text: The next piece of the document.
+        Returns:
+             List of the objects of the array completed by this piece, in order.
+        Raises:
+            json.JSONDecodeError: If a completed object is not valid JSON.
+        """
+        self._buffer += text
+        if not self._array_started:
+            match = self._array_start.search(self._buffer)
+            if match is None:
+                return []
+            self._array_started = True
+            self._position = match.end()
+
+        objects = []
+        buffer = self._buffer
+        while self._position < len(buffer) and not self.finished:
+            character = buffer[self._position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif character == '\\':
+                    self._escaped = True
+                elif character == '"':
+                    self._in_string = False
+            elif character == '"':
+                self._in_string = True
+            elif character in '{[':
+                if self._depth == 0:
+                    self._object_start = self._position
+                self._depth += 1
+            elif character in '}]':
+                if self._depth == 0:
+                    # The closing bracket of the array itself.
+                    self.finished = True
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        objects.append(json.loads(buffer[self._object_start:self._position + 1]))
+                        self._object_start = None
+            self._position += 1
+
+        # Keep only the unfinished object.
+        keep_from = self._object_start if self._object_start is not None else self._position
+        self._buffer = buffer[keep_from:]
+        self._position -= keep_from
+        if self._object_start is not None:
+            self._object_start = 0
+        return objects
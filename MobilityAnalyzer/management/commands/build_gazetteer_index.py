@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from MobilityAnalyzer.gazetteer import Gazetteer, default_index_path, read_index_file, write_index_file
+
+
+class Command(BaseCommand):
+    help = ("Compiles the Excel list of Ottoman location names into a binary gazetteer file, "
+            "which every worker memory-maps instead of parsing the Excel file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=settings.LOCATIONS_FILE,
+                            help='Excel file with a cleaned_location_name column.')
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild even if the compiled file is up to date.')
+
+    def handle(self, *args, **options):
+        source_path = options['source']
+        index_path = default_index_path(source_path)
+
+        if not options['force'] and read_index_file(source_path) is not None:
+            self.stdout.write(f"{index_path} is up to date.")
+            return
+
+        gazetteer = Gazetteer.from_excel(source_path)
+        write_index_file(gazetteer, source_path, index_path)
+        self.stdout.write(self.style.SUCCESS(f"Compiled {len(gazetteer)} location names into {index_path}."))
@@ -0,0 +1,48 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from MobilityAnalyzer.ingest import ingest_archive
+
+
+class Command(BaseCommand):
+    help = ("OCRs, latinizes and extracts the appointments of every PNG page under a directory, "
+            "and saves them with their locations resolved. Pages saved by a previous run are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory of the page images, searched recursively.')
+        parser.add_argument('--ocr-workers', type=int, default=4,
+                            help='Pages OCR\'ed at the same time.')
+        parser.add_argument('--latinization-workers', type=int, default=4,
+                            help='Pages latinized at the same time.')
+        parser.add_argument('--extraction-workers', type=int, default=4,
+                            help='Pages whose appointments are extracted at the same time.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Appointments are saved once at least this many are ready.')
+        parser.add_argument('--source', help='Source of the appointments. By default, the path of their page.')
+        parser.add_argument('--date', type=date.fromisoformat,
+                            help='Date (YYYY-MM-DD) of the pages without a YYYY-MM-DD date in their path.')
+        parser.add_argument('--max-distance', type=int, default=2,
+                            help='Locations are resolved to a known name within this Levenshtein distance.')
+        parser.add_argument('--limit', type=int, help='Ingest at most this many pages.')
+        parser.add_argument('--message-batches', action='store_true',
+                            help='Latinize and extract in message batches: half the price, but it may take hours.')
+
+    def handle(self, *args, **options):
+        counts = ingest_archive(options['directory'],
+                                ocr_workers=options['ocr_workers'],
+                                latinization_workers=options['latinization_workers'],
+                                extraction_workers=options['extraction_workers'],
+                                batch_size=options['batch_size'],
+                                source=options['source'],
+                                default_date=options['date'],
+                                max_distance=options['max_distance'],
+                                limit=options['limit'],
+                                message_batches=options['message_batches'])
+
+        if counts['skipped']:
+            self.stdout.write(f"Skipped {counts['skipped']} pages ingested by a previous run.")
+        if counts['failed']:
+            self.stderr.write(f"Failed to ingest {counts['failed']} pages. Run the command again to retry them.")
+        self.stdout.write(self.style.SUCCESS(f"Saved {counts['appointments']} appointments "
+                                             f"from {counts['pages']} pages."))
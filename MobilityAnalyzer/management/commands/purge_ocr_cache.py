@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from MobilityAnalyzer.analyze import ocr_cache
+
+
+class Command(BaseCommand):
+    help = "Deletes the cached Document AI OCR results."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true',
+                            help='Only print the size of the cache.')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = ocr_cache.stats()
+            self.stdout.write(f"{stats['entries']} cached OCR results, "
+                              f"{stats['bytes']} of {stats['max_bytes']} bytes.")
+            return
+
+        deleted = ocr_cache.purge()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} cached OCR results."))
@@ -0,0 +1,50 @@
+import threading
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from MobilityAnalyzer.jobs import requeue_stale_jobs, work
+
+
+class Command(BaseCommand):
+    help = ("Runs the OCR and Latinization of the uploaded pages in the background. "
+            "Each thread works on one page at a time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Number of pages processed at the same time. '
+                                 'Defaults to 4, or 1 on SQLite, which writes one page at a time.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before looking at an empty queue again.')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Seconds after which a running job without progress is queued again.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(timedelta(seconds=options['stale_after']))
+        if requeued:
+            self.stdout.write(f"Queued {requeued} stale jobs again.")
+
+        thread_count = options['threads'] or (1 if connection.vendor == 'sqlite' else 4)
+        stop = threading.Event()
+        jobs_run = []
+        threads = [threading.Thread(target=lambda: jobs_run.append(work(stop, options['poll_interval'],
+                                                                        options['once'])),
+                                    name=f'page-worker-{number}')
+                   for number in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} page worker threads.")
+
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the current pages...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {sum(jobs_run)} pages."))
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MobilityAnalyzer', '0003_alter_movementitem_notes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255)),
+                ('image', models.BinaryField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('stage', models.CharField(choices=[('queued', 'Queued'), ('ocr', 'OCR'), ('latinization', 'Latinization'), ('done', 'Done')], default='queued', max_length=20)),
+                ('ocr_text', models.TextField(blank=True, default='')),
+                ('latinized_text', models.TextField(blank=True, default='')),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('MobilityAnalyzer', '0004_pagejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestedPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('appointments', models.PositiveIntegerField(default=0)),
+                ('ingested_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -17,3 +17,59 @@ class MovementItem(models.Model):
 
 def __str__(self):
     return self.name
+
+
+# PageJob holds an uploaded page waiting for, or going through, OCR and Latinization in a worker
+class PageJob(models.Model):
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    class Stage(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        OCR = 'ocr', 'OCR'
+        LATINIZATION = 'latinization', 'Latinization'
+        DONE = 'done', 'Done'
+
+    file_name = models.CharField(max_length=255)
+    image = models.BinaryField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.QUEUED, db_index=True)
+    stage = models.CharField(max_length=20, choices=Stage.choices, default=Stage.QUEUED)
+    ocr_text = models.TextField(blank=True, default='')
+    latinized_text = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+
+    def __str__(self):
+        return f"{self.file_name} ({self.status})"
+
+    def to_dict(self) -> dict:
+        """
+        The progress of the job, as sent to the browser.
+        """
+        return {
+            'job_id': self.pk,
+            'status': self.status,
+            'stage': self.stage,
+            'OCR': self.ocr_text,
+            'Latinized': self.latinized_text,
+            'error': self.error,
+        }
+
+
+# IngestedPage records a page image of an archive whose appointments were saved by the ingest_archive command
+class IngestedPage(models.Model):
+    path = models.CharField(max_length=500, unique=True)
+    appointments = models.PositiveIntegerField(default=0)
+    ingested_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.path
@@ -0,0 +1,115 @@
+from collections import defaultdict
+
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+
+# Marks the start and the end of a word, so the first and last characters get their own n-grams.
+NGRAM_PADDING = '\0'
+
+
+def word_ngrams(word: str, n: int = 3) -> set:
+    """
+    The distinct character n-grams of the padded word.
+    """
+    padded_word = NGRAM_PADDING * (n - 1) + word + NGRAM_PADDING * (n - 1)
+    return {padded_word[i:i + n] for i in range(len(padded_word) - n + 1)}
+
+
+class NGramIndex:
+    """
+    Inverted index from character n-grams to the positions of the words containing them.
+    It narrows a word list to the candidates that can be within a given Levenshtein distance
+    of a query, using the q-gram lemma: one edit changes at most n of the query's n-grams,
+    so a word within distance k shares at least (number of query n-grams - k * n) of them.
+    """
+
+    def __init__(self, words: list, n: int = 3):
+        self.words = words
+        # Candidates are picked out of this array with fancy indexing, without a Python loop.
+        self.word_array = np.array(words, dtype=object)
+        self.n = n
+        self.lengths = np.fromiter((len(word) for word in words), dtype=np.int32, count=len(words))
+        self.gram_counts = np.zeros(len(words), dtype=np.int32)
+        postings = defaultdict(list)
+        for position, word in enumerate(words):
+            grams = word_ngrams(word, n)
+            self.gram_counts[position] = len(grams)
+            for gram in grams:
+                postings[gram].append(position)
+        self.postings = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+        self.positions = {}
+        for position, word in enumerate(words):
+            self.positions.setdefault(word, position)
+
+    def shared_ngram_counts(self, word: str) -> tuple:
+        """
+        Counts the n-grams each word shares with the given word.
+        Returns:
+             A (number of distinct n-grams of the word, array of counts per word) tuple.
+        """
+        query_grams = word_ngrams(word, self.n)
+        counts = np.zeros(len(self.words), dtype=np.int32)
+        for gram in query_grams:
+            positions = self.postings.get(gram)
+            if positions is not None:
+                counts[positions] += 1
+        return len(query_grams), counts
+
+    def candidates(self, word: str, max_distance: int) -> np.ndarray:
+        """
+        Positions of the words that can be within max_distance of the given word.
+        Every word within the distance is included; some farther words may be too.
+        """
+        query_gram_count, counts = self.shared_ngram_counts(word)
+        return np.flatnonzero(self._candidate_mask(word, max_distance, query_gram_count, counts))
+
+    def _candidate_mask(self, word: str, max_distance: int, query_gram_count: int, counts: np.ndarray) -> np.ndarray:
+        # The lemma holds from the side of either word.
+        min_shared = np.maximum(self.gram_counts, query_gram_count) - max_distance * self.n
+        return (np.abs(self.lengths - len(word)) <= max_distance) & (counts >= min_shared)
+
+    def search(self, word: str, limit: int, max_distance: int = None) -> list:
+        """
+        Finds the closest words to the given word, widening the allowed distance one edit at a time
+        and computing the exact distance only for the new candidates of each step.
+        An exact match is found on the first step without scoring any other word.
+        Ties are broken by the position of the words in the list,
+        so the result is the same as sorting all words by (distance, position).
+        Args:
+            word: The word to look up.
+            limit: Maximum number of matches to return.
+            max_distance: If given, only words within this distance are returned.
+        Returns:
+             List of (distance, position) tuples, closest first.
+        """
+        if not self.words or limit <= 0:
+            return []
+
+        exact_position = self.positions.get(word)
+        if limit == 1 and exact_position is not None:
+            return [(0, exact_position)]
+
+        query_gram_count, counts = self.shared_ngram_counts(word)
+        # -1 marks the words whose distance is not computed yet.
+        distances = np.full(len(self.words), -1, dtype=np.int32)
+        # No word is farther than this, so every word is a candidate at this distance.
+        widest_distance = max(len(word), int(self.lengths.max()))
+        if max_distance is not None:
+            widest_distance = min(widest_distance, max_distance)
+
+        allowed_distance = 0
+        while True:
+            mask = self._candidate_mask(word, allowed_distance, query_gram_count, counts)
+            new_candidates = np.flatnonzero(mask & (distances < 0))
+            if len(new_candidates):
+                distances[new_candidates] = process.cdist(
+                    [word], self.word_array[new_candidates],
+                    scorer=Levenshtein.distance, dtype=np.int32)[0]
+
+            # Every word within allowed_distance is a candidate, so this set is complete.
+            matches = np.flatnonzero(mask & (distances <= allowed_distance))
+            if len(matches) >= limit or allowed_distance >= widest_distance:
+                order = np.lexsort((matches, distances[matches]))[:limit]
+                return [(int(distances[matches[i]]), int(matches[i])) for i in order]
+            allowed_distance += 1
@@ -44,8 +44,10 @@ STRUCTURED_DATA_EXTRACTION_SYSTEM_PROMPT = """You are a smart assistant. You kno
             City names may include the type of administrative unit, such as "kaza" or "şehir" or "sancak".
             Pay attention to "from" and "to" in the appointments. The "from" is the previous position and the "to" is the
             new position.
-            Consider the example: 
+            Please respond only with the JSON data, without any additional explanation or commentary."""
+
+# Sent after the extraction system prompt. Both are static, so they are cached together by Claude.
+STRUCTURED_DATA_EXTRACTION_EXAMPLES = """Consider the example: 
             "Limni Sancağı Bidayet Mahkemesi Müdde-i Umumi Muavinliği
             Çorlu Kazası Bidayet Mahkeme-i Ceza Dairesi Reisi
-            Meziyet-lü Ahmed Naim Bey'e" implies that Ahmed Naim bey was appointed to Limni from Çorlu and so on.
-            Please respond only with the JSON data, without any additional explanation or commentary."""
\ No newline at end of file
+            Meziyet-lü Ahmed Naim Bey'e" implies that Ahmed Naim bey was appointed to Limni from Çorlu and so on."""
\ No newline at end of file
@@ -0,0 +1,75 @@
+import json
+import threading
+from collections import Counter, defaultdict
+
+from .translation_memory import split_latinized_lines
+
+NOT_SPECIFIED = "Not specified"
+
+
+def latinization_problem(ottoman_text: str, latinized_text: str):
+    """
+    Cheap check of a latinization, made before accepting the answer of the fast model.
+    Returns:
+         The reason the latinization looks wrong, or None if it looks fine.
+    """
+    ocr_line_count = len([line for line in ottoman_text.split("\n") if line.strip()])
+    latinized_line_count = len([line for line in split_latinized_lines(latinized_text) if line.strip()])
+    if latinized_line_count == 0:
+        return "empty latinization"
+    if latinized_line_count != ocr_line_count:
+        return f"{latinized_line_count} latinized lines for {ocr_line_count} OCR lines"
+    return None
+
+
+def extraction_problem(extracted_text: str, max_not_specified_ratio: float):
+    """
+    Cheap check of an extraction, made before accepting the answer of the fast model.
+    Args:
+        extracted_text: Claude's JSON answer.
+        max_not_specified_ratio: Largest accepted share of "Not specified" fields.
+    Returns:
+         The reason the extraction looks wrong, or None if it looks fine.
+    """
+    try:
+        extraction = json.loads(extracted_text[extracted_text.find('{'):extracted_text.rfind('}') + 1])
+    except json.JSONDecodeError:
+        return "invalid JSON"
+
+    appointments = extraction.get('appointments')
+    if not isinstance(appointments, list) or not all(isinstance(appointment, dict) for appointment in appointments):
+        return "no appointments list"
+
+    fields = [value for appointment in appointments for value in appointment.values()]
+    not_specified = sum(value == NOT_SPECIFIED for value in fields)
+    if fields and not_specified / len(fields) > max_not_specified_ratio:
+        return f"{not_specified} of {len(fields)} fields not specified"
+    return None
+
+
+class RoutingStats:
+    """
+    Counts, per stage, the requests answered by the fast model and those escalated to the large one.
+    """
+
+    def __init__(self):
+        self._counts = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, escalated: bool) -> None:
+        with self._lock:
+            self._counts[stage].update(routed=1, escalated=int(escalated))
+
+    def escalation_rate(self, stage: str) -> float:
+        with self._lock:
+            counts = self._counts[stage]
+            return counts['escalated'] / counts['routed'] if counts['routed'] else 0.0
+
+    def stats(self) -> dict:
+        """
+        Number of requests routed to the fast model, and escalated, per stage.
+        """
+        with self._lock:
+            return {stage: {'routed': counts['routed'], 'escalated': counts['escalated'],
+                            'escalation_rate': counts['escalated'] / counts['routed'] if counts['routed'] else 0.0}
+                    for stage, counts in self._counts.items()}
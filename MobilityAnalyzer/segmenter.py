@@ -0,0 +1,29 @@
+import re
+
+# Each appointment in the Ceride ends with the person it is addressed to, in the dative:
+# "... Mehmed Emin Efendi'ye", "... Tevfik Bey'e", "... Paşa'ya", also without the apostrophe.
+RECIPIENT_CLAUSE = re.compile(
+    r"\b(?:Efendi|Bey|Beğ|Paşa|Ağa|Hanım|Hoca)(?:ler|lar)?['’ʼ`]?(?:y[ea]|[ea])\b")
+
+# Line breaks (also escaped ones, as Claude writes them) and punctuation left between two blocks.
+BLOCK_PADDING = re.compile(r"^(?:\s|\\n|[.,;:])+|(?:\s|\\n)+$")
+
+
+def segment_appointments(latinized_text: str) -> list:
+    """
+    Splits a latinized text into appointment blocks, each ending with its recipient clause.
+    Text after the last recipient clause, e.g. an appointment continued on the next page,
+    makes a block of its own.
+    Args:
+        latinized_text: Latinized appointment text.
+    Returns:
+         List of the non-empty blocks, without the line breaks around them, in the order of the text.
+    """
+    blocks = []
+    block_start = 0
+    for match in RECIPIENT_CLAUSE.finditer(latinized_text):
+        blocks.append(latinized_text[block_start:match.end()])
+        block_start = match.end()
+    blocks.append(latinized_text[block_start:])
+    blocks = [BLOCK_PADDING.sub("", block) for block in blocks]
+    return [block for block in blocks if block]
@@ -1,81 +1,105 @@
 import re
-import pandas as pd
-import Levenshtein as Lev
 
+from .cache import LRUCache
+from .gazetteer import get_gazetteer, normalize_location_name, strip_administrative_suffix
 
-def suggest_location(raw_location_name: str, location_names_source_path: str) -> list:
+NO_SUGGESTION = ["No suggestion."]
+
+# Suggestions keyed by (normalized name, suffix, max distance, gazetteer version).
+# The version changes with the content of the gazetteer, so stale entries are never hit.
+SUGGESTION_CACHE_SIZE = 4096
+suggestion_cache = LRUCache(SUGGESTION_CACHE_SIZE)
+
+
+def _has_location_name(raw_location_name: str) -> bool:
+    """
+    Checks if the raw location name is worth looking up.
+    """
+    return not (raw_location_name == ""
+                or not isinstance(raw_location_name, str) or not bool(re.search(r'[a-zA-Z]', raw_location_name))
+                or raw_location_name == "Not specified")
+
+
+def suggest_location(raw_location_name: str, location_names_source_path: str, max_distance: int = None) -> list:
     """
-    Reads the Excel list of Ottoman location names
-    and makes 25 suggestions using Levenshtein distance.
+    Makes 25 suggestions from the list of Ottoman location names
+    using Levenshtein distance. The Excel list is read once per process,
+    and the suggestions for recurring names are served from suggestion_cache.
     Args:
-        location_names_source_path:
+        location_names_source_path: The path to the Excel list of location names.
         raw_location_name: Location name as generated by
         OCR and Latinization.
+        max_distance: If given, only names within this Levenshtein distance are suggested.
     Returns:
          An array of 25 suggested location names as string.
     """
 
-    if (raw_location_name == ""
-            or raw_location_name is None or not bool(re.search(r'[a-zA-Z]', raw_location_name))
-            or raw_location_name == "Not specified"):
-        return ["No suggestion."]
-
-    raw_location_name_lowercased = raw_location_name.lower()
-
-    # Normalize some Turkish characters
-    replacements = {
-        'û': 'u',
-        'ç': 'c',
-        'ü': 'u',
-        'ö': 'o',
-        'î': 'i',
-        'â': 'a',
-        'ş': 's',
-        'ı': 'i',
-        'ğ': 'g'
-    }
-
-    # Apply all replacements
-    for old, new in replacements.items():
-        raw_location_name_lowercased = raw_location_name_lowercased.replace(old, new)
-
-    # Some location names may include administrative unit
-    # suffixes, such as X Village, Y Town. We need to remove them before working on them.
-    # List of suffixes to remove
-    suffixes = [
-        ' nahiyesi',
-        ' karyesi',
-        ' koyu',
-        ' kasabasi',
-        ' mahallesi',
-        ' ilcesi',
-        ' vilayeti',
-        ' sancagi',
-        ' sancak',
-        ' kazasi',
-        ' kaza',
-        ' sehri',
-        ' ceziresi',
-    ]
-
-    # Remove suffix if found
-    suffix_from_raw = ""
-    for suffix in suffixes:
-        if raw_location_name_lowercased.endswith(suffix):
-            suffix_from_raw = suffix
-            raw_location_name_lowercased = raw_location_name_lowercased[:-len(suffix)]
-            break  # Exit after first match, as there can be only one suffix
-
-    # Read the Excel file containing the Ottoman location names
-    df = pd.read_excel(location_names_source_path)
-
-    # Calculate the Levenshtein distance
-    df['distance'] = (df['cleaned_location_name'].
-                      apply(lambda x: Lev.distance(str(x), str(raw_location_name_lowercased))))
-
-    # Sort the DataFrame by the distance and filter out same results
-    df = df.sort_values(by='distance')
-    df = df.drop_duplicates(subset='cleaned_location_name')
-
-    # Return the top 25 suggestions as json
-    return df['cleaned_location_name'].head(25).apply(lambda x: x + suffix_from_raw).to_list()
+    if not _has_location_name(raw_location_name):
+        return list(NO_SUGGESTION)
+
+    # Remove the administrative unit suffix, and add it back to the suggestions.
+    location_name, suffix_from_raw = strip_administrative_suffix(normalize_location_name(raw_location_name))
+
+    gazetteer = get_gazetteer(location_names_source_path)
+    cache_key = (location_name, suffix_from_raw, max_distance, gazetteer.version)
+    suggestions = suggestion_cache.get(cache_key)
+    if suggestions is None:
+        suggestions = tuple(suggestion + suffix_from_raw
+                            for suggestion in gazetteer.nearest(location_name, 25, max_distance))
+        suggestion_cache.put(cache_key, suggestions)
+    return list(suggestions)
+
+
+def suggest_locations(raw_location_names: list, location_names_source_path: str) -> list:
+    """
+    Makes 25 suggestions for each of the given location names, computing
+    the distances of the uncached names to the gazetteer in a single batch.
+    Args:
+        raw_location_names: Location names as generated by OCR and Latinization.
+        location_names_source_path: The path to the Excel list of location names.
+    Returns:
+         One array of suggested location names per given name, in the same order.
+    """
+    gazetteer = get_gazetteer(location_names_source_path)
+
+    # Look up each distinct name only once.
+    suggestions = {}
+    lookups = {}
+    for raw_location_name in raw_location_names:
+        if not _has_location_name(raw_location_name) or raw_location_name in suggestions:
+            continue
+        location_name, suffix_from_raw = strip_administrative_suffix(normalize_location_name(raw_location_name))
+        cache_key = (location_name, suffix_from_raw, None, gazetteer.version)
+        suggestions[raw_location_name] = suggestion_cache.get(cache_key)
+        if suggestions[raw_location_name] is None:
+            lookups[raw_location_name] = (location_name, cache_key)
+
+    nearest_names = gazetteer.nearest_many([location_name for location_name, _ in lookups.values()], 25)
+    for (raw_location_name, (_, cache_key)), names in zip(lookups.items(), nearest_names):
+        _, suffix_from_raw, _, _ = cache_key
+        suggestions[raw_location_name] = tuple(name + suffix_from_raw for name in names)
+        suggestion_cache.put(cache_key, suggestions[raw_location_name])
+
+    return [list(suggestions[raw_location_name]) if _has_location_name(raw_location_name) else list(NO_SUGGESTION)
+            for raw_location_name in raw_location_names]
+
+
+def complete_location(raw_location_prefix: str, location_names_source_path: str, limit: int = 10) -> list:
+    """
+    Completes a partially typed location name from the list of Ottoman location names.
+    The prefix is normalized like in suggest_location, and a complete
+    administrative unit suffix is kept on the completions.
+    Args:
+        raw_location_prefix: The beginning of a location name, as typed by the user.
+        location_names_source_path: The path to the Excel list of location names.
+        limit: Maximum number of completions.
+    Returns:
+         An array of location names starting with the prefix.
+    """
+    if not _has_location_name(raw_location_prefix):
+        return []
+
+    location_prefix, suffix_from_raw = strip_administrative_suffix(normalize_location_name(raw_location_prefix))
+
+    gazetteer = get_gazetteer(location_names_source_path)
+    return [completion + suffix_from_raw for completion in gazetteer.complete(location_prefix, limit)]
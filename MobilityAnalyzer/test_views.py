@@ -105,4 +105,44 @@ class ViewTestCase(TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertTrue(len(response.json()) > 0)
 
+    def test_find_location_suggestions_invalid_max_distance(self):
+        for max_distance in ["abc", -3, [1]]:
+            response = self.client.post(reverse('find_location_suggestions'),
+                                        json.dumps({"location_name": "Edirne", "max_distance": max_distance}),
+                                        content_type='application/json')
+
+            self.assertEqual(response.status_code, 400)
+
+    def test_find_location_suggestions_batch(self):
+        location_names = [location["location_name"] for location in self.location_suggestions_test]
+        response = self.client.post(reverse('find_location_suggestions_batch'),
+                                    json.dumps({"location_names": location_names + ["Not specified"]}),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        suggestions = response.json()['suggestions']
+        self.assertEqual(len(suggestions), len(location_names) + 1)
+        self.assertIn("istanbul", suggestions[0])
+        self.assertIn("ankara", suggestions[2])
+        self.assertEqual(suggestions[3], ["No suggestion."])
+
+    def test_find_location_suggestions_batch_invalid(self):
+        response = self.client.post(reverse('find_location_suggestions_batch'),
+                                    json.dumps({"location_names": "Angora"}),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
 
+    def test_location_typeahead(self):
+        response = self.client.get(reverse('location_typeahead'), {'q': 'Edir'})
+
+        self.assertEqual(response.status_code, 200)
+        suggestions = response.json()['suggestions']
+        self.assertIn("edirne", suggestions)
+        self.assertTrue(all(suggestion.startswith("edir") for suggestion in suggestions))
+
+    def test_location_typeahead_empty(self):
+        response = self.client.get(reverse('location_typeahead'), {'q': ''})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['suggestions'], [])
@@ -0,0 +1,85 @@
+import hashlib
+import re
+
+from .cache import PersistentCache
+
+# Claude writes the line breaks of the OCR text as an escaped \n, usually followed by a real one.
+LATINIZED_LINE_BREAK = re.compile(r'\\n\n?|\n')
+LATINIZED_LINE_SEPARATOR = '\\n\n'
+# Line breaks at the end of a latinization still being generated, possibly incomplete, e.g. a lone backslash.
+TRAILING_LATINIZED_LINE_BREAKS = re.compile(r'(?:\\n\n?|\n|\\)+\Z')
+
+
+def split_latinized_lines(latinized_text: str) -> list:
+    """
+    Splits a latinized text into its lines, whichever line break Claude used.
+    A trailing line break does not make an extra empty line.
+    """
+    lines = LATINIZED_LINE_BREAK.split(latinized_text)
+    if lines and lines[-1].strip() == "":
+        lines.pop()
+    return lines
+
+
+def join_latinized_lines(latinized_lines: list) -> str:
+    """
+    Joins latinized lines with the line break the latinization prompt asks for.
+    """
+    return LATINIZED_LINE_SEPARATOR.join(latinized_lines)
+
+
+def latinized_prefix(partial_text: str) -> str:
+    """
+    The part of a latinization still being generated that is sure to start its lines joined
+    by join_latinized_lines: the trailing line breaks are left out until the text after them arrives.
+    """
+    return join_latinized_lines(split_latinized_lines(TRAILING_LATINIZED_LINE_BREAKS.sub('', partial_text)))
+
+
+class TranslationMemory(PersistentCache):
+    """
+    Remembers the latinization of each OCR line Claude has transliterated.
+    Stock lines (court names, headings, honorifics) recur across pages,
+    so only the lines that were never seen before have to be sent again.
+    Lines are remembered per version, e.g. model and prompt, of the latinization.
+    """
+
+    @staticmethod
+    def line_key(ocr_line: str, version: str) -> str:
+        return f"{hashlib.sha256(ocr_line.strip().encode('utf-8')).hexdigest()}:{version}"
+
+    def lookup_lines(self, ocr_lines: list, version: str) -> dict:
+        """
+        Finds the remembered latinizations of the given lines.
+        Args:
+            ocr_lines: Lines of an OCR text.
+            version: Version of the latinization.
+        Returns:
+             Dict from the index of each remembered non-empty line to its latinization.
+        """
+        known_lines = {}
+        for index, ocr_line in enumerate(ocr_lines):
+            if ocr_line.strip():
+                latinized_line = self.get(self.line_key(ocr_line, version))
+                if latinized_line is not None:
+                    known_lines[index] = latinized_line
+        return known_lines
+
+    def learn_lines(self, ocr_lines: list, latinized_lines: list, version: str):
+        """
+        Remembers the latinization of each line. Lines are only paired up when the
+        non-empty lines of both texts match one to one; otherwise nothing is stored.
+        Args:
+            ocr_lines: Lines of an OCR text.
+            latinized_lines: Lines of its latinization.
+            version: Version of the latinization.
+        Returns:
+             Dict from each stripped OCR line to its latinization, or None if the lines do not match.
+        """
+        ocr_lines = [line.strip() for line in ocr_lines if line.strip()]
+        latinized_lines = [line.strip() for line in latinized_lines if line.strip()]
+        if len(ocr_lines) != len(latinized_lines):
+            return None
+        for ocr_line, latinized_line in zip(ocr_lines, latinized_lines):
+            self.put(self.line_key(ocr_line, version), latinized_line)
+        return dict(zip(ocr_lines, latinized_lines))
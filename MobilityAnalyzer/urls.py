@@ -4,8 +4,18 @@ from . import views
 urlpatterns = [
     path("", views.ocr, name="index"),
     path("ocr_and_latinize_image", views.ocr_and_latinize_image, name="ocr_and_latinize_image"),
+    path("ocr_and_latinize_image_stream", views.ocr_and_latinize_image_stream,
+         name="ocr_and_latinize_image_stream"),
+    path("submit_page", views.submit_page, name="submit_page"),
+    path("page_jobs/<int:job_id>", views.page_job_status, name="page_job_status"),
     path("extract_appointment_data", views.extract_appointment_data, name="extract_appointment_data"),
+    path("extract_appointment_data_stream", views.extract_appointment_data_stream,
+         name="extract_appointment_data_stream"),
+    path("reextract_appointment_data", views.reextract_appointment_data, name="reextract_appointment_data"),
     path("save_appointments", views.save_extracted_appointment_data, name="save_appointments"),
     path("find_location_suggestions", views.find_location_suggestions, name="find_location_suggestions"),
+    path("find_location_suggestions_batch", views.find_location_suggestions_batch,
+         name="find_location_suggestions_batch"),
+    path("location_typeahead", views.location_typeahead, name="location_typeahead"),
 ]
 
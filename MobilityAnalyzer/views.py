@@ -1,45 +1,151 @@
+import inspect
 import json
-import os
-from pathlib import Path
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.shortcuts import render
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import get_object_or_404, render
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET, require_POST
 
-from .analyze import extract_appointments, end_to_end_process, initialize_claude
-from .suggest_location import suggest_location
-from .models import MovementItem
+from . import analyze_async
+from .analyze import (
+    end_to_end_process,
+    extract_appointments,
+    get_claude_client,
+    read_uploaded_png,
+    reextract_appointments,
+    stream_appointments,
+    stream_end_to_end_process
+)
+from .jobs import submit_page_job
+from .suggest_location import complete_location, suggest_location, suggest_locations
+from .models import MovementItem, PageJob
 
 
 def ocr(request):
-    return render(request, 'ocr.html')
+    # Under ASGI the page streams the OCR and Latinization itself; under WSGI it queues them for the page worker.
+    return render(request, 'ocr.html', {'stream_pages': isinstance(request, ASGIRequest)})
 
 
-def ocr_and_latinize_image(request) -> JsonResponse:
+async def ocr_and_latinize_image(request) -> JsonResponse:
     """
-    OCR and Latinize the uploaded Image file
+    OCR and Latinize the uploaded Image file.
+    Under ASGI, the page waits for Document AI and Claude on the event loop, without holding a thread.
+    Under WSGI, it goes through the synchronous pipeline and its shared clients, since every request
+    runs on an event loop of its own, whose asynchronous clients would never be reused nor closed.
     Args:
         request: The HTTP request object
     Returns:
         A JSON response containing the OCR'ed and Latinized text
     """
-    file_path = None
-    try:
-        if 'file' not in request.FILES:
-            return JsonResponse({'message': 'No file was uploaded'}, status=400)
+    if 'file' not in request.FILES:
+        return JsonResponse({'message': 'No file was uploaded'}, status=400)
 
-        file_path = Path('./media') / request.FILES['file'].name
-        file_path.parent.mkdir(exist_ok=True)
-        file_path.write_bytes(request.FILES['file'].read())
-        return end_to_end_process(str(file_path))
+    try:
+        image_content = read_uploaded_png(request.FILES['file'])
+    except ValueError as e:
+        return JsonResponse({'message': str(e)}, status=400)
 
+    try:
+        if isinstance(request, ASGIRequest):
+            return await analyze_async.end_to_end_process(image_content)
+        return await sync_to_async(end_to_end_process)(image_content)
     except Exception as e:
         return JsonResponse({'message': f'Failed to OCR and Latinize the document: {e}'}, status=500)
 
-    finally:
-        if file_path.exists():
-            file_path.unlink()
+
+def server_sent_event(event: str, data: dict) -> str:
+    """
+    Formats a server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream_response(events) -> StreamingHttpResponse:
+    """
+    Streams (event, data) tuples to the browser as server-sent events.
+    Args:
+        events: Generator of (event, data) tuples, asynchronous under ASGI and synchronous under WSGI,
+        since Django buffers a synchronous iterator under ASGI (and an asynchronous one under WSGI).
+    Returns:
+         A text/event-stream response
+    """
+    if inspect.isasyncgen(events):
+        async def messages():
+            async for event, data in events:
+                yield server_sent_event(event, data)
+        response = StreamingHttpResponse(messages(), content_type='text/event-stream')
+    else:
+        response = StreamingHttpResponse((server_sent_event(event, data) for event, data in events),
+                                         content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies such as nginx from buffering the events.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_POST
+async def ocr_and_latinize_image_stream(request) -> StreamingHttpResponse:
+    """
+    OCR and Latinize the uploaded Image file, streaming the results as server-sent events:
+    'ocr' with the OCR'ed text as soon as it is ready, then 'latinized' with each piece
+    of the Latinized text, and finally 'done' (or 'error').
+    Under ASGI, the page waits for Document AI and Claude on the event loop, without holding a thread.
+    Args:
+        request: The HTTP request object
+    Returns:
+        A text/event-stream response
+    """
+    if 'file' not in request.FILES:
+        return JsonResponse({'message': 'No file was uploaded'}, status=400)
+
+    try:
+        image_content = read_uploaded_png(request.FILES['file'])
+    except ValueError as e:
+        return JsonResponse({'message': str(e)}, status=400)
+
+    if isinstance(request, ASGIRequest):
+        return event_stream_response(analyze_async.stream_end_to_end_process(image_content))
+    return event_stream_response(stream_end_to_end_process(image_content))
+
+
+@require_POST
+def submit_page(request) -> JsonResponse:
+    """
+    Queues the uploaded Image file for OCR and Latinization by the page worker
+    (manage.py run_page_worker) and answers right away with the ID of the job.
+    Args:
+        request: The HTTP request object
+    Returns:
+        A JSON response containing the job ID
+    """
+    if 'file' not in request.FILES:
+        return JsonResponse({'message': 'No file was uploaded'}, status=400)
+
+    uploaded_file = request.FILES['file']
+    try:
+        image_content = read_uploaded_png(uploaded_file)
+    except ValueError as e:
+        return JsonResponse({'message': str(e)}, status=400)
+
+    job = submit_page_job(uploaded_file.name, image_content)
+    return JsonResponse({'job_id': job.pk}, status=202)
+
+
+@require_GET
+def page_job_status(request, job_id: int) -> JsonResponse:
+    """
+    Reports the progress of a page job: its status, its current stage,
+    and the OCR'ed and Latinized text as soon as each is ready.
+    Args:
+        request: The HTTP request object
+        job_id: The ID returned by submit_page
+    Returns:
+        A JSON response containing the progress of the job
+    """
+    job = get_object_or_404(PageJob.objects.defer('image'), pk=job_id)
+    return JsonResponse(job.to_dict())
 
 
 @require_POST
@@ -83,9 +189,11 @@ def save_extracted_appointment_data(request) -> JsonResponse:
 
 
 @require_POST
-def extract_appointment_data(request) -> JsonResponse:
+async def extract_appointment_data(request) -> JsonResponse:
     """
-    Extract appointment data from the Latinized text
+    Extract appointment data from the Latinized text.
+    Under ASGI, the batches are extracted on the event loop; under WSGI, by the synchronous pipeline,
+    see ocr_and_latinize_image.
     Args:
         request: The HTTP request object, containing the Latinized text
     Returns:
@@ -95,18 +203,88 @@ def extract_appointment_data(request) -> JsonResponse:
         body_data = json.loads(request.body)
         latinized_text = body_data.get('text')
 
-        try:
-            claude_client = initialize_claude()
-        except Exception:
-            raise Exception("Failed to initialize the Claude client.")
+        if isinstance(request, ASGIRequest):
+            extracted_text = await analyze_async.extract_appointments(analyze_async.get_claude_client(),
+                                                                      latinized_text)
+        else:
+            extracted_text = await sync_to_async(extract_appointments)(get_claude_client(), latinized_text)
+        return JsonResponse(json.loads(extracted_text), status=200)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'message': 'Invalid JSON'}, status=400)
+
 
-        extracted_appointments = json.loads(extract_appointments(claude_client, latinized_text))
+@require_POST
+async def reextract_appointment_data(request) -> JsonResponse:
+    """
+    Extract appointment data again after the Latinized text was edited,
+    sending only the changed appointment blocks to Claude, on the event loop under ASGI
+    and by the synchronous pipeline under WSGI, see ocr_and_latinize_image.
+    Args:
+        request: The HTTP request object, containing the previous and the edited
+        Latinized text, and the appointments extracted from the previous text
+    Returns:
+         A JSON response containing the extracted appointment data
+    """
+    try:
+        body_data = json.loads(request.body)
+        previous_text = body_data.get('previous_text')
+        latinized_text = body_data.get('text')
+        previous_appointments = body_data.get('previous_appointments')
+        if not isinstance(previous_text, str) or not isinstance(latinized_text, str) \
+                or not isinstance(previous_appointments, list):
+            return JsonResponse({'message': 'previous_text, text and previous_appointments are required'},
+                                status=400)
+
+        if isinstance(request, ASGIRequest):
+            extracted_appointments = await analyze_async.reextract_appointments(
+                analyze_async.get_claude_client(), previous_text, latinized_text, previous_appointments)
+        else:
+            extracted_appointments = await sync_to_async(reextract_appointments)(
+                get_claude_client(), previous_text, latinized_text, previous_appointments)
         return JsonResponse(extracted_appointments, status=200)
 
     except json.JSONDecodeError:
         return JsonResponse({'message': 'Invalid JSON'}, status=400)
 
 
+@require_POST
+async def extract_appointment_data_stream(request) -> StreamingHttpResponse:
+    """
+    Extract appointment data from the Latinized text, streaming each appointment
+    as a server-sent 'appointment' event as soon as it is extracted, then 'done' (or 'error').
+    Under ASGI, the batches are extracted on the event loop, without holding a thread.
+    Args:
+        request: The HTTP request object, containing the Latinized text
+    Returns:
+         A text/event-stream response
+    """
+    try:
+        body_data = json.loads(request.body)
+        latinized_text = body_data.get('text')
+    except json.JSONDecodeError:
+        return JsonResponse({'message': 'Invalid JSON'}, status=400)
+
+    async def async_events():
+        try:
+            async for appointment in analyze_async.stream_appointments(analyze_async.get_claude_client(),
+                                                                       latinized_text):
+                yield 'appointment', appointment
+            yield 'done', {}
+        except Exception as e:
+            yield 'error', {'message': str(e)}
+
+    def events():
+        try:
+            for appointment in stream_appointments(get_claude_client(), latinized_text):
+                yield 'appointment', appointment
+            yield 'done', {}
+        except Exception as e:
+            yield 'error', {'message': str(e)}
+
+    return event_stream_response(async_events() if isinstance(request, ASGIRequest) else events())
+
+
 @require_POST
 def find_location_suggestions(request) -> JsonResponse:
     """
@@ -120,9 +298,59 @@ def find_location_suggestions(request) -> JsonResponse:
     try:
         body_data = json.loads(request.body)
         location_text = body_data.get('location_name')
-        suggestions = suggest_location(location_text, os.path.join(settings.DATA_DIR,
-                                                                   'ottoman_locations.xlsx'))
+        max_distance = body_data.get('max_distance')
+        if max_distance is not None:
+            try:
+                max_distance = int(max_distance)
+            except (TypeError, ValueError):
+                return JsonResponse({'message': 'max_distance should be a number'}, status=400)
+            if max_distance < 0:
+                return JsonResponse({'message': 'max_distance should not be negative'}, status=400)
+
+        suggestions = suggest_location(location_text, settings.LOCATIONS_FILE, max_distance)
+        return JsonResponse({'suggestions': suggestions}, status=200)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'message': 'Invalid JSON'}, status=400)
+
+
+@require_POST
+def find_location_suggestions_batch(request) -> JsonResponse:
+    """
+    Find location name suggestions for several location texts at once
+    using suggest_locations function.
+    Args:
+        request: The HTTP request object, containing the list of location texts
+    Returns:
+         One array of location suggestions per location text
+    """
+    try:
+        body_data = json.loads(request.body)
+        location_texts = body_data.get('location_names')
+        if not isinstance(location_texts, list):
+            return JsonResponse({'message': 'location_names should be a list'}, status=400)
+
+        suggestions = suggest_locations(location_texts, settings.LOCATIONS_FILE)
         return JsonResponse({'suggestions': suggestions}, status=200)
 
     except json.JSONDecodeError:
         return JsonResponse({'message': 'Invalid JSON'}, status=400)
+
+
+@require_GET
+def location_typeahead(request) -> JsonResponse:
+    """
+    Complete a partially typed location name.
+    Cheap enough to be called on every keystroke.
+    Args:
+        request: The HTTP request object, with the typed text in the q parameter
+    Returns:
+         Array of location names starting with the typed text
+    """
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        return JsonResponse({'message': 'limit should be a number'}, status=400)
+
+    completions = complete_location(request.GET.get('q', ''), settings.LOCATIONS_FILE, limit)
+    return JsonResponse({'suggestions': completions}, status=200)
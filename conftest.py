@@ -0,0 +1,24 @@
+import pytest
+
+from MobilityAnalyzer import analyze
+
+
+@pytest.fixture(autouse=True)
+def isolated_analysis_caches(monkeypatch, tmp_path):
+    """
+    Give every test empty OCR and LLM result caches, so tests neither
+    read nor fill the caches of the development server.
+    """
+    database_path = tmp_path / 'analysis_cache.sqlite3'
+    for name in ['ocr_cache', 'latinization_cache', 'translation_memory', 'extraction_cache']:
+        cache = getattr(analyze, name)
+        monkeypatch.setattr(analyze, name, type(cache)(database_path, cache.table, cache.max_bytes))
+
+
+@pytest.fixture(autouse=True)
+def without_model_routing(monkeypatch):
+    """
+    Send every request to CLAUDE_MODEL, so tests count requests without escalations.
+    Routing tests turn it back on.
+    """
+    monkeypatch.setattr(analyze, 'MODEL_ROUTING', False)
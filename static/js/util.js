@@ -17,24 +17,105 @@ function displayImage(file) {
     reader.readAsDataURL(file);  // Read the file as a Data URL
 }
 
-//Update OCR and Latinization cards.
-function renderOCRAndLatinizedText(ocr, latinized) {
-    spinners.forEach(spinner => spinner.classList.add('hidden'));
+//Show the OCR text as soon as it arrives, and prepare the Latinization card for the streamed text.
+function renderStreamedOCRText(ocr) {
     document.getElementById('ocr_text_info').innerText = "";
-    document.getElementById('latinized_text_info').innerText = "";
+    const ocrParagraph = `<p class="text-gray-700 text-lg">${ocr.replace(/\n/g, '<br>')}</p>`;
+    const latinizedParagraph = '<p class="text-gray-700 text-sm leading-relaxed"></p>';
 
     if (document.getElementById('is_conseq').checked) {
-        document.getElementById('ocr_text').innerHTML += `<p class="text-gray-700 text-lg">${ocr.replace(/\n/g, '<br>')}</p>`;
-        document.getElementById('latinized_text').innerHTML += `<p class="text-gray-700 text-sm leading-relaxed">${latinized.replace(/\n/g, '<br>')}</p>`;
+        document.getElementById('ocr_text').innerHTML += ocrParagraph;
+        document.getElementById('latinized_text').innerHTML += latinizedParagraph;
     } else {
-        document.getElementById('ocr_text').innerHTML = `<p class="text-gray-700 text-lg">${ocr.replace(/\n/g, '<br>')}</p>`;
-        document.getElementById('latinized_text').innerHTML = `<p class="text-gray-700 text-sm leading-relaxed">${latinized.replace(/\n/g, '<br>')}</p>`;
+        document.getElementById('ocr_text').innerHTML = ocrParagraph;
+        document.getElementById('latinized_text').innerHTML = latinizedParagraph;
     }
+}
+
+//Append a piece of the streamed Latinization to the last paragraph of the Latinization card.
+function appendLatinizedText(text) {
+    document.getElementById('latinized_text_info').innerText = "";
+    const paragraph = document.getElementById('latinized_text').lastElementChild;
+
+    text.split('\n').forEach((line, index) => {
+        if (index > 0) {
+            paragraph.appendChild(document.createElement('br'));
+        }
+        paragraph.appendChild(document.createTextNode(line));
+    });
+}
 
+//Called once the whole Latinization has been streamed.
+function finishStreamedLatinization() {
     document.getElementById('extract_data').classList.remove('hidden');
     document.getElementById('save_to_db').classList.remove('hidden');
 }
 
+//Poll the status of a page job until it is done or failed, calling onProgress(job) after each poll.
+//Gives up when no worker picks the job up within startTimeout ms, or when it is not finished within timeout ms.
+async function pollPageJob(url, onProgress, {interval = 500, startTimeout = 30000, timeout = 600000} = {}) {
+    const started = Date.now();
+    while (true) {
+        const response = await fetch(url);
+        const job = await response.json();
+        if (!response.ok) {
+            throw job;
+        }
+        onProgress(job);
+        if (job.status === 'done' || job.status === 'failed') {
+            return job;
+        }
+
+        const elapsed = Date.now() - started;
+        if (job.status === 'queued' && elapsed > startTimeout) {
+            throw {message: 'No page worker picked up the page. Is manage.py run_page_worker running?'};
+        }
+        if (elapsed > timeout) {
+            throw {message: 'The page was not processed in time.'};
+        }
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
+
+//Show why a page could not be OCR'ed and Latinized in the OCR and Latinization cards.
+function renderPageError(error) {
+    const message = error.error || error.message || String(error);
+    document.getElementById('ocr_text_info').innerText = message;
+    document.getElementById('latinized_text_info').innerText = message;
+}
+
+//Read a text/event-stream response, calling onEvent(event, data) for each server-sent event.
+async function readServerSentEvents(response, onEvent) {
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += value;
+
+        // Events are separated by a blank line.
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            message.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            onEvent(event, data ? JSON.parse(data) : {});
+        }
+    }
+}
+
 function collectAppointDataFromTable() {
     // Prepare an array to hold the form data
     let appointments = [];
@@ -58,4 +139,13 @@ function collectAppointDataFromTable() {
     });
 
     return appointments;
-}
\ No newline at end of file
+}
+
+// Delays calling func until wait ms have passed since the last call.
+function debounce(func, wait) {
+    let timeout;
+    return function(...args) {
+        clearTimeout(timeout);
+        timeout = setTimeout(() => func.apply(this, args), wait);
+    };
+}
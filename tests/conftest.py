@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import httpx
+import pytest
+
+from MobilityAnalyzer import analyze, analyze_async
+from tests.fake_claude import LATINIZED_TEXT, OCR_TEXT, FakeClaudeTransport
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+@pytest.fixture
+def fake_claude():
+    """
+    Makes the shared Claude clients answer through a fake transport until the end of the test.
+    Call it with a responder of FakeClaudeTransport, or with a transport such as FakeMessageBatchServer,
+    and with asynchronous=True for the client of analyze_async. Returns the transport.
+    """
+    def use(responder, asynchronous: bool = False) -> httpx.MockTransport:
+        transport = responder if isinstance(responder, httpx.MockTransport) else FakeClaudeTransport(responder)
+        (analyze_async if asynchronous else analyze).reset_claude_client(transport)
+        return transport
+    yield use
+    analyze.reset_claude_client()
+    analyze_async.reset_claude_client()
+
+
+@pytest.fixture
+def fake_page(monkeypatch, fake_claude):
+    """OCRs every image to OCR_TEXT, and latinizes it to LATINIZED_TEXT. Returns the Claude transport."""
+    monkeypatch.setattr(analyze, "document_ai_ocr_content", lambda image_content: OCR_TEXT)
+    return fake_claude(lambda body: LATINIZED_TEXT)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    directory = tmp_path / 'archive'
+    for issue in ['1890-05-01', '1890-05-08']:
+        (directory / issue).mkdir(parents=True)
+        for page in [1, 2]:
+            (directory / issue / f'page{page}.png').write_bytes(PNG)
+    return directory
+
+
+@pytest.fixture
+def ocred_pages(monkeypatch):
+    """OCRs each page to 'page <name>', and records the OCR'ed paths."""
+    paths = []
+
+    def ocr(file_path):
+        paths.append(Path(file_path))
+        return f"page {Path(file_path).parent.name}/{Path(file_path).stem}"
+    monkeypatch.setattr(analyze, "document_ai_ocr", ocr)
+    return paths
@@ -0,0 +1,205 @@
+import asyncio
+import json
+from pathlib import Path
+
+import httpx
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from MobilityAnalyzer import analyze
+from MobilityAnalyzer.prompts import LATINIZATION_SYSTEM_PROMPT
+from MobilityAnalyzer.segmenter import segment_appointments
+
+# A page as the fake_page fixture OCRs it, and as Claude latinizes it.
+OCR_TEXT = "درسعادت بدایت محکمهسی\nرئیسی"
+LATINIZED_TEXT = "Dersaadet bidayet mahkemesi\\n\nreisi"
+
+# A scanned page of the journal.
+TEST_IMAGE = Path(__file__).parent / 'test_data' / 'input' / 'ottoman_test1.png'
+
+# A latinized page of six appointments.
+SAMPLE_TEXT = """Akçehisar kazâsı bidâyet mahkemesi riyâseti mekteb-i
+hukuk-ı şâhâne me'zûnlarından Mehmed Emin Efendi'ye
+kazâ-yı mezbûr müddeî-i umûmî muâvinliği Manastır
+vilâyeti merkez bidâyet mahkemesi ikinci müstantıkı Fâik
+Efendi'ye
+Şiyak kazâsı bidâyet mahkemesi riyâseti Trablus-ı Garb
+vilâyeti merkez bidâyet mahkemesi ikinci müstantıkı Dâvud
+Efendi'ye
+kazâ-yı mezbûr müddeî-i umûmî muâvinliği Ertuğrul
+sancağı bidâyet mahkemesi icrâ me'mûru Nâzım Efendi'ye
+Tiran kazâsı bidâyet mahkemesi riyâseti Bingazi
+sancağı bidâyet mahkemesi müstantıkı Ali Rıza Efendi'ye
+kazâ-yı mezbûr müddeî-i umûmî muâvinliği Seydişehir
+sancağı bidâyet mahkemesi müstantıkı Tevfik Bey'e"""
+
+
+def upload():
+    """An uploaded page, as posted by the browser."""
+    return {"file": SimpleUploadedFile("page.png", b"\x89PNG\r\n\x1a\n", content_type="image/png")}
+
+
+def claude_message(text: str, model: str = "claude-3-5-sonnet-20240620", **usage) -> dict:
+    """A Messages API response body with a single text block."""
+    return {
+        "id": "msg_fake",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 10, "output_tokens": 10, **usage},
+    }
+
+
+def claude_stream(text: str, model: str = "claude-3-5-sonnet-20240620", chunk_size: int = 8) -> bytes:
+    """A streamed Messages API response sending the text in deltas of chunk_size characters."""
+    message = claude_message("", model)
+    message["content"] = []
+    message["stop_reason"] = None
+    events = [("message_start", {"type": "message_start", "message": message}),
+              ("content_block_start", {"type": "content_block_start", "index": 0,
+                                       "content_block": {"type": "text", "text": ""}})]
+    for start in range(0, len(text), chunk_size):
+        events.append(("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                               "delta": {"type": "text_delta", "text": text[start:start + chunk_size]}}))
+    events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+               ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                  "usage": {"output_tokens": 10}}),
+               ("message_stop", {"type": "message_stop"})]
+    return "".join(f"event: {event}\ndata: {json.dumps(data)}\n\n" for event, data in events).encode("utf-8")
+
+
+class StreamedBody(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """A streamed response body sent one server-sent event at a time, counting the events read so far."""
+
+    def __init__(self, content: bytes):
+        self.events = [event + b"\n\n" for event in content.split(b"\n\n") if event]
+        self.read = 0
+
+    def __iter__(self):
+        for event in self.events:
+            self.read += 1
+            yield event
+
+    async def __aiter__(self):
+        for event in self:
+            # Let the other tasks run, like while waiting for the next event from the network.
+            await asyncio.sleep(0)
+            yield event
+
+
+class FakeClaudeTransport(httpx.MockTransport):
+    """
+    HTTP transport answering Messages API calls without the network.
+    The responder gets the JSON body of each request and returns the text of the answer,
+    streamed if the request asks for it. The usage, e.g. prompt cache token counts,
+    can be set for the non-streamed answers.
+    Every request body is kept in self.requests, the request headers in self.headers,
+    and the bodies of the streamed answers in self.streams.
+    """
+
+    def __init__(self, responder=lambda body: "Fake answer.", usage: dict = None):
+        self.responder = responder
+        self.usage = usage or {}
+        self.requests = []
+        self.headers = []
+        self.streams = []
+        super().__init__(self.handle)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        self.headers.append(request.headers)
+        if body.get("stream"):
+            self.streams.append(StreamedBody(claude_stream(self.responder(body), body["model"])))
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=self.streams[-1])
+        return httpx.Response(200, json=claude_message(self.responder(body), body["model"], **self.usage))
+
+
+class FakeMessageBatchServer(httpx.MockTransport):
+    """
+    Local stand-in for the Message Batches API. A created batch stays in progress for
+    polls_until_ended retrievals, then its requests are answered by the responder,
+    like FakeClaudeTransport answers single requests. A request whose responder raises
+    an exception is reported as errored. Messages API calls are refused, so a test
+    fails if anything bypasses the batches.
+    The created batches are kept in self.batches, each with its 'requests' and 'polls'.
+    """
+
+    BATCHES_PATH = "/v1/messages/batches"
+
+    def __init__(self, responder=lambda body: "Fake answer.", polls_until_ended: int = 1):
+        self.responder = responder
+        self.polls_until_ended = polls_until_ended
+        self.batches = {}
+        self.headers = []
+        super().__init__(self.handle)
+
+    def batch_object(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        ended = batch["polls"] >= self.polls_until_ended
+        counts = {"processing": 0, "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+        counts["processing" if not ended else "succeeded"] = len(batch["requests"])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": counts,
+            "created_at": "2024-10-01T00:00:00Z",
+            "expires_at": "2024-10-02T00:00:00Z",
+            "ended_at": "2024-10-01T01:00:00Z" if ended else None,
+            "results_url": f"https://api.anthropic.com{self.BATCHES_PATH}/{batch_id}/results" if ended else None,
+        }
+
+    def result(self, request: dict) -> dict:
+        try:
+            text = self.responder(request["params"])
+        except Exception as e:
+            return {"type": "errored", "error": {"type": "error",
+                                                 "error": {"type": "api_error", "message": str(e)}}}
+        return {"type": "succeeded", "message": claude_message(text, request["params"]["model"])}
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.headers.append(request.headers)
+        path = request.url.path
+        if request.method == "POST" and path == self.BATCHES_PATH:
+            batch_id = f"msgbatch_{len(self.batches)}"
+            self.batches[batch_id] = {"requests": json.loads(request.content)["requests"], "polls": 0}
+            return httpx.Response(200, json=self.batch_object(batch_id))
+
+        batch_id = path.removeprefix(self.BATCHES_PATH + "/").removesuffix("/results")
+        if not path.startswith(self.BATCHES_PATH + "/") or batch_id not in self.batches:
+            return httpx.Response(404, json={"type": "error", "error": {"type": "not_found_error",
+                                                                        "message": f"Unknown path {path}."}})
+        if path.endswith("/results"):
+            results = [{"custom_id": batch_request["custom_id"], "result": self.result(batch_request)}
+                       for batch_request in reversed(self.batches[batch_id]["requests"])]
+            return httpx.Response(200, content="".join(json.dumps(result) + "\n" for result in results).encode())
+        self.batches[batch_id]["polls"] += 1
+        return httpx.Response(200, json=self.batch_object(batch_id))
+
+
+def latinize_line_by_line(body: dict) -> str:
+    """Answers with one latinized line per OCR line, the way the prompt asks for."""
+    ocr_text = body["messages"][0]["content"].removeprefix(analyze.LATINIZATION_USER_PROMPT)
+    return "".join(f"Latin {line}\\n\n" for line in ocr_text.split("\n"))
+
+
+def recipient(block: str) -> str:
+    return " ".join(block.split()[-2:])
+
+
+def extract_each_block(body: dict) -> str:
+    """Answers with one appointment per block of the text, named after its recipient."""
+    text = body["messages"][0]["content"]
+    return json.dumps({"appointments": [{"name": recipient(block)} for block in segment_appointments(text)]})
+
+
+def latinize_or_extract(body: dict) -> str:
+    """Latinizes 'page N' to 'Sayfa N', and extracts one appointment from Istambul per page."""
+    text = body["messages"][0]["content"]
+    if body["system"][0]["text"] == LATINIZATION_SYSTEM_PROMPT:
+        return text.removeprefix(analyze.LATINIZATION_USER_PROMPT).replace("page ", "Sayfa ")
+    return json.dumps({"appointments": [{"name": text[text.index("Sayfa"):].strip(), "fromCity": "Istambul",
+                                         "toCity": "Not specified", "fromTitle": "müstantik", "toTitle": "reis"}]})
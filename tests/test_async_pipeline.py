@@ -0,0 +1,251 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+
+from MobilityAnalyzer import analyze, analyze_async
+from MobilityAnalyzer.analyze import extract_text_from_claude_response
+from tests.fake_claude import (
+    SAMPLE_TEXT,
+    TEST_IMAGE,
+    claude_message,
+    extract_each_block,
+    latinize_line_by_line,
+    recipient
+)
+
+
+class SlowFakeClaudeTransport(httpx.MockTransport):
+    """
+    Asynchronous fake transport taking delay seconds to answer,
+    and recording the largest number of requests in flight at the same time.
+    """
+
+    def __init__(self, responder, delay: float = 0.02):
+        self.responder = responder
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.peak = 0
+        super().__init__(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return httpx.Response(200, json=claude_message(self.responder(body), body["model"]))
+
+
+class FakeAsyncDocumentAIClient:
+    """Stands in for DocumentProcessorServiceAsyncClient and records the OCR requests."""
+
+    def __init__(self, credentials=None, client_options=None):
+        self.requests = []
+
+    async def process_document(self, request):
+        self.requests.append(request)
+        return SimpleNamespace(document=SimpleNamespace(text="توجيهات"))
+
+
+@pytest.fixture
+def fake_transport(fake_claude):
+    return fake_claude(latinize_line_by_line, asynchronous=True)
+
+
+@pytest.fixture
+def fake_document_ai(monkeypatch):
+    monkeypatch.setattr(analyze.service_account.Credentials, "from_service_account_file", lambda key_path: object())
+    monkeypatch.setattr(analyze.documentai, "DocumentProcessorServiceAsyncClient", FakeAsyncDocumentAIClient)
+
+
+def run(coroutine_function, *args, **kwargs):
+    """Runs a coroutine function in a new event loop, like an async view served under WSGI."""
+    return async_to_sync(coroutine_function)(*args, **kwargs)
+
+
+class TestAsyncClients:
+
+    def test_claude_client_is_shared_within_an_event_loop(self, fake_transport):
+        async def two_clients():
+            return analyze_async.get_claude_client(), analyze_async.get_claude_client()
+
+        first, second = run(two_clients)
+        assert first is second
+
+    def test_document_ai_ocr(self, fake_document_ai):
+        async def ocr_twice():
+            text = await analyze_async.document_ai_ocr(str(TEST_IMAGE), "key.json")
+            await analyze_async.document_ai_ocr(str(TEST_IMAGE), "key.json")
+            return text, analyze_async.get_document_ai_client("key.json")
+
+        text, client = run(ocr_twice)
+        assert text == "توجيهات"
+        # The second page is served from the OCR cache shared with the synchronous pipeline.
+        assert len(client.requests) == 1
+        assert analyze.ocr_cache.get(analyze.ocr_cache_key(TEST_IMAGE.read_bytes())) == "توجيهات"
+
+
+class TestAsyncLatinization:
+
+    def test_latinization_is_cached(self, fake_transport):
+        async def latinize_twice():
+            client = analyze_async.get_claude_client()
+            await analyze_async.latinize_ocr_text(client, "درسعادت\nبدایت")
+            return await analyze_async.latinize_ocr_text(client, "درسعادت\nبدایت")
+
+        response = run(latinize_twice)
+        assert extract_text_from_claude_response(response) == "Latin درسعادت\\n\nLatin بدایت\\n\n"
+        assert len(fake_transport.requests) == 1
+
+    def test_chunks_are_latinized_concurrently(self, fake_claude):
+        transport = fake_claude(SlowFakeClaudeTransport(latinize_line_by_line), asynchronous=True)
+        text = "\n".join(f"satır {number}" for number in range(12))
+        async def latinize():
+            return await analyze_async.latinize_ocr_text_in_chunks(
+                analyze_async.get_claude_client(), text, max_lines=2, max_concurrency=4)
+        response = run(latinize)
+
+        assert len(transport.requests) == 6
+        assert transport.peak == 4
+        assert analyze.translation_memory.stats()["entries"] == 12
+        assert analyze.split_latinized_lines(extract_text_from_claude_response(response)) == \
+            [f"Latin satır {number}" for number in range(12)]
+
+    def test_chunks_are_streamed_in_order(self, fake_transport):
+        text = "\n".join(f"satır {number}" for number in range(5))
+
+        async def stream():
+            return [piece async for piece in analyze_async.stream_latinization(
+                analyze_async.get_claude_client(), text, max_lines=2)]
+        pieces = run(stream)
+
+        # The first chunk is streamed as it is generated, the other two are yielded whole.
+        assert len(pieces) > 3
+        streamed = [request["messages"][0]["content"] for request in fake_transport.requests if request.get("stream")]
+        assert len(fake_transport.requests) == 3
+        assert len(streamed) == 1 and streamed[0].endswith("satır 0\nsatır 1")
+        assert "".join(pieces) == "\\n\n".join(f"Latin satır {number}" for number in range(5))
+
+
+class TestAsyncExtraction:
+
+    def test_batches_are_extracted_concurrently(self, fake_claude):
+        transport = fake_claude(SlowFakeClaudeTransport(extract_each_block), asynchronous=True)
+        async def extract():
+            return await analyze_async.extract_appointments(
+                analyze_async.get_claude_client(), SAMPLE_TEXT, batch_blocks=2)
+        extracted = json.loads(run(extract))
+
+        assert transport.peak == 3
+        assert [appointment["name"] for appointment in extracted["appointments"]] == \
+            [recipient(block) for block in analyze.segment_appointments(SAMPLE_TEXT)]
+
+    def test_retries_wait_for_the_semaphore(self, fake_claude):
+        """The blocks of the malformed batches are sent again, still at most max_concurrency at a time."""
+        def invalid_for_several_blocks(body):
+            text = body["messages"][0]["content"]
+            return "not JSON" if len(analyze.segment_appointments(text)) > 1 else extract_each_block(body)
+        transport = fake_claude(SlowFakeClaudeTransport(invalid_for_several_blocks), asynchronous=True)
+        async def extract():
+            return await analyze_async.extract_appointments(
+                analyze_async.get_claude_client(), SAMPLE_TEXT, batch_blocks=3, max_concurrency=2)
+        extracted = json.loads(run(extract))
+
+        assert len(transport.requests) == 2 + 6
+        assert transport.peak == 2
+        assert len(extracted["appointments"]) == 6
+
+
+    def test_appointments_are_streamed_in_order(self, fake_claude):
+        transport = fake_claude(extract_each_block, asynchronous=True)
+        async def stream():
+            return [appointment async for appointment in analyze_async.stream_appointments(
+                analyze_async.get_claude_client(), SAMPLE_TEXT, batch_blocks=2, max_concurrency=2)]
+
+        assert run(stream) == [{"name": recipient(block)} for block in analyze.segment_appointments(SAMPLE_TEXT)]
+        assert [request["stream"] for request in transport.requests] == [True] * 3
+
+    def test_appointments_are_yielded_before_the_answer_ends(self, fake_claude):
+        transport = fake_claude(lambda body: json.dumps({"appointments": [{"name": "Mehmed Emin Efendi"},
+                                                                          {"name": "Tevfik Bey"}]}),
+                                asynchronous=True)
+        async def first_appointment():
+            appointments = analyze_async.stream_appointments(analyze_async.get_claude_client(), "Mehmed Emin Efendi'ye")
+            try:
+                return await anext(appointments), transport.streams[0].read
+            finally:
+                await appointments.aclose()
+        appointment, read = run(first_appointment)
+
+        assert appointment == {"name": "Mehmed Emin Efendi"}
+        assert read < len(transport.streams[0].events)
+
+
+class TestAsyncViews:
+
+    def test_ocr_and_latinize_image(self, async_client, fake_transport, monkeypatch):
+        async def fake_ocr(image_content):
+            return "درسعادت\nبدایت"
+        monkeypatch.setattr(analyze_async, "document_ai_ocr_content", fake_ocr)
+
+        response = run(async_client.post, reverse("ocr_and_latinize_image"),
+                       {"file": SimpleUploadedFile("page.png", TEST_IMAGE.read_bytes())})
+
+        assert response.status_code == 200
+        assert response.json() == {"OCR": "درسعادت\nبدایت", "Latinized": "Latin درسعادت\\n\nLatin بدایت\\n\n"}
+
+    def test_missing_or_invalid_file(self, client):
+        """Neither fails on a file that was never written to disk."""
+        assert client.post(reverse("ocr_and_latinize_image")).status_code == 400
+        assert client.post(reverse("ocr_and_latinize_image"),
+                           {"file": SimpleUploadedFile("page.png", b"GIF89a")}).status_code == 400
+
+    def test_extract_appointment_data(self, async_client, fake_claude):
+        fake_claude(extract_each_block, asynchronous=True)
+        response = run(async_client.post, reverse("extract_appointment_data"), json.dumps({"text": SAMPLE_TEXT}),
+                       content_type="application/json")
+
+        assert response.status_code == 200
+        assert len(response.json()["appointments"]) == 6
+
+    def test_reextract_appointment_data(self, async_client, fake_claude):
+        transport = fake_claude(extract_each_block, asynchronous=True)
+        edited_text = SAMPLE_TEXT.replace("Dâvud", "Dâvûd")
+        previous_appointments = [{"name": recipient(block)} for block in analyze.segment_appointments(SAMPLE_TEXT)]
+        response = run(async_client.post, reverse("reextract_appointment_data"), json.dumps({
+            "previous_text": SAMPLE_TEXT, "text": edited_text, "previous_appointments": previous_appointments
+        }), content_type="application/json")
+
+        assert response.status_code == 200
+        assert response.json()["reextracted_blocks"] == 1
+        assert [appointment["name"] for appointment in response.json()["appointments"]] == \
+            [recipient(block) for block in analyze.segment_appointments(edited_text)]
+        assert len(transport.requests) == 1
+
+    def test_wsgi_requests_use_the_synchronous_pipeline(self, client, fake_claude, monkeypatch):
+        """Under WSGI every request runs on a new event loop, so no asynchronous client is created."""
+        monkeypatch.setattr(analyze, "document_ai_ocr_content", lambda image_content: "درسعادت\nبدایت")
+        monkeypatch.setattr(analyze_async, "get_claude_client", lambda: pytest.fail("Asynchronous client used."))
+
+        def latinize_or_extract(body):
+            if body["system"][0]["text"] == analyze.LATINIZATION_SYSTEM_PROMPT:
+                return latinize_line_by_line(body)
+            return extract_each_block(body)
+        transport = fake_claude(latinize_or_extract)
+
+        ocr_response = client.post(reverse("ocr_and_latinize_image"),
+                                   {"file": SimpleUploadedFile("page.png", TEST_IMAGE.read_bytes())})
+        extraction_response = client.post(reverse("extract_appointment_data"), json.dumps({"text": SAMPLE_TEXT}),
+                                          content_type="application/json")
+
+        assert ocr_response.json()["Latinized"] == "Latin درسعادت\\n\nLatin بدایت\\n\n"
+        assert len(extraction_response.json()["appointments"]) == 6
+        assert len(transport.requests) == 1 + 2
@@ -0,0 +1,174 @@
+import json
+
+import pytest
+
+from MobilityAnalyzer import analyze, batches
+from MobilityAnalyzer.analyze import extract_text_from_claude_response, get_claude_client
+from MobilityAnalyzer.ingest import ingest_archive
+from MobilityAnalyzer.models import MovementItem
+from tests.fake_claude import (
+    SAMPLE_TEXT,
+    FakeMessageBatchServer,
+    extract_each_block,
+    latinize_line_by_line,
+    latinize_or_extract,
+    recipient
+)
+
+
+@pytest.fixture
+def batch_server(fake_claude):
+    def use(responder, **options):
+        return fake_claude(FakeMessageBatchServer(responder, **options))
+    return use
+
+
+def batch_requests(server) -> list:
+    return [request for batch in server.batches.values() for request in batch["requests"]]
+
+
+class TestMessageBatches:
+
+    def test_batches_are_polled_until_they_end(self, batch_server):
+        server = batch_server(lambda body: "Fake answer.", polls_until_ended=3)
+
+        messages = batches.run_message_batches(get_claude_client(), {"a": analyze.latinization_request("x"),
+                                                                     "b": analyze.latinization_request("y")},
+                                               'latinization', poll_interval=0)
+
+        assert {custom_id: extract_text_from_claude_response(message) for custom_id, message in messages.items()} \
+            == {"a": "Fake answer.", "b": "Fake answer."}
+        assert [batch["polls"] for batch in server.batches.values()] == [4]
+        assert "extra_headers" not in batch_requests(server)[0]["params"]
+        assert batches.MESSAGE_BATCHES_BETA in server.headers[0]["anthropic-beta"]
+
+    def test_requests_are_split_into_batches(self, batch_server):
+        server = batch_server(lambda body: "Fake answer.")
+
+        messages = batches.run_message_batches(get_claude_client(), {str(number): analyze.latinization_request("x")
+                                                                     for number in range(5)},
+                                               'latinization', poll_interval=0, max_requests=2)
+
+        assert len(messages) == 5
+        assert [len(batch["requests"]) for batch in server.batches.values()] == [2, 2, 1]
+
+    def test_failed_requests_are_left_out(self, batch_server):
+        def fail_on_y(body):
+            if body["messages"][0]["content"].endswith("y"):
+                raise Exception("Overloaded.")
+            return "Fake answer."
+        batch_server(fail_on_y)
+
+        messages = batches.run_message_batches(get_claude_client(), {"a": analyze.latinization_request("x"),
+                                                                     "b": analyze.latinization_request("y")},
+                                               'latinization', poll_interval=0)
+        assert list(messages) == ["a"]
+
+
+class TestBatchLatinization:
+
+    def test_pages_are_latinized_and_cached(self, batch_server):
+        server = batch_server(latinize_line_by_line)
+        long_page = "\n".join(f"satır {number}" for number in range(5))
+
+        latinized = batches.latinize_pages(get_claude_client(), ["bir", long_page, "bir"], chunk_lines=2,
+                                           poll_interval=0)
+
+        assert extract_text_from_claude_response(latinized[0]) == "Latin bir\\n\n"
+        assert extract_text_from_claude_response(latinized[1]) == \
+            "\\n\n".join(f"Latin satır {number}" for number in range(5))
+        # The repeated page is sent once, and the long page in three chunks.
+        assert len(batch_requests(server)) == 4
+
+        # The answers are served from the cache of latinize_ocr_text.
+        assert analyze.latinize_ocr_text(get_claude_client(), "bir").content[0].text == "Latin bir\\n\n"
+        assert len(batch_requests(server)) == 4
+
+    def test_failed_page(self, batch_server):
+        def fail_on_iki(body):
+            if "iki" in body["messages"][0]["content"]:
+                raise Exception("Overloaded.")
+            return latinize_line_by_line(body)
+        batch_server(fail_on_iki)
+
+        latinized = batches.latinize_pages(get_claude_client(), ["bir", "iki"], poll_interval=0)
+        assert latinized[1] is None
+
+
+class TestBatchExtraction:
+
+    def test_pages_are_extracted_in_block_batches(self, batch_server):
+        server = batch_server(extract_each_block)
+
+        extracted = batches.extract_pages(get_claude_client(), [SAMPLE_TEXT, "Ali Bey'e"], batch_blocks=4,
+                                          poll_interval=0)
+
+        assert [appointment["name"] for appointment in json.loads(extracted[0])["appointments"]] == \
+            [recipient(block) for block in analyze.segment_appointments(SAMPLE_TEXT)]
+        assert json.loads(extracted[1]) == {"appointments": [{"name": "Ali Bey'e"}]}
+        assert len(batch_requests(server)) == 3
+
+    def test_whole_page_answers_are_normalized(self, batch_server):
+        batch_server(lambda body: "Sure:\n```json\n" + extract_each_block(body) + "\n```")
+
+        extracted = batches.extract_pages(get_claude_client(), ["Ali Bey'e"], batch_blocks=4, poll_interval=0)
+
+        assert json.loads(extracted[0]) == {"appointments": [{"name": "Ali Bey'e"}]}
+
+    def test_invalid_answers_are_sent_again_block_by_block(self, batch_server):
+        def invalid_for_several_blocks(body):
+            text = body["messages"][0]["content"]
+            return "not JSON" if len(analyze.segment_appointments(text)) > 1 else extract_each_block(body)
+        server = batch_server(invalid_for_several_blocks)
+
+        extracted = batches.extract_pages(get_claude_client(), [SAMPLE_TEXT, SAMPLE_TEXT[:200]], batch_blocks=2,
+                                          poll_interval=0)
+
+        assert len(json.loads(extracted[0])["appointments"]) == 6
+        assert len(json.loads(extracted[1])["appointments"]) == len(analyze.segment_appointments(SAMPLE_TEXT[:200]))
+        assert [len(batch["requests"]) for batch in server.batches.values()] == [4, 8]
+
+
+    def test_errored_whole_pages_are_sent_again_block_by_block(self, batch_server):
+        def overloaded_for_several_blocks(body):
+            if len(analyze.segment_appointments(body["messages"][0]["content"])) > 1:
+                raise Exception("Overloaded.")
+            return extract_each_block(body)
+        server = batch_server(overloaded_for_several_blocks)
+
+        extracted = batches.extract_pages(get_claude_client(), [SAMPLE_TEXT], batch_blocks=6, poll_interval=0)
+
+        assert [appointment["name"] for appointment in json.loads(extracted[0])["appointments"]] == \
+            [recipient(block) for block in analyze.segment_appointments(SAMPLE_TEXT)]
+        assert [len(batch["requests"]) for batch in server.batches.values()] == [1, 6]
+
+    def test_failed_single_block_page(self, batch_server):
+        def overloaded(body):
+            raise Exception("Overloaded.")
+        batch_server(overloaded)
+
+        assert batches.extract_pages(get_claude_client(), ["Ali Bey'e"], batch_blocks=4, poll_interval=0) == [None]
+
+    def test_cached_blocks_are_not_sent(self, batch_server):
+        server = batch_server(extract_each_block)
+        first = batches.extract_pages(get_claude_client(), [SAMPLE_TEXT], batch_blocks=2, poll_interval=0)
+
+        extracted = batches.extract_pages(get_claude_client(), [SAMPLE_TEXT, "Ali Bey'e"], batch_blocks=2,
+                                          poll_interval=0)
+
+        assert extracted == [first[0], json.dumps({"appointments": [{"name": "Ali Bey'e"}]})]
+        assert [len(batch["requests"]) for batch in server.batches.values()] == [3, 1]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestBatchIngestion:
+
+    def test_archive_is_ingested_in_message_batches(self, archive, ocred_pages, batch_server, monkeypatch):
+        monkeypatch.setattr(batches, "MESSAGE_BATCH_POLL_INTERVAL", 0)
+        server = batch_server(latinize_or_extract)
+
+        counts = ingest_archive(archive, message_batches=True)
+
+        assert counts == {'pages': 4, 'appointments': 4, 'failed': 0, 'skipped': 0}
+        assert MovementItem.objects.get(source='1890-05-01/page1.png').name == "Sayfa 1890-05-01/page1"
+        assert [len(batch["requests"]) for batch in server.batches.values()] == [4, 4]
@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+
+from MobilityAnalyzer.cache import LRUCache, PersistentCache
+
+
+class TestLRUCache:
+
+    def test_get_and_put(self):
+        cache = LRUCache(2)
+        assert cache.get("a") is None
+        cache.put("a", 1)
+        assert cache.get("a") == 1
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+
+    def test_clear(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.stats()["hits"] == 0
+
+    def test_concurrent_use(self):
+        cache = LRUCache(64)
+
+        def worker(offset):
+            for i in range(1000):
+                cache.put((offset, i % 100), i)
+                cache.get((offset, i % 50))
+
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = cache.stats()
+        assert stats["size"] <= 64
+        assert stats["hits"] + stats["misses"] == 8 * 1000
+
+
+class TestPersistentCache:
+
+    def test_get_and_put(self, tmp_path):
+        cache = PersistentCache(tmp_path / 'cache.sqlite3', 'results', 1024)
+        assert cache.get("a") is None
+        cache.put("a", "metin")
+        assert cache.get("a") == "metin"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_entries_are_shared_through_the_file(self, tmp_path):
+        PersistentCache(tmp_path / 'cache.sqlite3', 'results', 1024).put("a", "metin")
+        assert PersistentCache(tmp_path / 'cache.sqlite3', 'results', 1024).get("a") == "metin"
+
+    def test_least_recently_used_entries_are_evicted_over_max_bytes(self, tmp_path):
+        cache = PersistentCache(tmp_path / 'cache.sqlite3', 'results', 10)
+        cache.put("a", "1234")
+        cache.put("b", "1234")
+        cache.get("a")
+        cache.put("c", "1234")
+        assert cache.get("b") is None
+        assert cache.get("a") == "1234"
+        assert cache.stats()["bytes"] <= 10
+
+    def test_purge(self, tmp_path):
+        cache = PersistentCache(tmp_path / 'cache.sqlite3', 'results', 1024)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        assert cache.purge() == 2
+        assert cache.get("a") is None
+
+    def test_total_size_follows_replaced_and_deleted_entries(self, tmp_path):
+        cache = PersistentCache(tmp_path / 'cache.sqlite3', 'results', 1024)
+        cache.put("a", "1234")
+        cache.put("a", "12")
+        cache.put("b", "şş")
+        assert cache.stats()["bytes"] == 6
+        cache.purge()
+        assert cache.stats()["bytes"] == 0
+
+    def test_total_size_of_an_existing_table(self, tmp_path):
+        connection = sqlite3.connect(tmp_path / 'cache.sqlite3')
+        connection.execute("CREATE TABLE results (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                           "created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        connection.execute("INSERT INTO results VALUES ('a', '1234', 4, 0, 0)")
+        connection.commit()
+        connection.close()
+
+        cache = PersistentCache(tmp_path / 'cache.sqlite3', 'results', 6)
+        assert cache.stats()["bytes"] == 4
+        cache.put("b", "1234")
+        assert cache.get("a") is None
@@ -0,0 +1,212 @@
+import json
+import threading
+import time
+
+import pytest
+
+from MobilityAnalyzer import analyze
+from MobilityAnalyzer.analyze import (
+    extract_text_from_claude_response,
+    get_claude_client,
+    initialize_claude,
+    end_to_end_process,
+    extract_appointments,
+    latinize_ocr_text,
+    latinize_ocr_text_in_chunks,
+    prompt_cache_stats,
+    reset_claude_client,
+    split_into_chunks
+)
+from MobilityAnalyzer.translation_memory import join_latinized_lines, split_latinized_lines
+from tests.fake_claude import FakeClaudeTransport, latinize_line_by_line
+
+
+@pytest.fixture
+def fake_transport(fake_claude):
+    """Replace the shared Claude client with one answering through a fake transport."""
+    return fake_claude(lambda body: "Dersaadet bidayet mahkemesi")
+
+
+class TestClaudeClient:
+
+    def test_shared_client_is_reused(self, fake_transport):
+        """Every caller gets the same client, and so the same connection pool."""
+        assert get_claude_client() is get_claude_client()
+
+    def test_latinization_through_injected_transport(self, fake_transport):
+        """The shared client sends its requests through the injected transport."""
+        response = latinize_ocr_text(get_claude_client(), "درسعادت بدایت محکمهسی")
+
+        assert extract_text_from_claude_response(response) == "Dersaadet bidayet mahkemesi"
+        assert len(fake_transport.requests) == 1
+        assert "درسعادت بدایت محکمهسی" in fake_transport.requests[0]["messages"][0]["content"]
+
+    def test_reset_creates_a_new_client(self, fake_transport):
+        """After a reset, the next call creates a new shared client."""
+        client = get_claude_client()
+        reset_claude_client()
+        assert get_claude_client() is not client
+
+    def test_initialize_claude_uses_the_given_transport(self):
+        """Independent clients can be created with their own transport."""
+        transport = FakeClaudeTransport()
+        client = initialize_claude(transport)
+        latinize_ocr_text(client, "متن")
+        assert len(transport.requests) == 1
+        client.close()
+
+
+class TestLatinizationCache:
+
+    def test_same_text_is_latinized_once(self, fake_transport):
+        """A byte-identical OCR text is served from the cache."""
+        first_response = latinize_ocr_text(get_claude_client(), "درسعادت بدایت محکمهسی")
+        second_response = latinize_ocr_text(get_claude_client(), "درسعادت بدایت محکمهسی")
+
+        assert len(fake_transport.requests) == 1
+        assert extract_text_from_claude_response(second_response) == \
+            extract_text_from_claude_response(first_response)
+        assert analyze.latinization_cache.stats()["hits"] == 1
+
+    def test_editing_the_prompt_invalidates_the_cache(self, fake_transport, monkeypatch):
+        """Entries made with another system prompt are not reused."""
+        latinize_ocr_text(get_claude_client(), "درسعادت بدایت محکمهسی")
+        monkeypatch.setattr(analyze, "LATINIZATION_SYSTEM_PROMPT", "Another prompt.")
+        latinize_ocr_text(get_claude_client(), "درسعادت بدایت محکمهسی")
+
+        assert len(fake_transport.requests) == 2
+        assert fake_transport.requests[1]["system"][0]["text"] == "Another prompt."
+
+
+class TestTranslationMemory:
+
+    @pytest.fixture
+    def line_transport(self, fake_claude):
+        return fake_claude(latinize_line_by_line)
+
+    def test_split_latinized_lines(self):
+        """Escaped and real line breaks both end a line; a trailing break adds no line."""
+        assert split_latinized_lines("bir\\n\niki\\nüç\ndört\\n\n") == ["bir", "iki", "üç", "dört"]
+        assert join_latinized_lines(["bir", "iki"]) == "bir\\n\niki"
+
+    def test_only_unseen_lines_are_sent(self, line_transport):
+        """Lines latinized on an earlier page are not sent to Claude again."""
+        latinize_ocr_text(get_claude_client(), "مقدمه\nاول\nخاتمه")
+        response = latinize_ocr_text(get_claude_client(), "مقدمه\nثانی\nخاتمه")
+
+        assert len(line_transport.requests) == 2
+        second_request = line_transport.requests[1]["messages"][0]["content"]
+        assert second_request.endswith("ثانی")
+        assert "مقدمه" not in second_request
+        assert split_latinized_lines(extract_text_from_claude_response(response)) == \
+            ["Latin مقدمه", "Latin ثانی", "Latin خاتمه"]
+
+    def test_page_of_known_lines_is_not_sent(self, line_transport):
+        """A new page made only of known lines is assembled without calling Claude."""
+        latinize_ocr_text(get_claude_client(), "مقدمه\nاول")
+        response = latinize_ocr_text(get_claude_client(), "اول\nمقدمه")
+
+        assert len(line_transport.requests) == 1
+        assert extract_text_from_claude_response(response) == "Latin اول\\n\nLatin مقدمه"
+
+    def test_mismatched_answer_falls_back_to_the_whole_page(self, fake_transport):
+        """When the lines cannot be paired up, the whole page is sent and nothing is remembered."""
+        analyze.translation_memory.put(
+            analyze.translation_memory.line_key("مقدمه", analyze.latinization_version(analyze.CLAUDE_MODEL)),
+            "Mukaddime")
+        response = latinize_ocr_text(get_claude_client(), "مقدمه\nاول\nثانی")
+
+        assert len(fake_transport.requests) == 2
+        assert fake_transport.requests[1]["messages"][0]["content"].endswith("مقدمه\nاول\nثانی")
+        assert extract_text_from_claude_response(response) == "Dersaadet bidayet mahkemesi"
+        assert analyze.translation_memory.stats()["entries"] == 1
+
+
+class TestChunkedLatinization:
+
+    def test_chunks_are_whole_lines_of_even_size(self):
+        """Chunks split the text at line breaks and join back to it."""
+        text = "\n".join(f"satır {number}" for number in range(10))
+        chunks = split_into_chunks(text, 4)
+
+        assert [len(chunk.split("\n")) for chunk in chunks] == [4, 4, 2]
+        assert "\n".join(chunks) == text
+        assert split_into_chunks("tek satır", 4) == ["tek satır"]
+
+    def test_chunks_are_reassembled_in_order(self, fake_claude):
+        """Chunks answered out of order are still joined in the order of the page."""
+        def slow_first_chunks(body):
+            # The earlier the chunk, the later its answer.
+            time.sleep(0.05 if "satır 0" in body["messages"][0]["content"] else 0)
+            return latinize_line_by_line(body)
+
+        transport = fake_claude(slow_first_chunks)
+        text = "\n".join(f"satır {number}" for number in range(9))
+        response = latinize_ocr_text_in_chunks(get_claude_client(), text, max_lines=3)
+
+        assert len(transport.requests) == 3
+        assert split_latinized_lines(extract_text_from_claude_response(response)) == \
+            [f"Latin satır {number}" for number in range(9)]
+        assert response.usage.input_tokens == 30
+
+    def test_concurrency_is_bounded(self, fake_claude):
+        """No more than max_concurrency chunks are in flight at the same time."""
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def counting_responder(body):
+            with lock:
+                in_flight.append(body)
+                peak.append(len(in_flight))
+            time.sleep(0.02)
+            with lock:
+                in_flight.remove(body)
+            return latinize_line_by_line(body)
+
+        transport = fake_claude(counting_responder)
+        text = "\n".join(f"satır {number}" for number in range(12))
+        latinize_ocr_text_in_chunks(get_claude_client(), text, max_lines=2, max_concurrency=2)
+
+        assert len(transport.requests) == 6
+        assert max(peak) == 2
+
+    def test_end_to_end_process_latinizes_in_chunks(self, monkeypatch, fake_claude):
+        """end_to_end_process sends a long page in chunks and returns the whole latinization."""
+        text = "\n".join(f"satır {number}" for number in range(6))
+        monkeypatch.setattr(analyze, "document_ai_ocr", lambda file_path: text)
+        transport = fake_claude(latinize_line_by_line)
+        response = end_to_end_process("page.png", chunk_lines=3)
+
+        data = json.loads(response.content)
+        assert len(transport.requests) == 2
+        assert data["OCR"] == text
+        assert split_latinized_lines(data["Latinized"]) == [f"Latin satır {number}" for number in range(6)]
+
+
+class TestPromptCaching:
+
+    def test_system_prompts_are_cacheable(self, fake_transport):
+        """The static system prompts end with a cache breakpoint, sent with the prompt caching beta header."""
+        latinize_ocr_text(get_claude_client(), "درسعادت بدایت محکمهسی")
+        extract_appointments(get_claude_client(), "Tevfik Bey'e")
+
+        latinization_request, extraction_request = fake_transport.requests
+        assert latinization_request["system"] == [{"type": "text", "text": analyze.LATINIZATION_SYSTEM_PROMPT,
+                                                   "cache_control": {"type": "ephemeral"}}]
+        assert [block["text"] for block in extraction_request["system"]] == \
+            [analyze.STRUCTURED_DATA_EXTRACTION_SYSTEM_PROMPT, analyze.STRUCTURED_DATA_EXTRACTION_EXAMPLES]
+        assert "cache_control" not in extraction_request["system"][0]
+        assert extraction_request["system"][1]["cache_control"] == {"type": "ephemeral"}
+        assert all(headers["anthropic-beta"] == analyze.PROMPT_CACHING_BETA for headers in fake_transport.headers)
+
+    def test_cache_reads_and_writes_are_recorded(self, monkeypatch, fake_claude):
+        monkeypatch.setattr(analyze, "_prompt_cache_usage", type(analyze._prompt_cache_usage)(
+            analyze._prompt_cache_usage.default_factory))
+        fake_claude(FakeClaudeTransport(usage={"cache_read_input_tokens": 900, "cache_creation_input_tokens": 0}))
+        latinize_ocr_text(get_claude_client(), "درسعادت")
+        latinize_ocr_text(get_claude_client(), "بدایت")
+
+        assert prompt_cache_stats() == {"latinization": {"requests": 2, "input_tokens": 20,
+                                                         "cache_read_input_tokens": 1800,
+                                                         "cache_creation_input_tokens": 0}}
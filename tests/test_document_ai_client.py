@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from MobilityAnalyzer import analyze
+from tests.fake_claude import TEST_IMAGE
+
+
+class FakeDocumentAIClient:
+    """Stands in for DocumentProcessorServiceClient and records the OCR requests."""
+
+    def __init__(self, credentials=None, client_options=None):
+        self.credentials = credentials
+        self.client_options = client_options
+        self.requests = []
+
+    def process_document(self, request):
+        self.requests.append(request)
+        return SimpleNamespace(document=SimpleNamespace(text="توجيهات"))
+
+
+@pytest.fixture
+def ocr_cache():
+    """The OCR cache of the test, emptied by the isolated_analysis_caches fixture."""
+    return analyze.ocr_cache
+
+
+@pytest.fixture
+def fake_document_ai(monkeypatch, ocr_cache):
+    """Replace the Document AI client class and the key file loading with fakes."""
+    loaded_keys = []
+
+    def load_key(key_path):
+        loaded_keys.append(key_path)
+        return object()
+
+    monkeypatch.setattr(analyze.service_account.Credentials, "from_service_account_file", load_key)
+    monkeypatch.setattr(analyze.documentai, "DocumentProcessorServiceClient", FakeDocumentAIClient)
+    monkeypatch.setattr(analyze, "_document_ai_clients", {})
+    return loaded_keys
+
+
+class TestDocumentAIClient:
+
+    def test_client_is_cached_per_key_and_location(self, fake_document_ai):
+        """The key file is read once per (key, location), and the client is reused."""
+        client = analyze.get_document_ai_client("key.json", "eu")
+
+        assert analyze.get_document_ai_client("key.json", "eu") is client
+        assert analyze.get_document_ai_client("key.json", "us") is not client
+        assert fake_document_ai == ["key.json", "key.json"]
+        assert client.client_options.api_endpoint == "eu-documentai.googleapis.com"
+
+    def test_ocr_reuses_the_client(self, fake_document_ai, ocr_cache):
+        """Consecutive OCR calls go through the same client and processor name."""
+        for _ in range(3):
+            assert analyze.document_ai_ocr(str(TEST_IMAGE), "key.json") == "توجيهات"
+            ocr_cache.purge()
+
+        client = analyze.get_document_ai_client("key.json")
+        assert len(client.requests) == 3
+        assert fake_document_ai == ["key.json"]
+        assert client.requests[0].name == analyze.document_ai_processor_name()
+
+    def test_warm_up_failure_is_not_raised(self, monkeypatch):
+        """A failing warm-up is logged and does not stop the server."""
+        def fail(*args, **kwargs):
+            raise FileNotFoundError("key.json")
+
+        monkeypatch.setattr(analyze, "get_document_ai_client", fail)
+        analyze.warm_up_document_ai("key.json")
+
+
+class TestOCRCache:
+
+    def test_same_image_is_sent_once(self, fake_document_ai, ocr_cache, tmp_path):
+        """A re-uploaded page is served from the cache, whatever its file name."""
+        copy_of_image = tmp_path / 'copy.png'
+        copy_of_image.write_bytes(TEST_IMAGE.read_bytes())
+
+        assert analyze.document_ai_ocr(str(TEST_IMAGE), "key.json") == "توجيهات"
+        assert analyze.document_ai_ocr(str(copy_of_image), "key.json") == "توجيهات"
+
+        assert len(analyze.get_document_ai_client("key.json").requests) == 1
+        assert ocr_cache.stats()["hits"] == 1
+
+    def test_cache_key_includes_the_processor(self, fake_document_ai, ocr_cache, monkeypatch):
+        """Results of another processor are not reused."""
+        analyze.document_ai_ocr(str(TEST_IMAGE), "key.json")
+        monkeypatch.setattr(analyze, "document_ai_processor_name", lambda: "projects/p/locations/eu/processors/other")
+        analyze.document_ai_ocr(str(TEST_IMAGE), "key.json")
+
+        assert len(analyze.get_document_ai_client("key.json").requests) == 2
+
+
+class TestInMemoryUpload:
+
+    def test_uploaded_page_is_ocred_from_memory(self, fake_document_ai, ocr_cache):
+        """An upload is read chunk by chunk and sent as is, with the same cache as a file."""
+        upload = SimpleUploadedFile("page.png", TEST_IMAGE.read_bytes(), content_type="image/png")
+        upload.DEFAULT_CHUNK_SIZE = 1024
+        image_content = analyze.read_uploaded_png(upload)
+
+        assert image_content == TEST_IMAGE.read_bytes()
+        assert analyze.document_ai_ocr_content(image_content, "key.json") == "توجيهات"
+        assert analyze.document_ai_ocr(str(TEST_IMAGE), "key.json") == "توجيهات"
+        client = analyze.get_document_ai_client("key.json")
+        assert len(client.requests) == 1
+        assert client.requests[0].raw_document.content == image_content
+
+    def test_other_files_are_rejected_by_their_signature(self, fake_document_ai, tmp_path):
+        with pytest.raises(ValueError):
+            analyze.read_uploaded_png(SimpleUploadedFile("page.png", b"GIF89a", content_type="image/png"))
+        with pytest.raises(Exception, match="not a valid PNG"):
+            analyze.document_ai_ocr_content(b"%PDF-1.7", "key.json")
+
+        renamed_file = tmp_path / 'page.png'
+        renamed_file.write_bytes(b"%PDF-1.7")
+        with pytest.raises(Exception, match="not a valid PNG"):
+            analyze.document_ai_ocr(str(renamed_file), "key.json")
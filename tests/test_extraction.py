@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+
+import pytest
+
+from MobilityAnalyzer import analyze
+from django.urls import reverse
+
+from MobilityAnalyzer.analyze import (
+    extract_appointments,
+    get_claude_client,
+    reextract_appointments
+)
+from MobilityAnalyzer.segmenter import segment_appointments
+from tests.fake_claude import SAMPLE_TEXT, extract_each_block, recipient
+
+
+@pytest.fixture
+def extraction_transport(fake_claude):
+    return fake_claude(extract_each_block)
+
+
+class TestBatchedExtraction:
+
+    def test_batches_are_merged_in_order(self, extraction_transport):
+        extracted = json.loads(extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=2))
+
+        assert len(extraction_transport.requests) == 3
+        assert [appointment["name"] for appointment in extracted["appointments"]] == \
+            [recipient(block) for block in segment_appointments(SAMPLE_TEXT)]
+
+    def test_short_text_is_sent_at_once(self, extraction_transport):
+        """A text with no more blocks than a batch is sent as is."""
+        extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=6)
+
+        assert len(extraction_transport.requests) == 1
+        assert extraction_transport.requests[0]["messages"][0]["content"].endswith(SAMPLE_TEXT)
+
+    def test_batches_are_extracted_concurrently(self, fake_claude):
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def counting_responder(body):
+            with lock:
+                in_flight.append(body)
+                peak.append(len(in_flight))
+            time.sleep(0.02)
+            with lock:
+                in_flight.remove(body)
+            return extract_each_block(body)
+
+        fake_claude(counting_responder)
+        extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=1, max_concurrency=3)
+
+        assert max(peak) == 3
+
+    def test_malformed_block_does_not_spoil_the_rest(self, fake_claude):
+        """A batch Claude answers with invalid JSON is retried block by block; only the bad block is lost."""
+        def malformed_for_davud(body):
+            if "Dâvud" in body["messages"][0]["content"]:
+                return "{'appointments': [{'name': 'single quotes'}]}"
+            return extract_each_block(body)
+
+        transport = fake_claude(malformed_for_davud)
+        extracted = json.loads(extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=2))
+
+        names = [appointment["name"] for appointment in extracted["appointments"]]
+        assert len(names) == 5
+        assert "Dâvud Efendi'ye" not in names
+        assert names[0] == "Emin Efendi'ye" and names[-1] == "Tevfik Bey'e"
+        # Three batches, plus the two blocks of the malformed one on their own.
+        assert len(transport.requests) == 5
+
+    def test_other_lists_are_merged(self, fake_claude):
+        fake_claude(lambda body: json.dumps(
+            {"appointments": [{"name": "a"}], "dismissals": [{"name": "d"}]}))
+        extracted = json.loads(extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=3))
+
+        assert extracted == {"appointments": [{"name": "a"}] * 2, "dismissals": [{"name": "d"}] * 2}
+
+    def test_short_text_answer_is_normalized(self, fake_claude):
+        """Short and long texts both give plain JSON, also when Claude wraps its answer in text."""
+        fake_claude(lambda body: "Here is the JSON:\n```json\n" + extract_each_block(body) + "\n```")
+        short = json.loads(extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=6))
+        long = json.loads(extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=2))
+
+        assert short == long
+        assert len(short["appointments"]) == 6
+
+    def test_malformed_short_text_is_retried_block_by_block(self, fake_claude):
+        def malformed_for_several_blocks(body):
+            text = body["messages"][0]["content"]
+            return "not JSON" if len(segment_appointments(text)) > 1 else extract_each_block(body)
+
+        transport = fake_claude(malformed_for_several_blocks)
+        extracted = json.loads(extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=6))
+
+        assert len(extracted["appointments"]) == 6
+        assert len(transport.requests) == 7
+
+    def test_batch_size_setting(self, extraction_transport):
+        assert analyze.EXTRACTION_BATCH_BLOCKS > 0
+        extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=0)
+        assert len(extraction_transport.requests) == 1
+
+
+EDITED_TEXT = SAMPLE_TEXT.replace("Dâvud", "Dâvûd")
+
+
+def previous_appointments():
+    return [{"name": recipient(block), "notes": "checked"} for block in segment_appointments(SAMPLE_TEXT)]
+
+
+class TestReextraction:
+
+    def test_only_the_edited_block_is_sent(self, extraction_transport):
+        extracted = reextract_appointments(get_claude_client(), SAMPLE_TEXT, EDITED_TEXT, previous_appointments())
+
+        assert len(extraction_transport.requests) == 1
+        sent_text = extraction_transport.requests[0]["messages"][0]["content"]
+        assert "Dâvûd" in sent_text and "Ertuğrul" not in sent_text
+        assert extracted["reextracted_blocks"] == 1
+        # The other rows are kept as they were in the table.
+        assert extracted["appointments"][2] == {"name": "Dâvûd Efendi'ye"}
+        assert [appointment.get("notes") for appointment in extracted["appointments"]] == \
+            ["checked", "checked", None, "checked", "checked", "checked"]
+
+    def test_inserted_and_removed_blocks(self, extraction_transport):
+        blocks = segment_appointments(SAMPLE_TEXT)
+        edited_text = "\n".join(blocks[1:3] + ["Konya Hasan Bey'e"] + blocks[3:])
+        extracted = reextract_appointments(get_claude_client(), SAMPLE_TEXT, edited_text, previous_appointments())
+
+        assert len(extraction_transport.requests) == 1
+        assert [appointment["name"] for appointment in extracted["appointments"]] == \
+            [recipient(block) for block in segment_appointments(edited_text)]
+
+    def test_cached_blocks_are_reused(self, extraction_transport):
+        """Without usable previous appointments, blocks extracted before come from the cache."""
+        extract_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=3)
+        extracted = reextract_appointments(get_claude_client(), SAMPLE_TEXT, EDITED_TEXT, [])
+
+        assert len(extraction_transport.requests) == 3
+        assert extracted["reextracted_blocks"] == 1
+        assert len(extracted["appointments"]) == 6
+
+    def test_reextraction_view(self, client, extraction_transport):
+        response = client.post(reverse("reextract_appointment_data"), json.dumps({
+            "previous_text": SAMPLE_TEXT, "text": EDITED_TEXT, "previous_appointments": previous_appointments()
+        }), content_type="application/json")
+
+        assert response.status_code == 200
+        assert len(response.json()["appointments"]) == 6
+        assert len(extraction_transport.requests) == 1
+
+    def test_reextraction_view_requires_the_previous_extraction(self, client):
+        response = client.post(reverse("reextract_appointment_data"), json.dumps({"text": EDITED_TEXT}),
+                               content_type="application/json")
+        assert response.status_code == 400
@@ -0,0 +1,106 @@
+import threading
+import time
+from datetime import date
+
+import pytest
+from django.core.management import call_command
+
+from MobilityAnalyzer import analyze
+from MobilityAnalyzer.ingest import ingest_archive, page_date
+from MobilityAnalyzer.models import IngestedPage, MovementItem
+from MobilityAnalyzer.prompts import LATINIZATION_SYSTEM_PROMPT
+from tests.fake_claude import latinize_or_extract
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture
+def fake_transport(fake_claude):
+    return fake_claude(latinize_or_extract)
+
+
+class TestIngestArchive:
+
+    def test_pages_are_saved_with_resolved_locations(self, archive, ocred_pages, fake_transport):
+        counts = ingest_archive(archive, ocr_workers=2, latinization_workers=2, extraction_workers=2, batch_size=3)
+
+        assert counts == {'pages': 4, 'appointments': 4, 'failed': 0, 'skipped': 0}
+        item = MovementItem.objects.get(source='1890-05-08/page2.png')
+        assert (item.name, item.fromCity, item.toCity) == ("Sayfa 1890-05-08/page2", "istanbul", "Not specified")
+        assert item.notes == "fromCity read as Istambul."
+        assert item.date == date(1890, 5, 8)
+        assert IngestedPage.objects.count() == 4
+
+    def test_ingested_pages_are_skipped(self, archive, ocred_pages, fake_transport):
+        ingest_archive(archive, limit=3)
+        requests = len(fake_transport.requests)
+
+        counts = ingest_archive(archive)
+
+        assert counts == {'pages': 1, 'appointments': 1, 'failed': 0, 'skipped': 3}
+        assert ocred_pages[-1] == archive / '1890-05-08' / 'page2.png'
+        assert len(fake_transport.requests) == requests + 2
+        assert MovementItem.objects.count() == 4
+
+    def test_failed_pages_are_tried_again(self, archive, ocred_pages, fake_transport, monkeypatch):
+        ocr = analyze.document_ai_ocr
+
+        def failing_ocr(file_path):
+            if file_path.endswith('page1.png'):
+                raise Exception("Document AI is unavailable.")
+            return ocr(file_path)
+        monkeypatch.setattr(analyze, "document_ai_ocr", failing_ocr)
+
+        assert ingest_archive(archive)['failed'] == 2
+        assert not IngestedPage.objects.filter(path__endswith='page1.png').exists()
+
+        monkeypatch.setattr(analyze, "document_ai_ocr", ocr)
+        assert ingest_archive(archive) == {'pages': 2, 'appointments': 2, 'failed': 0, 'skipped': 2}
+
+    def test_wrapped_extraction_answers(self, archive, ocred_pages, fake_transport):
+        fake_transport.responder = lambda body: "Here is the JSON:\n```json\n" + latinize_or_extract(body) + "\n```" \
+            if body["system"][0]["text"] != LATINIZATION_SYSTEM_PROMPT else latinize_or_extract(body)
+
+        assert ingest_archive(archive) == {'pages': 4, 'appointments': 4, 'failed': 0, 'skipped': 0}
+
+    def test_pages_send_one_request_at_a_time(self, archive, fake_claude, monkeypatch):
+        """Long pages are not latinized in concurrent chunks on top of the concurrent pages."""
+        monkeypatch.setattr(analyze, "document_ai_ocr",
+                            lambda file_path: "\n".join(f"page {file_path}/{line}" for line in range(60)))
+        lock = threading.Lock()
+        in_flight = peak = 0
+
+        def slow_responder(body):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight -= 1
+            return latinize_or_extract(body)
+        transport = fake_claude(slow_responder)
+
+        ingest_archive(archive, ocr_workers=4, latinization_workers=2, extraction_workers=1)
+
+        # 4 chunks of 15 lines per page.
+        latinizations = [body for body in transport.requests if body["system"][0]["text"] == LATINIZATION_SYSTEM_PROMPT]
+        assert len(latinizations) == 16
+        assert peak <= 2 + 1
+
+    def test_command(self, archive, ocred_pages, fake_transport, capsys):
+        call_command("ingest_archive", str(archive), "--source", "Ceride-i Mehakim", "--batch-size", "1")
+
+        assert "Saved 4 appointments from 4 pages." in capsys.readouterr().out
+        assert set(MovementItem.objects.values_list("source", flat=True)) == {"Ceride-i Mehakim"}
+
+
+class TestPageDate:
+
+    def test_date_in_path(self):
+        assert page_date("1890-05-08/page2.png") == date(1890, 5, 8)
+        assert page_date("page2.png", date(1890, 1, 1)) == date(1890, 1, 1)
+
+    def test_page_without_date(self):
+        with pytest.raises(ValueError):
+            page_date("page2.png")
@@ -0,0 +1,141 @@
+import threading
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from MobilityAnalyzer import analyze, jobs
+from MobilityAnalyzer.jobs import claim_next_job, requeue_stale_jobs, run_page_job, submit_page_job, work
+from MobilityAnalyzer.models import PageJob
+from tests.fake_claude import LATINIZED_TEXT, OCR_TEXT, upload
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+class TestPageJobs:
+
+    def test_jobs_are_claimed_once_in_order(self):
+        first = submit_page_job("first.png", PNG)
+        second = submit_page_job("second.png", PNG)
+
+        assert claim_next_job().pk == first.pk
+        assert claim_next_job().pk == second.pk
+        assert claim_next_job() is None
+        assert set(PageJob.objects.values_list("status", flat=True)) == {PageJob.Status.RUNNING}
+
+    def test_each_stage_is_saved(self, fake_page, monkeypatch):
+        """The OCR text is saved before the Latinization starts, and the Latinization chunk by chunk."""
+        stages = []
+
+        def stream_latinization(claude_client, ocr_text):
+            for piece in ["Dersaadet", " bidayet"]:
+                job = PageJob.objects.get()
+                stages.append((job.stage, job.ocr_text, job.latinized_text))
+                yield piece
+        monkeypatch.setattr(analyze, "stream_latinization", stream_latinization)
+        monkeypatch.setattr(jobs, "LATINIZATION_SAVE_INTERVAL", 0)
+        submit_page_job("page.png", PNG)
+
+        run_page_job(claim_next_job())
+
+        assert stages == [(PageJob.Stage.LATINIZATION, OCR_TEXT, ""),
+                          (PageJob.Stage.LATINIZATION, OCR_TEXT, "Dersaadet")]
+        job = PageJob.objects.get()
+        assert (job.status, job.stage) == (PageJob.Status.DONE, PageJob.Stage.DONE)
+        assert job.latinized_text == "Dersaadet bidayet"
+        assert job.finished_at is not None
+        # The image is not kept once the page is done.
+        assert bytes(job.image) == b""
+
+    def test_latinization_saves_are_throttled(self, fake_page, monkeypatch):
+        saved_texts = []
+
+        def stream_latinization(claude_client, ocr_text):
+            for piece in ["Dersaadet", " bidayet", " mahkemesi"]:
+                saved_texts.append(PageJob.objects.get().latinized_text)
+                yield piece
+        monkeypatch.setattr(analyze, "stream_latinization", stream_latinization)
+        monkeypatch.setattr(jobs, "LATINIZATION_SAVE_INTERVAL", 60)
+        submit_page_job("page.png", PNG)
+
+        run_page_job(claim_next_job())
+
+        assert saved_texts == ["", "", ""]
+        assert PageJob.objects.get().latinized_text == "Dersaadet bidayet mahkemesi"
+
+    def test_failure_is_saved_in_the_job(self, fake_page, monkeypatch):
+        def failing_ocr(image_content):
+            raise Exception("Document AI is unavailable.")
+        monkeypatch.setattr(analyze, "document_ai_ocr_content", failing_ocr)
+        submit_page_job("page.png", PNG)
+
+        run_page_job(claim_next_job())
+
+        job = PageJob.objects.get()
+        assert (job.status, job.stage) == (PageJob.Status.FAILED, PageJob.Stage.OCR)
+        assert job.error == "Document AI is unavailable."
+        assert bytes(job.image) == b""
+
+    def test_stale_jobs_are_queued_again(self):
+        submit_page_job("page.png", PNG)
+        claim_next_job()
+
+        assert requeue_stale_jobs(timedelta(minutes=10)) == 0
+        PageJob.objects.update(updated_at=timezone.now() - timedelta(minutes=11))
+        assert requeue_stale_jobs(timedelta(minutes=10)) == 1
+        assert claim_next_job() is not None
+
+    def test_worker_threads_share_the_queue(self, fake_page):
+        for number in range(6):
+            submit_page_job(f"page{number}.png", PNG)
+
+        jobs_run = []
+        threads = [threading.Thread(target=lambda: jobs_run.append(work(threading.Event(), exit_when_idle=True)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sum(jobs_run) == 6
+        assert set(PageJob.objects.values_list("status", flat=True)) == {PageJob.Status.DONE}
+
+    def test_worker_command_drains_the_queue(self, fake_page, capsys):
+        for number in range(3):
+            submit_page_job(f"page{number}.png", PNG)
+
+        call_command("run_page_worker", threads=2, once=True)
+
+        assert set(PageJob.objects.values_list("status", flat=True)) == {PageJob.Status.DONE}
+        assert "Started 2 page worker threads." in capsys.readouterr().out
+
+    def test_worker_command_runs_one_thread_on_sqlite(self, fake_page, capsys):
+        call_command("run_page_worker", once=True)
+
+        assert "Started 1 page worker threads." in capsys.readouterr().out
+
+
+class TestPageJobViews:
+
+    def test_upload_returns_a_job_to_poll(self, client, fake_page):
+        response = client.post(reverse("submit_page"), upload())
+
+        assert response.status_code == 202
+        status_url = reverse("page_job_status", args=[response.json()["job_id"]])
+        assert client.get(status_url).json()["status"] == PageJob.Status.QUEUED
+
+        work(threading.Event(), exit_when_idle=True)
+
+        progress = client.get(status_url).json()
+        assert progress["status"] == PageJob.Status.DONE
+        assert (progress["OCR"], progress["Latinized"]) == (OCR_TEXT, LATINIZED_TEXT)
+
+    def test_missing_file(self, client):
+        assert client.post(reverse("submit_page")).status_code == 400
+
+    def test_unknown_job(self, client):
+        assert client.get(reverse("page_job_status", args=[1])).status_code == 404
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from MobilityAnalyzer.json_stream import JSONArrayStreamParser
+
+APPOINTMENTS = {"appointments": [
+    {"name": "Mehmed Emin Efendi", "fromCity": "Manastır", "toCity": "Akçehisar",
+     "notes": "Braces {like [these]} and \"quotes\" in a string"},
+    {"name": "Dâvud Efendi", "fromCity": "Trablus-ı Garb", "toCity": "Şiyak",
+     "salary": {"amount": 1500, "currency": "kuruş"}},
+    {"name": "Tevfik Bey", "fromCity": "Seydişehir", "toCity": "Tiran", "notes": "Ends with a backslash \\"},
+]}
+
+
+def feed_in_pieces(parser, document: str, piece_size: int) -> list:
+    """Feeds the document piece by piece, recording after which piece each object was returned."""
+    returned = []
+    for start in range(0, len(document), piece_size):
+        for parsed_object in parser.feed(document[start:start + piece_size]):
+            returned.append((start + piece_size, parsed_object))
+    return returned
+
+
+class TestJSONArrayStreamParser:
+
+    @pytest.mark.parametrize("piece_size", [1, 3, 8, 1000])
+    def test_objects_match_json_loads(self, piece_size):
+        """Whatever the size of the pieces, the objects are the same as with json.loads."""
+        parser = JSONArrayStreamParser("appointments")
+        returned = feed_in_pieces(parser, json.dumps(APPOINTMENTS, ensure_ascii=False), piece_size)
+
+        assert [parsed_object for _, parsed_object in returned] == APPOINTMENTS["appointments"]
+        assert parser.finished
+
+    def test_objects_are_returned_as_soon_as_they_are_complete(self):
+        document = json.dumps(APPOINTMENTS, ensure_ascii=False)
+        parser = JSONArrayStreamParser("appointments")
+        returned = feed_in_pieces(parser, document, 1)
+
+        first_object_end = document.index(json.dumps(APPOINTMENTS["appointments"][0], ensure_ascii=False)) + \
+            len(json.dumps(APPOINTMENTS["appointments"][0], ensure_ascii=False))
+        assert returned[0][0] == first_object_end
+
+    def test_text_around_the_json_is_ignored(self):
+        parser = JSONArrayStreamParser("appointments")
+        document = "Here is the JSON:\n```json\n" + json.dumps(APPOINTMENTS) + "\n```"
+        objects = [parsed_object for _, parsed_object in feed_in_pieces(parser, document, 5)]
+
+        assert objects == APPOINTMENTS["appointments"]
+
+    def test_other_keys_are_not_parsed(self):
+        parser = JSONArrayStreamParser("appointments")
+        assert parser.feed('{"other": [{"a": 1}], "appointments": [{"b": 2}') == [{"b": 2}]
+
+    def test_empty_array(self):
+        parser = JSONArrayStreamParser("appointments")
+        assert parser.feed('{"appointments": []}') == []
+        assert parser.finished
+
+    def test_invalid_object(self):
+        parser = JSONArrayStreamParser("appointments")
+        with pytest.raises(json.JSONDecodeError):
+            parser.feed("{\"appointments\": [{'name': 'single quotes'}]}")
@@ -1,6 +1,24 @@
+import os
+import numpy as np
+import pandas as pd
 import pytest
 from pathlib import Path
-from MobilityAnalyzer.suggest_location import suggest_location
+from MobilityAnalyzer.gazetteer import (
+    Gazetteer,
+    check_gazetteer_for_changes,
+    get_gazetteer,
+    load_gazetteer,
+    normalize_location_name,
+    read_index_file,
+    strip_administrative_suffix,
+    write_index_file
+)
+from MobilityAnalyzer.suggest_location import (
+    complete_location,
+    suggest_location,
+    suggest_locations,
+    suggestion_cache
+)
 from typing import Dict, List
 current_dir = Path(__file__).parent
 current_dir / '..' / 'data' / 'ottoman_locations.xlsx'
@@ -65,3 +83,140 @@ class TestLocationNameSuggestion:
         assert suggestions[0] == "No suggestion.", "Suggestions should be empty for an empty location name."
         suggestions = suggest_location("99999", str(locations_sheet))
         assert suggestions[0] == "No suggestion.", "Suggestions should be empty for an empty location name."
+
+
+class TestGazetteer:
+
+    def test_gazetteer_is_loaded_once(self, locations_sheet: Path):
+        """The Excel sheet should be read only once per process."""
+        assert get_gazetteer(str(locations_sheet)) is get_gazetteer(str(locations_sheet))
+
+    def test_gazetteer_names_are_normalized_and_unique(self):
+        """Names are normalized and deduplicated, keeping the sheet order."""
+        gazetteer = Gazetteer.from_names(['Edirne', 'edirne', 'Şam', None, 'Üsküb'])
+        assert gazetteer.names == ['edirne', 'sam', 'uskub']
+
+    def test_gazetteer_nearest_tie_order(self):
+        """Names with the same distance are returned in the sheet order."""
+        gazetteer = Gazetteer.from_names(['kanya', 'konya', 'konia', 'bursa'])
+        assert gazetteer.nearest('konya', 3) == ['konya', 'kanya', 'konia']
+
+    def test_bounded_suggestion(self, locations_sheet: Path):
+        """Bounded suggestions only contain names within the given distance."""
+        suggestions = suggest_location("Edorne Vilayeti", str(locations_sheet), max_distance=1)
+        assert suggestions[0] == "edirne vilayeti"
+        assert len(suggestions) < 25
+
+    def test_batch_suggestions_match_single_suggestions(self, locations_sheet: Path):
+        """Batched suggestions should be the same as suggesting each name on its own."""
+        location_names = [variant for _, variants in LOCATION_VARIATIONS for variant in variants]
+        location_names += ["", None, "12358", "Not specified"]
+        batch_suggestions = suggest_locations(location_names, str(locations_sheet))
+        assert batch_suggestions == [suggest_location(name, str(locations_sheet)) for name in location_names]
+
+    def test_compiled_gazetteer_file(self, locations_sheet: Path, tmp_path: Path):
+        """The compiled file is memory-mapped back to the same names."""
+        source_path = tmp_path / 'locations.xlsx'
+        source_path.write_bytes(locations_sheet.read_bytes())
+        gazetteer = Gazetteer.from_excel(str(source_path))
+
+        index_path = write_index_file(gazetteer, str(source_path))
+        assert index_path == str(tmp_path / 'locations.gazetteer')
+
+        compiled_gazetteer = read_index_file(str(source_path))
+        assert compiled_gazetteer is not None
+        assert compiled_gazetteer.name_data.readonly and not compiled_gazetteer.sorted_order.flags.writeable
+        assert compiled_gazetteer.version == gazetteer.version
+        assert compiled_gazetteer.complete('edi') == gazetteer.complete('edi')
+        assert compiled_gazetteer.names == gazetteer.names
+        assert compiled_gazetteer.nearest('edorne') == gazetteer.nearest('edorne')
+
+    def test_compiled_gazetteer_file_is_invalidated(self, locations_sheet: Path, tmp_path: Path):
+        """The compiled file is ignored once the Excel file changes, but not when it is only touched."""
+        source_path = tmp_path / 'locations.xlsx'
+        source_path.write_bytes(locations_sheet.read_bytes())
+        write_index_file(Gazetteer.from_excel(str(source_path)), str(source_path))
+
+        os.utime(source_path, ns=(0, 0))
+        assert read_index_file(str(source_path)) is not None
+
+        source_path.write_bytes(locations_sheet.read_bytes() + b'\0')
+        assert read_index_file(str(source_path)) is None
+
+    def test_load_gazetteer_compiles_the_excel_file(self, locations_sheet: Path, tmp_path: Path):
+        """Loading a gazetteer without a compiled file writes one for the next process."""
+        source_path = tmp_path / 'locations.xlsx'
+        source_path.write_bytes(locations_sheet.read_bytes())
+
+        gazetteer = load_gazetteer(str(source_path))
+        assert (tmp_path / 'locations.gazetteer').exists()
+        assert read_index_file(str(source_path)).names == gazetteer.names
+
+    @pytest.mark.parametrize("expected_suggestion, possible_variation", LOCATION_VARIATIONS)
+    def test_ngram_ranking_matches_linear_scan(self, locations_sheet: Path, expected_suggestion: str,
+                                               possible_variation: List[str]):
+        """The trigram prefiltered search should return exactly the ranking of the brute-force scan."""
+        gazetteer = get_gazetteer(str(locations_sheet))
+        for location_variant in possible_variation:
+            name, _ = strip_administrative_suffix(normalize_location_name(location_variant))
+            for limit, max_distance in [(25, None), (25, 2), (5, 1), (1, None)]:
+                expected = gazetteer.nearest_linear(name, limit, max_distance)
+                found = [gazetteer.names[position]
+                         for _, position in gazetteer.ngram_index.search(name, limit, max_distance)]
+                assert found == expected, f"Trigram search ranking differs for '{location_variant}'"
+
+    def test_ngram_candidates_include_every_close_name(self, locations_sheet: Path):
+        """The trigram prefilter must not drop any name within the distance."""
+        gazetteer = get_gazetteer(str(locations_sheet))
+        for name in ['istambul', 'edorne', 'selanik', 'meis', 'x']:
+            distances = gazetteer.distances(name)
+            for max_distance in range(4):
+                candidates = set(gazetteer.ngram_index.candidates(name, max_distance).tolist())
+                assert set(np.flatnonzero(distances <= max_distance).tolist()) <= candidates
+
+    def test_prefix_completion(self):
+        """Completions start with the prefix and come in alphabetical order."""
+        gazetteer = Gazetteer.from_names(['konya', 'edirne', 'edremit', 'edirnecik', 'bursa'])
+        assert gazetteer.complete('edi') == ['edirne', 'edirnecik']
+        assert gazetteer.complete('ed', 2) == ['edirne', 'edirnecik']
+        assert gazetteer.complete('x') == []
+        assert Gazetteer.from_names(['şam', 'sam', 'sakız']).complete('sa') == ['sakiz', 'sam']
+
+    def test_location_completion_folds_characters(self, locations_sheet: Path):
+        """Typed prefixes are folded like suggest_location, and a full suffix is kept."""
+        completions = complete_location("Üsküd", str(locations_sheet))
+        assert completions and all(completion.startswith("uskud") for completion in completions)
+        assert "edirne vilayeti" in complete_location("Edirne Vilayeti", str(locations_sheet))
+        assert "istanbul" in complete_location("İsta", str(locations_sheet))
+
+    def test_gazetteer_version_follows_content(self):
+        """The version changes with the names, so cached results of an old gazetteer are not reused."""
+        assert Gazetteer.from_names(['edirne']).version == Gazetteer.from_names(['Edirne']).version
+        assert Gazetteer.from_names(['edirne']).version != Gazetteer.from_names(['edirne', 'konya']).version
+
+    def test_suggestions_are_cached(self, locations_sheet: Path):
+        """Recurring names are served from the suggestion cache."""
+        suggestion_cache.clear()
+        first_suggestions = suggest_location("Selanik Vilayeti", str(locations_sheet))
+        assert suggestion_cache.stats()["misses"] == 1
+        assert suggest_location("selanik vilayeti", str(locations_sheet)) == first_suggestions
+        assert suggest_locations(["Selanik Vilayeti"], str(locations_sheet)) == [first_suggestions]
+        assert suggestion_cache.stats()["hits"] == 2
+
+    def test_gazetteer_is_reloaded_when_the_sheet_changes(self, tmp_path: Path):
+        """A changed sheet is loaded in the background and swapped in."""
+        source_path = tmp_path / 'locations.xlsx'
+        pd.DataFrame({'cleaned_location_name': ['edirne', 'konya']}).to_excel(source_path, index=False)
+        old_gazetteer = get_gazetteer(str(source_path))
+        assert suggest_location("Bursa", str(source_path)) == ['konya', 'edirne']
+
+        pd.DataFrame({'cleaned_location_name': ['edirne', 'bursa']}).to_excel(source_path, index=False)
+        os.utime(source_path, ns=(0, 0))
+        # The old gazetteer is still served until the check runs.
+        assert get_gazetteer(str(source_path)) is old_gazetteer
+
+        check_gazetteer_for_changes(str(source_path), wait=True)
+        new_gazetteer = get_gazetteer(str(source_path))
+        assert new_gazetteer.names == ['edirne', 'bursa']
+        assert new_gazetteer.version != old_gazetteer.version
+        assert suggest_location("Bursa", str(source_path))[0] == 'bursa'
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from MobilityAnalyzer import analyze
+from MobilityAnalyzer.analyze import extract_appointments, get_claude_client, latinize_ocr_text
+from MobilityAnalyzer.routing import RoutingStats, extraction_problem, latinization_problem
+
+FAST_MODEL = "claude-3-haiku-20240307"
+APPOINTMENT = {"name": "Tevfik Bey", "fromCity": "Seydişehir", "toCity": "Tiran", "fromTitle": "müstantik",
+               "toTitle": "Not specified", "salary": "Not specified", "education": "Not specified"}
+
+
+@pytest.fixture
+def routing(monkeypatch):
+    monkeypatch.setattr(analyze, "MODEL_ROUTING", True)
+    monkeypatch.setattr(analyze, "CLAUDE_FAST_MODEL", FAST_MODEL)
+    monkeypatch.setattr(analyze, "routing_stats", RoutingStats())
+
+
+@pytest.fixture
+def answering(fake_claude):
+    """Makes the shared client answer the fast model and CLAUDE_MODEL differently. Returns the transport."""
+    def use(fast_answer: str, large_answer: str):
+        return fake_claude(lambda body: fast_answer if body["model"] == FAST_MODEL else large_answer)
+    return use
+
+
+class TestQualityChecks:
+
+    def test_latinization_line_count(self):
+        assert latinization_problem("bir\niki", "bir\\n\niki") is None
+        assert latinization_problem("bir\niki\n", "bir\\n\niki\\n\n") is None
+        assert latinization_problem("bir\niki", "bir iki") == "1 latinized lines for 2 OCR lines"
+        assert latinization_problem("bir", "") == "empty latinization"
+
+    def test_extraction_json(self):
+        assert extraction_problem(json.dumps({"appointments": [APPOINTMENT]}), 0.6) is None
+        assert extraction_problem("{'appointments': []}", 0.6) == "invalid JSON"
+        assert extraction_problem(json.dumps({"appointments": "none"}), 0.6) == "no appointments list"
+
+    def test_extraction_not_specified_fields(self):
+        vague = dict.fromkeys(APPOINTMENT, "Not specified") | {"name": "Tevfik Bey"}
+        assert extraction_problem(json.dumps({"appointments": [vague]}), 0.6) == "6 of 7 fields not specified"
+
+
+class TestModelRouting:
+
+    def test_short_text_answered_by_the_fast_model(self, routing, answering):
+        transport = answering("Dersaadet", "Large answer")
+        response = latinize_ocr_text(get_claude_client(), "درسعادت")
+
+        assert [request["model"] for request in transport.requests] == [FAST_MODEL]
+        assert analyze.extract_text_from_claude_response(response) == "Dersaadet"
+        assert analyze.routing_stats.stats()["latinization"]["escalated"] == 0
+
+    def test_failed_check_escalates(self, routing, answering):
+        transport = answering("Dersaadet bidayet", "Dersaadet\\n\nbidayet")
+        response = latinize_ocr_text(get_claude_client(), "درسعادت\nبدایت")
+
+        assert [request["model"] for request in transport.requests] == [FAST_MODEL, analyze.CLAUDE_MODEL]
+        assert analyze.extract_text_from_claude_response(response) == "Dersaadet\\n\nbidayet"
+        assert analyze.routing_stats.stats()["latinization"] == {"routed": 1, "escalated": 1,
+                                                                 "escalation_rate": 1.0}
+
+    def test_long_text_goes_to_the_large_model(self, routing, monkeypatch, answering):
+        monkeypatch.setattr(analyze, "ROUTING_MAX_INPUT_CHARACTERS", 5)
+        transport = answering("Fast answer", "Dersaadet")
+        latinize_ocr_text(get_claude_client(), "درسعادت")
+
+        assert [request["model"] for request in transport.requests] == [analyze.CLAUDE_MODEL]
+
+    def test_invalid_extraction_escalates(self, routing, answering):
+        transport = answering("{'appointments': []}", json.dumps({"appointments": [APPOINTMENT]}))
+        extracted = json.loads(extract_appointments(get_claude_client(), "Tevfik Bey'e"))
+
+        assert [request["model"] for request in transport.requests] == [FAST_MODEL, analyze.CLAUDE_MODEL]
+        assert extracted == {"appointments": [APPOINTMENT]}
+
+    def test_valid_extraction_is_kept(self, routing, answering):
+        transport = answering(json.dumps({"appointments": [APPOINTMENT]}), "Large answer")
+        extract_appointments(get_claude_client(), "Tevfik Bey'e")
+
+        assert [request["model"] for request in transport.requests] == [FAST_MODEL]
+
+    def test_routing_can_be_turned_off(self, answering):
+        transport = answering("Fast answer", "Dersaadet")
+        latinize_ocr_text(get_claude_client(), "درسعادت")
+
+        assert [request["model"] for request in transport.requests] == [analyze.CLAUDE_MODEL]
+
+
+class TestRoutedCaching:
+
+    def test_fast_latinization_is_cached_under_the_fast_model(self, routing, monkeypatch, answering):
+        transport = answering("Dersaadet", "Large answer")
+        response = latinize_ocr_text(get_claude_client(), "درسعادت")
+        assert response.model == FAST_MODEL
+
+        latinize_ocr_text(get_claude_client(), "درسعادت")
+        assert len(transport.requests) == 1
+
+        # Without routing, only answers of CLAUDE_MODEL are served.
+        monkeypatch.setattr(analyze, "MODEL_ROUTING", False)
+        response = latinize_ocr_text(get_claude_client(), "درسعادت")
+        assert [request["model"] for request in transport.requests] == [FAST_MODEL, analyze.CLAUDE_MODEL]
+        assert analyze.extract_text_from_claude_response(response) == "Large answer"
+
+    def test_fast_lines_are_not_used_for_texts_of_the_large_model(self, routing, monkeypatch, answering):
+        transport = answering("Dersaadet", "Dersaadet\\n\nbidayet")
+        latinize_ocr_text(get_claude_client(), "درسعادت")
+
+        monkeypatch.setattr(analyze, "ROUTING_MAX_INPUT_CHARACTERS", 10)
+        response = latinize_ocr_text(get_claude_client(), "درسعادت\nبدایت")
+
+        assert transport.requests[-1]["messages"][0]["content"].endswith("درسعادت\nبدایت")
+        assert response.model == analyze.CLAUDE_MODEL
+
+    def test_stitched_fast_lines_are_attributed_to_the_fast_model(self, routing, answering):
+        transport = answering("Dersaadet", "Large answer")
+        latinize_ocr_text(get_claude_client(), "درسعادت")
+        transport.responder = lambda body: "bidayet"
+
+        response = latinize_ocr_text(get_claude_client(), "درسعادت\nبدایت")
+
+        assert transport.requests[-1]["messages"][0]["content"].endswith("بدایت")
+        assert response.model == FAST_MODEL
+
+    def test_fast_block_extractions_are_cached_under_the_fast_model(self, routing, monkeypatch, answering):
+        answering(json.dumps({"appointments": [APPOINTMENT]}), "Large answer")
+        analyze.extract_block_batch(get_claude_client(), ["Tevfik Bey'e"])
+
+        assert analyze.cached_block_extraction("Tevfik Bey'e") == {"appointments": [APPOINTMENT]}
+        monkeypatch.setattr(analyze, "MODEL_ROUTING", False)
+        assert analyze.cached_block_extraction("Tevfik Bey'e") is None
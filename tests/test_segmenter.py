@@ -0,0 +1,35 @@
+from MobilityAnalyzer.segmenter import segment_appointments
+from tests.fake_claude import SAMPLE_TEXT
+
+
+class TestSegmenter:
+
+    def test_one_block_per_recipient(self):
+        blocks = segment_appointments(SAMPLE_TEXT)
+
+        assert len(blocks) == 6
+        assert blocks[0].startswith("Akçehisar kazâsı")
+        assert blocks[0].endswith("Mehmed Emin Efendi'ye")
+        assert blocks[1].startswith("kazâ-yı mezbûr")
+        assert blocks[-1].endswith("Tevfik Bey'e")
+
+    def test_blocks_cover_the_text(self):
+        """Nothing but the line breaks between the blocks is dropped."""
+        assert "\n".join(segment_appointments(SAMPLE_TEXT)) == SAMPLE_TEXT
+
+    def test_escaped_line_breaks_and_punctuation_are_trimmed(self):
+        blocks = segment_appointments("Selanik vilâyeti müstantıkı Ali Paşa'ya.\\n\nKonya Hasan Ağa'ya\\n\n")
+        assert blocks == ["Selanik vilâyeti müstantıkı Ali Paşa'ya", "Konya Hasan Ağa'ya"]
+
+    def test_unfinished_appointment_is_a_block(self):
+        """An appointment continued on the next page is kept as the last block."""
+        blocks = segment_appointments("Konya Hasan Bey'e Sivas vilâyeti merkez")
+        assert blocks == ["Konya Hasan Bey'e", "Sivas vilâyeti merkez"]
+
+    def test_titles_inside_words_do_not_split(self):
+        """Beyefendi or Efendinin do not end an appointment."""
+        assert segment_appointments("Beyefendi Efendinin mahkemesi") == ["Beyefendi Efendinin mahkemesi"]
+
+    def test_text_without_recipient(self):
+        assert segment_appointments("Dersaadet bidayet mahkemesi") == ["Dersaadet bidayet mahkemesi"]
+        assert segment_appointments("  \n") == []
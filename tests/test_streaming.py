@@ -0,0 +1,250 @@
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+
+from MobilityAnalyzer import analyze, analyze_async
+from MobilityAnalyzer.analyze import get_claude_client, stream_appointments, stream_latinization
+from MobilityAnalyzer.segmenter import segment_appointments
+from tests.fake_claude import (
+    LATINIZED_TEXT,
+    OCR_TEXT,
+    SAMPLE_TEXT,
+    extract_each_block,
+    latinize_line_by_line,
+    recipient,
+    upload
+)
+
+
+def parse_events(content: bytes) -> list:
+    """Splits a text/event-stream body into (event, data) tuples."""
+    events = []
+    for message in content.decode("utf-8").strip().split("\n\n"):
+        event, data = message.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+class TestStreamLatinization:
+
+    def test_text_is_yielded_chunk_by_chunk(self, fake_page):
+        """The first chunk is streamed as Claude generates it, and the others are yielded as soon as
+        they are latinized; the pieces add up to latinize_page."""
+        fake_page.responder = latinize_line_by_line
+        page = "\n".join(f"satır {number}" for number in range(5))
+
+        pieces = list(stream_latinization(get_claude_client(), page, max_lines=2))
+
+        assert len(pieces) > 3
+        streamed = [request["messages"][0]["content"] for request in fake_page.requests if request.get("stream")]
+        assert len(fake_page.requests) == 3
+        assert len(streamed) == 1 and streamed[0].endswith("satır 0\nsatır 1")
+        assert "".join(pieces) == analyze.extract_text_from_claude_response(
+            analyze.latinize_page(get_claude_client(), page, 2))
+
+    def test_short_text_is_streamed(self, fake_page):
+        """A page of one chunk is streamed too, by CLAUDE_MODEL, which needs no quality check."""
+        pieces = list(stream_latinization(get_claude_client(), OCR_TEXT))
+
+        assert len(pieces) > 1
+        assert "".join(pieces) == LATINIZED_TEXT
+        assert [(request["model"], request["stream"]) for request in fake_page.requests] == \
+            [(analyze.CLAUDE_MODEL, True)]
+
+    def test_line_breaks_are_held_back(self, fake_page):
+        """A piece never ends with a line break, which may be incomplete, or dropped at the end of the answer."""
+        fake_page.responder = lambda body: "Dersaadet\\n\nbidayet\\n\n\\n\nmahkemesi\\n\n"
+
+        pieces = list(stream_latinization(get_claude_client(), "درسعادت\nبدایت\n\nمحکمهسی"))
+
+        assert not any(piece.endswith(("\\", "\\n", "\n")) for piece in pieces)
+        assert "".join(pieces) == "Dersaadet\\n\nbidayet\\n\n\\n\nmahkemesi"
+
+    def test_chunks_are_cached_and_remembered(self, fake_page):
+        """Streamed chunks are cached, and their lines are served from the translation memory."""
+        list(stream_latinization(get_claude_client(), OCR_TEXT))
+        assert list(stream_latinization(get_claude_client(), OCR_TEXT)) == [LATINIZED_TEXT]
+        assert len(fake_page.requests) == 1
+        assert analyze.translation_memory.stats()["entries"] == 2
+
+        fake_page.responder = lambda body: "Yeni satır"
+        pieces = list(stream_latinization(get_claude_client(), OCR_TEXT + "\nیکی سطر"))
+
+        assert pieces == [LATINIZED_TEXT + "\\n\nYeni satır"]
+        assert fake_page.requests[-1]["messages"][0]["content"].endswith("\nیکی سطر".strip())
+
+
+class TestStreamingView:
+
+    def test_ocr_is_sent_before_the_latinization(self, client, fake_page):
+        response = client.post(reverse("ocr_and_latinize_image_stream"), upload())
+
+        assert response["Content-Type"] == "text/event-stream"
+        events = parse_events(b"".join(response.streaming_content))
+        assert events[0] == ("ocr", {"OCR": OCR_TEXT})
+        assert [event for event, _ in events[1:-1]] == ["latinized"] * (len(events) - 2)
+        assert "".join(data["text"] for _, data in events[1:-1]) == LATINIZED_TEXT
+        assert events[-1] == ("done", {})
+
+    def test_events_are_streamed_under_asgi(self, async_client, fake_page, monkeypatch, fake_claude):
+        """Under ASGI the page goes through analyze_async on the event loop, and the response
+        iterates asynchronously, so Django does not buffer it."""
+        async def ocr(image_content):
+            return OCR_TEXT
+        monkeypatch.setattr(analyze_async, "document_ai_ocr_content", ocr)
+        async_transport = fake_claude(lambda body: LATINIZED_TEXT, asynchronous=True)
+
+        @async_to_sync
+        async def post():
+            response = await async_client.post(reverse("ocr_and_latinize_image_stream"), upload())
+            return response, b"".join([part async for part in response.streaming_content])
+        response, content = post()
+
+        assert response.is_async
+        events = parse_events(content)
+        assert events[0] == ("ocr", {"OCR": OCR_TEXT})
+        assert len(events) > 3
+        assert "".join(data["text"] for _, data in events[1:-1]) == LATINIZED_TEXT
+        assert events[-1] == ("done", {})
+        assert (len(async_transport.requests), len(fake_page.requests)) == (1, 0)
+
+    def test_page_streams_only_under_asgi(self, client, async_client):
+        """Under WSGI the page queues the image for the page worker instead of holding a thread."""
+        assert b"const streamPages = false;" in client.get(reverse("index")).content
+        assert b"const streamPages = true;" in async_to_sync(async_client.get)(reverse("index")).content
+
+    def test_failure_is_reported_as_an_event(self, client, fake_page, monkeypatch):
+        def failing_ocr(image_content):
+            raise Exception("Document AI is unavailable.")
+        monkeypatch.setattr(analyze, "document_ai_ocr_content", failing_ocr)
+
+        events = parse_events(b"".join(client.post(reverse("ocr_and_latinize_image_stream"),
+                                                   upload()).streaming_content))
+        assert events == [("error", {"message": "Failed to OCR and Latinize the document."
+                                                "Document AI is unavailable."})]
+
+    def test_missing_file(self, client):
+        response = client.post(reverse("ocr_and_latinize_image_stream"))
+        assert response.status_code == 400
+
+    def test_upload_is_not_written_to_disk(self, client, fake_page, monkeypatch, tmp_path):
+        working_directory = tmp_path / 'cwd'
+        working_directory.mkdir()
+        monkeypatch.chdir(working_directory)
+        response = client.post(reverse("ocr_and_latinize_image_stream"), upload())
+
+        assert parse_events(b"".join(response.streaming_content))[-1] == ("done", {})
+        assert list(working_directory.iterdir()) == []
+
+    def test_other_files_are_rejected(self, client):
+        response = client.post(reverse("ocr_and_latinize_image_stream"),
+                               {"file": SimpleUploadedFile("page.png", b"GIF89a", content_type="image/png")})
+        assert response.status_code == 400
+
+
+APPOINTMENTS = [
+    {"name": "Mehmed Emin Efendi", "fromCity": "Manastır", "toCity": "Akçehisar"},
+    {"name": "Tevfik Bey", "fromCity": "Seydişehir", "toCity": "Tiran"},
+]
+
+
+@pytest.fixture
+def extraction_transport(fake_claude):
+    """Claude answers every extraction with APPOINTMENTS, in a code fence."""
+    return fake_claude(
+        lambda body: "```json\n" + json.dumps({"appointments": APPOINTMENTS}, ensure_ascii=False) + "\n```")
+
+
+class TestStreamingExtraction:
+
+    def test_appointments_are_yielded_in_order(self, extraction_transport):
+        appointments = list(stream_appointments(get_claude_client(), "Mehmed Emin Efendi'ye"))
+
+        assert appointments == APPOINTMENTS
+
+    def test_appointments_are_yielded_before_the_answer_ends(self, extraction_transport):
+        """A text of a single batch is streamed too, appointment by appointment."""
+        appointments = stream_appointments(get_claude_client(), "Mehmed Emin Efendi'ye")
+
+        assert next(appointments) == APPOINTMENTS[0]
+        [stream] = extraction_transport.streams
+        assert stream.read < len(stream.events)
+        assert list(appointments) == APPOINTMENTS[1:]
+        assert stream.read == len(stream.events)
+
+    def test_blocks_after_a_malformed_appointment_are_retried(self, fake_claude):
+        """The appointments streamed before Claude's answer broke are kept, and the next blocks retried one by one."""
+        blocks = segment_appointments(SAMPLE_TEXT)
+
+        def broken_after_the_first_block(body):
+            answer = extract_each_block(body)
+            if len(segment_appointments(body["messages"][0]["content"])) == 1:
+                return answer
+            return answer[:answer.index("}") + 1] + ", {'name': 'single quotes'}]}"
+        transport = fake_claude(broken_after_the_first_block)
+
+        appointments = list(stream_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=len(blocks)))
+
+        assert appointments == [{"name": recipient(block)} for block in blocks]
+        assert len(transport.requests) == len(blocks)
+
+    def test_batches_are_streamed_and_cached(self, fake_claude):
+        """A long text is extracted in batches of blocks, and cached blocks are not sent again."""
+        transport = fake_claude(extract_each_block)
+        appointments = stream_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=2)
+        first = next(appointments)
+        assert first == {"name": recipient(segment_appointments(SAMPLE_TEXT)[0])}
+        assert [first, *appointments] == [{"name": recipient(block)} for block in segment_appointments(SAMPLE_TEXT)]
+        assert len(transport.requests) == 3
+
+        list(stream_appointments(get_claude_client(), SAMPLE_TEXT, batch_blocks=2))
+        assert len(transport.requests) == 3
+
+    def test_streaming_view(self, client, extraction_transport):
+        response = client.post(reverse("extract_appointment_data_stream"),
+                               json.dumps({"text": "Mehmed Emin Efendi'ye"}), content_type="application/json")
+
+        events = parse_events(b"".join(response.streaming_content))
+        assert events == [("appointment", APPOINTMENTS[0]), ("appointment", APPOINTMENTS[1]), ("done", {})]
+
+    def test_streaming_view_under_asgi(self, async_client, fake_claude):
+        transport = fake_claude(extract_each_block, asynchronous=True)
+
+        @async_to_sync
+        async def post():
+            response = await async_client.post(reverse("extract_appointment_data_stream"),
+                                               json.dumps({"text": SAMPLE_TEXT}), content_type="application/json")
+            return response, b"".join([part async for part in response.streaming_content])
+        response, content = post()
+
+        assert response.is_async
+        assert parse_events(content) == [*(("appointment", {"name": recipient(block)})
+                                           for block in segment_appointments(SAMPLE_TEXT)), ("done", {})]
+        assert len(transport.requests) == 2
+
+    def test_invalid_appointment_is_skipped(self, client, fake_claude):
+        """Like extract_appointments, a block Claude cannot extract is skipped."""
+        fake_claude(lambda body: "{\"appointments\": [{'name': 'Tevfik Bey'}]}")
+        response = client.post(reverse("extract_appointment_data_stream"),
+                               json.dumps({"text": "Tevfik Bey'e"}), content_type="application/json")
+        events = parse_events(b"".join(response.streaming_content))
+
+        assert events == [("done", {})]
+
+    def test_failure_is_reported(self, client, fake_claude):
+        def unavailable(body):
+            raise Exception("Overloaded.")
+        fake_claude(unavailable)
+        response = client.post(reverse("extract_appointment_data_stream"),
+                               json.dumps({"text": "Tevfik Bey'e"}), content_type="application/json")
+        events = parse_events(b"".join(response.streaming_content))
+
+        assert events == [("error", {"message": "Failed to extract the appointment data using Claude."})]
+
+    def test_invalid_request(self, client):
+        response = client.post(reverse("extract_appointment_data_stream"), "not json",
+                               content_type="application/json")
+        assert response.status_code == 400